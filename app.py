@@ -1,51 +1,130 @@
 import os
+from datetime import timedelta
 
 from flask import Flask
-from flask_migrate import Migrate
 from flask_restful import Api
-from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+from config import database_config, mpesa_config
 from models import db
-from routes.users import UserResource, UserSignup, LoginResource
-from routes.category import CategoryResource
-from routes.event import EventResource
-from routes.ticket import TicketResource
-
-# load the environment variables from our .env file
-# and makes them available to our application
-load_dotenv()
-
-app = Flask(__name__)
-
-# link flask + flask-restful
-api = Api(app)
-# link flask + flask-bcrypt
-bcrypt = Bcrypt(app)
-# link flask + flask-jwt-extended
-jwt = JWTManager(app)
-# link cors + flask
-CORS(app)
-
-# provide database config
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///tickets.db"
-# enable query logging
-app.config["SQLALCHEMY_ECHO"] = True
-
-app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
-# app.config["JWT_ACCESS_TOKEN_EXPIRES"] =
-
-# create a migration object to manage migrations
-migrate = Migrate(app, db)
-
-# link our db to the flask instance
-db.init_app(app)
-
-api.add_resource(UserResource, "/users")
-api.add_resource(UserSignup, "/sign-up")
-api.add_resource(LoginResource, "/login")
-api.add_resource(CategoryResource, "/categories")
-api.add_resource(EventResource, "/events", "/events/<int:id>")
-api.add_resource(TicketResource, "/tickets")
+from services.auth import revocations
+from services.database import configure_engines
+from services.cache import response_cache
+from services.passwords import password_hasher
+from services.ratelimit import rate_limiter
+from services.search import exclude_search_tables
+from services.metrics import metrics
+from services.representations import register_representations
+from services.stats import stats_cli
+from services.mpesa import mpesa
+from services.payments import payments_cli
+from services.waitingroom import waiting_room
+from routes.urls import register_routes
+
+
+def create_app(config=None, migrations=None):
+    """
+    Builds the app. config overrides anything read from the environment.
+
+    migrations: set up flask-migrate (the "flask db" commands). It pulls in alembic,
+    which takes longer to import than the rest of the app, and only the CLI needs it,
+    so by default it's only loaded when the app is started by the flask command.
+    """
+    # load the environment variables from our .env file
+    # and makes them available to our application
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    # provide database config (see config.py for the environment variables)
+    app.config.from_mapping(database_config())
+    # M-Pesa credentials and callback url (see config.py)
+    app.config.from_mapping(mpesa_config())
+
+    app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
+    # without this flask-restful turns the jwt errors (missing, expired, revoked token)
+    # into a 500 before flask-jwt-extended can answer them with a 401
+    app.config["PROPAGATE_EXCEPTIONS"] = True
+    # access tokens are short lived, clients get new ones from POST /refresh
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(
+        minutes=int(os.environ.get("JWT_ACCESS_TOKEN_MINUTES", 15))
+    )
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(
+        days=int(os.environ.get("JWT_REFRESH_TOKEN_DAYS", 30))
+    )
+
+    # catalog response cache, set CACHE_URL=redis://... to share it between workers
+    app.config["CACHE_URL"] = os.environ.get("CACHE_URL")
+
+    # bcrypt runs on its own bounded pool, the cost is calibrated to BCRYPT_TARGET_MS unless set
+    if os.environ.get("BCRYPT_LOG_ROUNDS"):
+        app.config["BCRYPT_LOG_ROUNDS"] = int(os.environ["BCRYPT_LOG_ROUNDS"])
+
+    # login, signup and waiting room joins per IP and per account, set RATELIMIT_URL=redis://... to share them between workers
+    app.config["RATELIMIT_URL"] = os.environ.get("RATELIMIT_URL")
+    app.config["WAITING_ROOM_URL"] = os.environ.get("WAITING_ROOM_URL")
+
+    # per route latency, SQL and serialization metrics at /metrics
+    # set SLOW_REQUEST_MS to log slow requests along with their SQL
+    if os.environ.get("SLOW_REQUEST_MS"):
+        app.config["SLOW_REQUEST_MS"] = int(os.environ["SLOW_REQUEST_MS"])
+
+    if config:
+        app.config.update(config)
+
+    # link flask + flask-restful
+    api = Api(app)
+    # link flask + flask-jwt-extended
+    JWTManager(app)
+    # link cors + flask
+    CORS(app)
+
+    # link our db to the flask instance
+    db.init_app(app)
+    # sqlite pragmas (WAL etc.) on every new connection
+    configure_engines(app, db)
+
+    if migrations is None:
+        # the flask command sets this before it loads the app
+        migrations = os.environ.get("FLASK_RUN_FROM_CLI") == "true"
+
+    if migrations:
+        from flask_migrate import Migrate
+
+        # create a migration object to manage migrations
+        # the search index tables are managed by hand, see services/search.py
+        Migrate(app, db, include_object=exclude_search_tables)
+
+    # logged out tokens are checked against an in-memory filter of the revoked_tokens table
+    revocations.init_app(app)
+    response_cache.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    mpesa.init_app(app)
+    # on-sale queues, set WAITING_ROOM_URL=redis://... to share them between workers
+    waiting_room.init_app(app)
+
+    register_routes(api)
+
+    # flask stats reconcile, recomputes the sales aggregates from the base tables
+    app.cli.add_command(stats_cli)
+    # flask payments work, the workers that talk to M-Pesa (see services/payments.py)
+    app.cli.add_command(payments_cli)
+
+    metrics.init_app(app)
+    # orjson for JSON, MessagePack for clients that ask for it (see services/representations.py)
+    register_representations(app, api)
+
+    return app
+
+
+def __getattr__(name):
+    # "from app import app" and servers pointed at app:app still work,
+    # the app is only built the first time it's asked for
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,185 @@
+"""
+ASGI entry point, for serving with an async server:
+
+    uvicorn asgi:create_asgi_app --factory --workers 4
+
+The threaded server gives every open connection a thread, and that thread sits idle
+while its query runs. Under many concurrent, mostly idle or slow clients the threads
+run out long before the CPU does. Here the busiest read paths are native async
+routes: a request waiting on the database is a suspended coroutine, not a blocked
+thread, so one process holds far more connections at once.
+
+    GET /events            the listing, the same filters, cursors and ?fields= (not ?ids=)
+    GET /events/<id>
+    GET /categories
+
+They build their statements with the same functions as the Flask resources
+(routes/event.py, routes/category.py), run them on an async engine (services/aio.py)
+and shape the rows with the same serializers. Serializing and encoding run on a
+small thread pool so they don't stall the event loop. Responses go through the same
+response cache, a page cached by one mode is served by the other, ETags and 304s
+included.
+
+Everything else, writes, logins, admin and the rest, is the Flask app itself behind
+a WSGI bridge (a2wsgi), on a pool of ASGI_WSGI_THREADS threads (10 by default).
+bcrypt keeps running on the password hasher's own pool there.
+
+Request metrics only count the requests that go through Flask.
+"""
+
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags
+
+from app import create_app
+from routes.category import categories_statement, category_list
+from routes.event import event_statement, events_page, events_page_statement, serialize_event
+from services.aio import async_db
+from services.cache import make_entry, response_cache
+from services.representations import encode, negotiate, representation_etag
+
+
+class CatalogRoute:
+    """
+    An async route that can hand a request over to the Flask app. The handler returns
+    (data, status, headers) like a Resource method, or None to let Flask answer.
+    """
+
+    def __init__(self, handler, namespace, fallback, config):
+        self.handler = handler
+        self.namespace = namespace
+        self.fallback = fallback
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        request = Request(scope, receive)
+        response = await self.respond(request)
+
+        if response is None:
+            await self.fallback(scope, receive, send)
+        else:
+            await response(scope, receive, send)
+
+    async def respond(self, request):
+        # the same negotiation as flask_restful, JSON unless msgpack is asked for
+        mediatype = negotiate(parse_accept_header(request.headers.get("accept"), MIMEAccept))
+
+        if not response_cache.enabled:
+            result = await self.handler(request)
+            return None if result is None else await self.render(mediatype, *result)
+
+        # the same key @response_cache.cached uses, request.full_path in werkzeug
+        full_path = f"{request.scope['path']}?{request.scope['query_string'].decode()}"
+        key = response_cache.key(self.namespace, full_path)
+        entry = response_cache.backend.get(key)
+
+        if entry is None:
+            result = await self.handler(request)
+
+            if result is None:
+                return None
+
+            data, status, headers = result
+
+            if status != 200:
+                return await self.render(mediatype, data, status, headers)
+
+            entry = await async_db.offload(make_entry, data, headers)
+            response_cache.backend.set(key, entry)
+
+        etag = representation_etag(entry["etag"], mediatype)
+
+        if parse_etags(request.headers.get("if-none-match")).contains(etag):
+            return Response(status_code=304, headers={"ETag": f'"{etag}"', "Vary": "Accept"})
+
+        return await self.render(mediatype, entry["data"], 200, {**entry["headers"], "ETag": f'"{etag}"'})
+
+    async def render(self, mediatype, data, status, headers):
+        body = await async_db.offload(encode, data, mediatype, self.config["JSON_ENCODER"])
+
+        headers = {
+            **headers,
+            "Vary": "Accept",
+            # what flask-cors adds to every Flask response
+            "Access-Control-Allow-Origin": "*",
+        }
+
+        return Response(body, status_code=status, headers=headers, media_type=mediatype)
+
+
+async def list_events(request):
+    if request.query_params.get("ids"):
+        # the bulk lookup by id stays on the Flask side
+        return None
+
+    try:
+        statement, fields, limit = events_page_statement(request.query_params)
+    except ValueError as e:
+        return {"message": str(e)}, 400, {}
+
+    async with async_db.session() as session:
+        result = await session.execute(statement)
+
+    return await async_db.offload(events_page, result, fields, limit)
+
+
+async def get_event(request):
+    async with async_db.session() as session:
+        event = (await session.execute(event_statement(request.path_params["id"]))).scalar()
+
+    if event is None:
+        return {"message": "Event not found"}, 404, {}
+
+    return await async_db.offload(serialize_event, event), 200, {}
+
+
+async def list_categories(request):
+    async with async_db.session() as session:
+        result = await session.execute(categories_statement())
+
+    return await async_db.offload(category_list, result), 200, {}
+
+
+def create_asgi_app(config=None):
+    """The Flask app (built with create_app(config)) with the async catalog routes in front"""
+    flask_app = create_app(config)
+    flask_app.config.setdefault("ASGI_WSGI_THREADS", 10)
+    async_db.init_app(flask_app)
+
+    flask = WSGIMiddleware(flask_app, workers=flask_app.config["ASGI_WSGI_THREADS"])
+
+    def catalog(handler, namespace):
+        return CatalogRoute(handler, namespace, flask, flask_app.config)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await async_db.dispose()
+
+    routes = [
+        Route("/events", catalog(list_events, "events"), methods=["GET"]),
+        Route("/events/{id:int}", catalog(get_event, "events"), methods=["GET"]),
+        Route("/categories", catalog(list_categories, "categories"), methods=["GET"]),
+        # anything else, and the other methods on the paths above, is the Flask app's
+        Mount("/", app=flask),
+    ]
+
+    app = Starlette(routes=routes, lifespan=lifespan)
+    app.state.flask_app = flask_app
+
+    return app
+
+
+def __getattr__(name):
+    # "uvicorn asgi:app" works too, built on first use like app:app
+    if name == "app":
+        globals()["app"] = create_asgi_app()
+        return globals()["app"]
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,281 @@
+"""
+How many concurrent connections the catalog holds up under, threaded vs ASGI (asgi.py).
+
+Seeds a throwaway database, then for each server and each --concurrency level has
+that many clients at once browse the catalog (GET /events pages, single events, /categories) for --seconds:
+
+    threaded   the werkzeug server, one thread per connection (what load_test.py --mode wsgi uses)
+    asgi       uvicorn running asgi.py, the catalog as async routes (needs uvicorn, starlette,
+               a2wsgi and the async driver, aiosqlite here)
+
+Each server runs in a process of its own so the client doesn't share its GIL. For
+every level it prints the throughput, p50/p99 latency, the connections that never
+got an answer or failed, and the most threads and RSS the server reached. The threaded
+server's threads grow with the connections, the ASGI one's stay put.
+
+sqlite answers in microseconds, so on the default database both servers are mostly
+CPU bound. The gap shows once the queries have to wait on the network, point
+--database-url at a postgres on another host to see it.
+
+    python benchmarks/async_capacity.py --concurrency 50,200,500
+    python benchmarks/async_capacity.py --servers threaded --seconds 5
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from common import api_config, base_parser, make_api_app, reset_database, temp_sqlite_url
+from load_test import percentile
+from seed import seed
+
+SERVERS = ("threaded", "asgi")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args):
+    """The server process, runs until it's terminated"""
+    config = api_config(args.database_url, args.cache)
+
+    if args.child == "threaded":
+        from werkzeug.serving import make_server
+
+        from load_test import QuietHandler
+
+        app = make_api_app(args.database_url, args.cache)
+        make_server("127.0.0.1", args.port, app, threaded=True, request_handler=QuietHandler).serve_forever()
+    else:
+        import uvicorn
+
+        from asgi import create_asgi_app
+
+        uvicorn.run(
+            create_asgi_app(config),
+            host="127.0.0.1",
+            port=args.port,
+            log_level="warning",
+            access_log=False,
+            # the same backlog as the werkzeug server, so neither turns connections away sooner
+            backlog=128,
+        )
+
+
+def start_server(args, name):
+    port = free_port()
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        name,
+        "--port",
+        str(port),
+        "--database-url",
+        args.database_url,
+    ]
+    if args.cache:
+        command.append("--cache")
+
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 30
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the {name} server exited with {process.returncode}")
+
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError(f"the {name} server didn't start")
+
+
+def process_stats(pid):
+    """(threads, RSS in MB) of a process, from /proc, so None on anything but linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return None, None
+
+    return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) / 1024
+
+
+async def get(reader, writer, path):
+    """One GET, (status, whether the connection stays open)"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept: application/json\r\n\r\n".encode())
+    await writer.drain()
+
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    await reader.readexactly(int(headers.get("content-length", 0)))
+
+    return int(lines[0].split()[1]), headers.get("connection", "").lower() != "close"
+
+
+async def connect(port):
+    return await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout=10)
+
+
+async def browse(port, events, deadline, latencies, outcomes, rng):
+    """
+    One client, requests back to back until the deadline. It keeps its connection
+    open, or opens a new one when the server closes it (the werkzeug server closes
+    after every response, ASGI servers keep it alive).
+    """
+    try:
+        reader, writer = await connect(port)
+    except (OSError, asyncio.TimeoutError):
+        outcomes["refused"] += 1
+        return
+
+    answered = False
+
+    try:
+        while time.monotonic() < deadline:
+            if writer.is_closing():
+                reader, writer = await connect(port)
+
+            roll = rng.random()
+
+            if roll < 0.5:
+                path = "/events?limit=20&status=active" if rng.random() < 0.3 else "/events?limit=20"
+            elif roll < 0.9:
+                path = f"/events/{rng.randint(1, events)}"
+            else:
+                path = "/categories"
+
+            start = time.perf_counter()
+            status, keep_alive = await asyncio.wait_for(get(reader, writer, path), timeout=30)
+            latencies.append(time.perf_counter() - start)
+            answered = True
+
+            if not keep_alive:
+                writer.close()
+
+            if status != 200:
+                outcomes["errors"] += 1
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+        outcomes["errors"] += 1
+    finally:
+        writer.close()
+
+    if not answered:
+        outcomes["unanswered"] += 1
+
+
+async def watch(pid, peak, stop):
+    """The most threads and RSS the server reaches while the clients are connected"""
+    while not stop.is_set():
+        threads, rss = process_stats(pid)
+
+        if threads is not None:
+            peak["threads"] = max(peak.get("threads", 0), threads)
+            peak["rss_mb"] = max(peak.get("rss_mb", 0), rss)
+
+        await asyncio.sleep(0.2)
+
+
+async def run_level(port, pid, events, connections, seconds):
+    latencies = []
+    peak = {}
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch(pid, peak, stop))
+    outcomes = {"refused": 0, "unanswered": 0, "errors": 0}
+    deadline = time.monotonic() + seconds
+    rng = random.Random(connections)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            browse(port, events, deadline, latencies, outcomes, random.Random(rng.random()))
+            for _ in range(connections)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await watcher
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "threads": peak.get("threads"),
+        "rss_mb": peak.get("rss_mb"),
+        **outcomes,
+    }
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--scale", type=float, default=0.2)
+    parser.add_argument("--concurrency", default="50,200,500")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--cache", action="store_true", help="with the response cache on")
+    # set when the script runs itself as one of the servers
+    parser.add_argument("--child", choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        serve(args)
+        return
+
+    args.database_url = args.database_url or temp_sqlite_url()
+    app = make_api_app(args.database_url)
+    reset_database(app)
+    events = seed(app, args.scale)["events"]
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    for name in args.servers.split(","):
+        if name not in SERVERS:
+            parser.error(f"unknown server {name}, use: {', '.join(SERVERS)}")
+
+        process, port = start_server(args, name)
+
+        print(f"\n{name} ({args.seconds:g}s per level)")
+        print(
+            f"{'conns':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>9}"
+            f" {'refused':>8} {'no answer':>10} {'errors':>7} {'threads':>8} {'RSS MB':>7}"
+        )
+
+        try:
+            for connections in levels:
+                result = asyncio.run(run_level(port, process.pid, events, connections, args.seconds))
+                threads, rss = result["threads"], result["rss_mb"]
+                print(
+                    f"{connections:>6} {result['throughput']:>8.0f} {result['p50_ms']:>8.1f}"
+                    f" {result['p99_ms']:>9.1f} {result['refused']:>8} {result['unanswered']:>10}"
+                    f" {result['errors']:>7} {threads if threads is not None else '-':>8}"
+                    f" {f'{rss:.0f}' if rss is not None else '-':>7}"
+                )
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
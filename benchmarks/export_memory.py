@@ -0,0 +1,168 @@
+"""
+Peak memory of exporting a big users table, the old way and streamed (services/export.py).
+
+Fills a throwaway database with --rows users (1M by default, that takes a minute),
+then exports them all in a fresh process per mode, so each one starts from the same
+baseline and the peak RSS is that mode's alone:
+
+    list     what GET /users used to do: User.query.all(), a list of dicts, one json.dumps
+    json     GET /users streamed as a JSON array, --batch-size rows at a time
+    ndjson   GET /users?format=ndjson, one user per line
+
+Prints the time to the first byte, the total time and how much the peak RSS grew.
+The list mode grows with the table, the streamed ones stay at a few MB. sqlite's
+mmap is turned off in the exporting process, otherwise the pages of the database
+file it has read count towards the RSS too, in every mode.
+
+    python benchmarks/export_memory.py --rows 1000000
+    python benchmarks/export_memory.py --rows 200000 --modes json,ndjson --batch-size 5000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from sqlalchemy import insert
+
+from common import base_parser, make_api_app, reset_database, temp_sqlite_url
+from models import User, db
+
+INSERT_BATCH = 20000
+
+
+def fill(database_url, rows):
+    app = make_api_app(database_url)
+    reset_database(app)
+
+    with app.app_context():
+        for start in range(0, rows, INSERT_BATCH):
+            db.session.execute(
+                insert(User),
+                [
+                    {
+                        "name": f"User {i}",
+                        "phone": f"+2547{i:08d}",
+                        "email": f"user{i}@example.com",
+                        "role": "admin" if i == 0 else "user",
+                        "password": "not-a-real-hash",
+                    }
+                    for i in range(start, min(start + INSERT_BATCH, rows))
+                ],
+            )
+        db.session.commit()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def child(args):
+    from flask_jwt_extended import create_access_token
+    from flask_restful.representations.json import output_json
+
+    from routes.users import serialize_user
+    from services.serializer import serialize_all
+
+    app = make_api_app(args.database_url, EXPORT_BATCH_SIZE=args.batch_size, SQLITE_MMAP_SIZE=0)
+
+    with app.app_context():
+        token = create_access_token(identity="1", additional_claims={"role": "admin"})
+
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    # one small request first so the imports and the first connection are in the baseline
+    client.get("/users?format=ndjson", headers=headers).close()
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    first_byte = None
+    size = 0
+
+    if args.child == "list":
+        with app.test_request_context("/users"):
+            users = User.query.all()
+            body = output_json(serialize_all(serialize_user, users), 200).get_data()
+            first_byte = time.perf_counter()
+            size = len(body)
+            del users, body
+    else:
+        path = "/users" if args.child == "json" else "/users?format=ndjson"
+        response = client.get(path, headers=headers)
+
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter()
+            size += len(chunk)
+
+        response.close()
+
+    elapsed = time.perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "first_byte_ms": ((first_byte or time.perf_counter()) - start) * 1000,
+                "seconds": elapsed,
+                "peak_growth_mb": peak_rss_mb() - baseline,
+                "bytes": size,
+            }
+        )
+    )
+
+
+def run_child(args, mode):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        mode,
+        "--database-url",
+        args.database_url,
+        "--batch-size",
+        str(args.batch_size),
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} export failed:\n{result.stderr}")
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--modes", default="list,json,ndjson")
+    # set when the script runs itself for one mode
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    args.database_url = args.database_url or temp_sqlite_url()
+
+    start = time.perf_counter()
+    fill(args.database_url, args.rows)
+    print(f"{args.rows} users inserted in {time.perf_counter() - start:.1f}s")
+
+    print(f"\n{'mode':8} {'first byte ms':>14} {'total s':>9} {'peak RSS +MB':>13} {'MB out':>8}")
+
+    for mode in args.modes.split(","):
+        result = run_child(args, mode)
+        print(
+            f"{mode:8} {result['first_byte_ms']:>14.1f} {result['seconds']:>9.2f}"
+            f" {result['peak_growth_mb']:>13.1f} {result['bytes'] / 1024 / 1024:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+Load test for the API, the numbers to compare from one commit to the next.
+
+Seeds a fresh database (see seed.py) and runs each scenario with a pool of client
+threads, first against the app in-process through the Flask test client (our code
+only) and then over HTTP against a local WSGI server (adds sockets and the server).
+
+    catalog_browse  GET /events pages, single events, categories and search
+    login_storm     POST /login for random existing users
+    signup_burst    POST /sign-up with new users
+    checkout_rush   POST /checkout, everyone buying the same few ticket types
+
+For every scenario it prints p50/p95/p99 latency and throughput. Save a run with
+--output and compare a later one against it with --compare:
+
+    python benchmarks/load_test.py --output before.json
+    python benchmarks/load_test.py --compare before.json
+    python benchmarks/load_test.py --mode wsgi --scenario login_storm --threads 32
+"""
+
+import http.client
+import json
+import math
+import platform
+import random
+import subprocess
+import threading
+import time
+from itertools import count
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import select, update
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from common import base_parser, make_api_app, reset_database, temp_sqlite_url
+from models import Ticket, User, db
+from seed import SEED_PASSWORD, seed
+
+# statuses that are a normal answer for the scenario, anything else counts as an error
+EXPECTED = {
+    "catalog_browse": {200},
+    "login_storm": {200},
+    "signup_burst": {201},
+    # running out of stock half way through the rush is the point of the scenario
+    "checkout_rush": {201, 409},
+}
+
+SEARCH_TERMS = ("jazz", "comedy", "nairobi", "summit", "festival", "gospel", "naiv")
+
+# tickets everyone goes for in the checkout rush, with little enough stock
+# that they sell out part way through the default run
+HOT_TICKETS = 8
+HOT_STOCK = 200
+
+
+class Context:
+    """What the scenarios need to know about the seeded data"""
+
+    def __init__(self, app, totals):
+        self.users = totals["users"]
+        self.events = totals["events"]
+        self.signups = count()
+        self.payments = count()
+
+        with app.app_context():
+            self.hot_tickets = db.session.execute(
+                select(Ticket.id).order_by(Ticket.id).limit(HOT_TICKETS)
+            ).scalars().all()
+            db.session.execute(
+                update(Ticket).where(Ticket.id.in_(self.hot_tickets)).values(tickets_available=HOT_STOCK)
+            )
+            db.session.commit()
+
+            # tokens are made up front, the checkout rush shouldn't also be a login storm
+            user_ids = db.session.execute(select(User.id).limit(500)).scalars().all()
+            self.tokens = [
+                create_access_token(identity=str(user_id), additional_claims={"role": "user"})
+                for user_id in user_ids
+            ]
+
+
+def catalog_browse(ctx, rng):
+    choice = rng.random()
+
+    if choice < 0.5:
+        params = "limit=20"
+        if rng.random() < 0.3:
+            params += "&status=active"
+        return "GET", f"/events?{params}", None, {}
+    if choice < 0.8:
+        return "GET", f"/events/{rng.randint(1, ctx.events)}", None, {}
+    if choice < 0.9:
+        return "GET", "/categories", None, {}
+    return "GET", f"/events/search?q={rng.choice(SEARCH_TERMS)}", None, {}
+
+
+def login_storm(ctx, rng):
+    user = rng.randrange(ctx.users)
+    return "POST", "/login", {"email": f"user{user}@example.com", "password": SEED_PASSWORD}, {}
+
+
+def signup_burst(ctx, rng):
+    n = next(ctx.signups)
+    body = {
+        "name": f"New User {n}",
+        # seeded users are +2547 00..., new ones +2547 2...
+        "phone": f"+25472{n:07d}",
+        "email": f"new{n}@example.com",
+        "password": SEED_PASSWORD,
+    }
+    return "POST", "/sign-up", body, {}
+
+
+def checkout_rush(ctx, rng):
+    items = [
+        {"ticket_id": ticket_id, "quantity": rng.randint(1, 2)}
+        for ticket_id in rng.sample(ctx.hot_tickets, rng.randint(1, 2))
+    ]
+    body = {"items": items}
+    headers = {"Authorization": f"Bearer {rng.choice(ctx.tokens)}"}
+    return "POST", "/checkout", body, headers
+
+
+SCENARIOS = {
+    "catalog_browse": catalog_browse,
+    "login_storm": login_storm,
+    "signup_burst": signup_burst,
+    "checkout_rush": checkout_rush,
+}
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body, headers):
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class HTTPClient:
+    """One keep-alive connection per client thread, like a browser or a load balancer would use"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = http.client.HTTPConnection(host, port)
+
+    def request(self, method, path, body, headers):
+        headers = dict(headers)
+        payload = None
+
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            # count it as an error and start over on a fresh connection
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port)
+            return 0
+
+    def close(self):
+        self.connection.close()
+
+
+class QuietHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log(self, type, message, *args):
+        pass
+
+
+class LocalServer:
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+    def client(self):
+        return HTTPClient("127.0.0.1", self.server.server_port)
+
+
+def percentile(ordered, p):
+    # nearest rank, ordered must be sorted
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(name, latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    errors = sum(1 for status in statuses if status not in EXPECTED[name])
+    by_status = {}
+
+    for status in statuses:
+        by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "statuses": by_status,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def run_scenario(name, ctx, make_client, threads, requests, warmup):
+    scenario = SCENARIOS[name]
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(threads + 1)
+    per_thread = max(1, requests // threads)
+
+    def worker(number):
+        rng = random.Random(f"{name}-{number}")
+        client = make_client()
+        own_latencies = []
+        own_statuses = []
+
+        try:
+            for _ in range(warmup):
+                client.request(*scenario(ctx, rng))
+
+            start_line.wait()
+
+            for _ in range(per_thread):
+                request = scenario(ctx, rng)
+                start = time.perf_counter()
+                status = client.request(*request)
+                own_latencies.append(time.perf_counter() - start)
+                own_statuses.append(status)
+        finally:
+            client.close()
+
+        with lock:
+            latencies.extend(own_latencies)
+            statuses.extend(own_statuses)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+
+    for thread in workers:
+        thread.start()
+
+    # everyone has warmed up, the clock starts when they all go together
+    start_line.wait()
+    start = time.perf_counter()
+
+    for thread in workers:
+        thread.join()
+
+    return summarize(name, latencies, statuses, time.perf_counter() - start)
+
+
+def run_mode(mode, args, scenarios):
+    database_url = args.database_url or temp_sqlite_url()
+    app = make_api_app(
+        database_url,
+        cache=args.cache,
+        BCRYPT_LOG_ROUNDS=args.bcrypt_rounds,
+        PASSWORD_HASH_QUEUE=max(32, args.threads),
+    )
+
+    # every mode starts from the same data, signups and checkouts change it
+    reset_database(app)
+    totals = seed(app, args.scale, rounds=args.bcrypt_rounds)
+    ctx = Context(app, totals)
+
+    results = {}
+
+    if mode == "inprocess":
+        for name in scenarios:
+            results[name] = run_scenario(
+                name, ctx, lambda: InProcessClient(app), args.threads, args.requests, args.warmup
+            )
+    else:
+        with LocalServer(app) as server:
+            for name in scenarios:
+                results[name] = run_scenario(
+                    name, ctx, server.client, args.threads, args.requests, args.warmup
+                )
+
+    with app.app_context():
+        db.engine.dispose()
+
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def change(before, after):
+    if not before:
+        return ""
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def print_report(report, baseline=None):
+    header = f"{'scenario':16} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+
+    for mode, results in report["results"].items():
+        print(f"\n{mode} ({report['threads']} threads, scale {report['scale']})")
+        print(header)
+
+        for name, r in results.items():
+            print(
+                f"{name:16} {r['requests']:6} {r['errors']:6} {r['throughput']:8.1f} "
+                f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} {r['max_ms']:8.2f}"
+            )
+
+            before = (baseline or {}).get("results", {}).get(mode, {}).get(name)
+
+            if before:
+                print(
+                    f"{'  vs baseline':16} {'':6} {'':6} {change(before['throughput'], r['throughput']):>8} "
+                    f"{change(before['p50_ms'], r['p50_ms']):>8} {change(before['p95_ms'], r['p95_ms']):>8} "
+                    f"{change(before['p99_ms'], r['p99_ms']):>8}"
+                )
+
+    if baseline:
+        print(f"\nbaseline: commit {baseline.get('commit')}, {baseline.get('threads')} threads")
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--mode", choices=("inprocess", "wsgi", "both"), default="both")
+    parser.add_argument("--scenario", choices=tuple(SCENARIOS), action="append")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="per scenario, split across the threads")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per thread")
+    parser.add_argument("--scale", type=float, default=0.2, help="data volume, 1 is 10k users and 2k events")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--cache", action="store_true", help="turn the response cache on")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a JSON file from an earlier --output to compare against")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    modes = ("inprocess", "wsgi") if args.mode == "both" else (args.mode,)
+
+    report = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "threads": args.threads,
+        "scale": args.scale,
+        "bcrypt_rounds": args.bcrypt_rounds,
+        "cache": args.cache,
+        "results": {mode: run_mode(mode, args, scenarios) for mode in modes},
+    }
+
+    baseline = None
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nsaved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Mixed read/write throughput with the old database settings and the new ones.
+
+    before: statement logging on, sqlite defaults (rollback journal, synchronous=FULL)
+    after:  statement logging off, WAL, synchronous=NORMAL, busy_timeout, mmap
+
+Readers list events while writers reserve tickets, all on the same sqlite file.
+
+    python benchmarks/mixed_workload.py --threads 8 --seconds 5
+"""
+
+import contextlib
+import os
+import random
+import threading
+import time
+
+from flask_jwt_extended import create_access_token
+
+from common import base_parser, make_api_app, reset_database, temp_sqlite_url
+from models import Category, Event, Ticket, db
+
+DEVNULL = open(os.devnull, "w")
+
+PROFILES = {
+    "before": {"SQLALCHEMY_ECHO": True, "SQLITE_PRAGMAS": False},
+    "after": {"SQLALCHEMY_ECHO": False, "SQLITE_PRAGMAS": True},
+}
+
+
+def seed(app, events=200):
+    with app.app_context():
+        category = Category(name=1)
+        db.session.add(category)
+        db.session.flush()
+
+        for i in range(events):
+            event = Event(
+                name=f"Event {i}",
+                description="Benchmark event",
+                venue="Nairobi",
+                poster="poster.png",
+                category_id=category.id,
+                start_date="2030-01-01T18:00:00Z",
+                end_date="2030-01-01T23:00:00Z",
+            )
+            event.tickets = [Ticket(name="Regular", price=1000, tickets_available=10**6)]
+            db.session.add(event)
+
+        db.session.commit()
+
+
+def run(profile, args):
+    database_url = args.database_url or temp_sqlite_url()
+
+    # echo writes to stdout, send it nowhere but still pay for formatting and writing it
+    with contextlib.redirect_stdout(DEVNULL):
+        # one buyer per thread, holding far more than the per-buyer cap would allow
+        app = make_api_app(database_url, RESERVATION_MAX_TICKETS=10**9, **PROFILES[profile])
+
+    reset_database(app)
+    seed(app)
+
+    with app.app_context():
+        tokens = [create_access_token(identity=str(i + 1)) for i in range(args.threads)]
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(token):
+        client = app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        local = {"reads": 0, "writes": 0, "errors": 0}
+
+        while time.perf_counter() < deadline:
+            if random.random() < args.write_ratio:
+                response = client.post(
+                    f"/tickets/{random.randint(1, 200)}/reserve", json={"quantity": 1}, headers=headers
+                )
+                kind = "writes"
+            else:
+                response = client.get("/events?limit=20")
+                kind = "reads"
+
+            local[kind if response.status_code < 300 else "errors"] += 1
+
+        with lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    with contextlib.redirect_stdout(DEVNULL):
+        threads = [threading.Thread(target=worker, args=(token,)) for token in tokens]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    total = counts["reads"] + counts["writes"]
+    print(
+        f"{profile:7} {total / args.seconds:8.0f} req/s   reads {counts['reads']:6}"
+        f"   writes {counts['writes']:5}   errors {counts['errors']}"
+    )
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    for profile in PROFILES:
+        run(profile, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+A local stand-in for the M-Pesa (Daraja) API, for running the payment pipeline offline.
+
+Answers the calls services/mpesa.py makes (OAuth token, STK push, STK query) and
+posts a result to the CallBackURL of every push after a short delay, like the
+customer typing their PIN. Failures can be injected:
+
+    --latency-ms       added to every API call
+    --error-rate       share of STK pushes answered with a 503 (the worker retries them)
+    --decline-rate     share of payments the customer turns down (ResultCode 1032)
+    --drop-rate        share of callbacks never sent (only a status query finds out)
+    --duplicate-rate   share of callbacks sent twice
+
+    python benchmarks/mpesa_simulator.py --port 8090 --drop-rate 0.1
+    MPESA_URL=http://127.0.0.1:8090 flask payments work
+"""
+
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import run_simple
+from werkzeug.wrappers import Request, Response
+
+from common import base_parser
+from services.mpesa import STILL_PROCESSING
+
+
+class MpesaSimulator:
+    def __init__(
+        self,
+        latency_ms=0,
+        error_rate=0.0,
+        decline_rate=0.0,
+        drop_rate=0.0,
+        duplicate_rate=0.0,
+        callback_delay=(0.2, 0.5),
+        seed=1,
+    ):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.drop_rate = drop_rate
+        self.duplicate_rate = duplicate_rate
+        self.callback_delay = callback_delay
+
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        # CheckoutRequestID -> the result, once the customer has "answered"
+        self.results = {}
+        self.counts = {"pushes": 0, "rejected": 0, "callbacks": 0, "dropped": 0, "duplicates": 0, "queries": 0}
+
+        # callbacks due, delivered by a small pool like M-Pesa's own
+        self.due = []
+        self.wakeup = threading.Condition(self.lock)
+        self.senders = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mpesa-callbacks")
+        self.running = True
+        self.scheduler = threading.Thread(target=self.schedule, daemon=True)
+        self.scheduler.start()
+
+    def roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    # callbacks
+
+    def schedule(self):
+        with self.lock:
+            while self.running:
+                if not self.due:
+                    self.wakeup.wait()
+                    continue
+
+                at, _, job = self.due[0]
+                wait = at - time.monotonic()
+
+                if wait > 0:
+                    self.wakeup.wait(wait)
+                    continue
+
+                heapq.heappop(self.due)
+                self.senders.submit(*job)
+
+    def later(self, delay, fn, *args):
+        with self.lock:
+            heapq.heappush(self.due, (time.monotonic() + delay, next(self.ids), (fn, *args)))
+            self.wakeup.notify()
+
+    def answer(self, checkout_request_id, callback_url, amount, phone):
+        """The customer answered the prompt"""
+        if self.roll(self.decline_rate):
+            result = {"ResultCode": 1032, "ResultDesc": "Request cancelled by user"}
+        else:
+            receipt = f"SIM{checkout_request_id.split('_')[-1]:0>7}"
+            result = {
+                "ResultCode": 0,
+                "ResultDesc": "The service request is processed successfully.",
+                "MpesaReceiptNumber": receipt,
+                "CallbackMetadata": {
+                    "Item": [
+                        {"Name": "Amount", "Value": amount},
+                        {"Name": "MpesaReceiptNumber", "Value": receipt},
+                        {"Name": "PhoneNumber", "Value": phone},
+                    ]
+                },
+            }
+
+        with self.lock:
+            self.results[checkout_request_id] = result
+
+        if self.roll(self.drop_rate):
+            self.count("dropped")
+            return
+
+        self.send(checkout_request_id, callback_url, result)
+
+        if self.roll(self.duplicate_rate):
+            self.count("duplicates")
+            self.later(self.rng.uniform(*self.callback_delay), self.send, checkout_request_id, callback_url, result)
+
+    def send(self, checkout_request_id, callback_url, result):
+        callback = {k: v for k, v in result.items() if k != "MpesaReceiptNumber"}
+        body = {
+            "Body": {
+                "stkCallback": {
+                    "MerchantRequestID": f"sim-{checkout_request_id}",
+                    "CheckoutRequestID": checkout_request_id,
+                    **callback,
+                }
+            }
+        }
+        request = urllib.request.Request(
+            callback_url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}
+        )
+
+        try:
+            urllib.request.urlopen(request, timeout=10).read()
+            self.count("callbacks")
+        except OSError:
+            # M-Pesa doesn't retry for long either, the status query has to catch these
+            self.count("dropped")
+
+    # the API
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if request.path == "/oauth/v1/generate":
+            status, body = 200, {"access_token": "simulated-token", "expires_in": "3599"}
+        elif request.path == "/mpesa/stkpush/v1/processrequest":
+            status, body = self.stk_push(request.get_json(silent=True) or {})
+        elif request.path == "/mpesa/stkpushquery/v1/query":
+            status, body = self.query(request.get_json(silent=True) or {})
+        else:
+            status, body = 404, {"errorMessage": "Not found"}
+
+        return Response(json.dumps(body), status, content_type="application/json")(environ, start_response)
+
+    def stk_push(self, body):
+        if self.roll(self.error_rate):
+            self.count("rejected")
+            return 503, {"errorCode": "503.001.01", "errorMessage": "Service unavailable"}
+
+        missing = [name for name in ("Amount", "PhoneNumber", "CallBackURL") if not body.get(name)]
+        if missing:
+            return 400, {"errorCode": "400.002.02", "errorMessage": f"Invalid {missing[0]}"}
+
+        self.count("pushes")
+        checkout_request_id = f"ws_CO_{next(self.ids)}"
+        self.later(
+            self.rng.uniform(*self.callback_delay),
+            self.answer,
+            checkout_request_id,
+            body["CallBackURL"],
+            body["Amount"],
+            body["PhoneNumber"],
+        )
+
+        return 200, {
+            "MerchantRequestID": f"sim-{checkout_request_id}",
+            "CheckoutRequestID": checkout_request_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        }
+
+    def query(self, body):
+        self.count("queries")
+
+        with self.lock:
+            result = self.results.get(body.get("CheckoutRequestID"))
+
+        if result is None:
+            return 500, {"errorCode": STILL_PROCESSING, "errorMessage": "The transaction is being processed"}
+
+        return 200, {
+            "ResponseCode": "0",
+            "CheckoutRequestID": body["CheckoutRequestID"],
+            "ResultCode": str(result["ResultCode"]),
+            "ResultDesc": result["ResultDesc"],
+            "MpesaReceiptNumber": result.get("MpesaReceiptNumber"),
+        }
+
+    def close(self):
+        with self.lock:
+            self.running = False
+            self.wakeup.notify()
+
+        self.scheduler.join()
+        self.senders.shutdown(wait=True)
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--decline-rate", type=float, default=0.1)
+    parser.add_argument("--drop-rate", type=float, default=0)
+    parser.add_argument("--duplicate-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    simulator = MpesaSimulator(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        decline_rate=args.decline_rate,
+        drop_rate=args.drop_rate,
+        duplicate_rate=args.duplicate_rate,
+    )
+
+    print(f"M-Pesa simulator on http://127.0.0.1:{args.port}")
+    run_simple("127.0.0.1", args.port, simulator, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
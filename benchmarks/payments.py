@@ -0,0 +1,169 @@
+"""
+Throughput and failure injection for the M-Pesa payment pipeline, entirely offline.
+
+Runs the API on a local port (M-Pesa callbacks come in over HTTP), the provider
+simulator (benchmarks/mpesa_simulator.py) and the payment workers, places
+--payments checkouts and waits for every payment to be settled. Then checks that
+nothing was lost or counted twice:
+
+- no payment is left pending
+- the paid payments are exactly the ones the simulator accepted
+- the stock of failed payments went back, the stock of paid ones didn't
+- the sales aggregates match the base tables (reconcile fixes nothing)
+
+    python benchmarks/payments.py --payments 500 --threads 8
+    python benchmarks/payments.py --scenario faults --latency-ms 200
+"""
+
+import random
+import statistics
+import sys
+import time
+import threading
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func, select
+
+from common import Timer, base_parser, make_api_app, reset_database, temp_sqlite_url
+from load_test import LocalServer
+from models import Payment, PaymentItem, PaymentJob, Ticket, db
+from mpesa_simulator import MpesaSimulator
+from seed import seed
+from services.mpesa import mpesa
+from services.payments import PaymentWorker
+from services.stats import reconcile
+
+CALLBACK_TOKEN = "benchmark-callback-token"
+
+SCENARIOS = {
+    "clean": {"decline_rate": 0.1},
+    # every kind of trouble at once: refused pushes, lost and repeated callbacks
+    "faults": {"decline_rate": 0.1, "error_rate": 0.2, "drop_rate": 0.2, "duplicate_rate": 0.2},
+}
+
+
+def run(args, name, faults):
+    simulator = MpesaSimulator(latency_ms=args.latency_ms, **faults)
+
+    with LocalServer(simulator) as provider:
+        app = make_api_app(
+            args.database_url or temp_sqlite_url(),
+            MPESA_URL=f"http://127.0.0.1:{provider.server.server_port}",
+            MPESA_CALLBACK_TOKEN=CALLBACK_TOKEN,
+            # a lost callback is looked for after a second instead of a minute
+            PAYMENT_STALE_SECONDS=1,
+            PAYMENT_RECONCILE_SECONDS=0.5,
+            PAYMENT_RETRY_SECONDS=0.05,
+            PAYMENT_POLL_SECONDS=0.02,
+        )
+        reset_database(app)
+        seed(app, 0.02)
+
+        with LocalServer(app) as api:
+            app.config["MPESA_CALLBACK_URL"] = (
+                f"http://127.0.0.1:{api.server.server_port}/payments/callback/{CALLBACK_TOKEN}"
+            )
+            # the client keeps its own copy of the settings
+            mpesa.init_app(app)
+
+            with app.app_context():
+                stock_before = db.session.execute(select(func.sum(Ticket.tickets_available))).scalar()
+                # the seeded payments aren't part of the run
+                first_id = db.session.execute(select(func.max(Payment.id))).scalar() or 0
+                tokens = [create_access_token(identity=str(user_id)) for user_id in range(1, 51)]
+
+            worker = PaymentWorker(app, threads=args.threads)
+            thread = threading.Thread(target=worker.run, daemon=True)
+
+            client = app.test_client()
+            rng = random.Random(7)
+            checkout_ms = []
+
+            thread.start()
+
+            with Timer() as total:
+                for i in range(args.payments):
+                    body = {"items": [{"ticket_id": rng.randint(1, 40), "quantity": rng.randint(1, 3)}]}
+                    headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+                    start = time.perf_counter()
+                    response = client.post("/checkout", json=body, headers=headers)
+                    checkout_ms.append((time.perf_counter() - start) * 1000)
+
+                    assert response.status_code == 201, response.get_json()
+
+                with app.app_context():
+                    deadline = time.monotonic() + args.timeout
+
+                    while time.monotonic() < deadline:
+                        pending = db.session.execute(
+                            select(func.count()).where(Payment.status == "pending")
+                        ).scalar()
+                        db.session.rollback()
+
+                        if not pending:
+                            break
+                        time.sleep(0.05)
+
+            worker.stop()
+            thread.join()
+
+        simulator.close()
+
+    with app.app_context():
+        statuses = dict(
+            db.session.execute(
+                select(Payment.status, func.count()).where(Payment.id > first_id).group_by(Payment.status)
+            ).all()
+        )
+        paid_quantity = db.session.execute(
+            select(func.coalesce(func.sum(PaymentItem.quantity), 0))
+            .join(Payment, Payment.id == PaymentItem.payment_id)
+            .where(Payment.status == "paid", Payment.id > first_id)
+        ).scalar()
+        stock_after = db.session.execute(select(func.sum(Ticket.tickets_available))).scalar()
+        retries = db.session.execute(select(func.sum(PaymentJob.attempts - 1))).scalar()
+        queries = db.session.execute(
+            select(func.count()).where(PaymentJob.kind == "status_query")
+        ).scalar()
+        drift = reconcile()
+
+    accepted = sum(1 for result in simulator.results.values() if result["ResultCode"] == 0)
+
+    checks = {
+        "nothing left pending": statuses.get("pending", 0) == 0,
+        "paid == accepted by M-Pesa": statuses.get("paid", 0) == accepted,
+        "failed payments restocked": stock_before - stock_after == paid_quantity,
+        "aggregates match": all(result["fixed"] == 0 for result in drift.values()),
+    }
+
+    print(f"\n{name}: {args.payments} payments, {args.threads} worker threads, {args.latency_ms:.0f}ms API latency")
+    print(f"  settled in       {total.elapsed:8.2f}s  ({args.payments / total.elapsed:.0f} payments/s)")
+    print(f"  checkout p50     {statistics.median(checkout_ms):8.2f}ms (never waits on M-Pesa)")
+    print(f"  outcome          {statuses}")
+    print(f"  simulator        {simulator.counts}")
+    print(f"  job retries      {retries}, status queries {queries}")
+
+    for check, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {check}")
+
+    return all(checks.values())
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--payments", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for every payment to settle")
+    parser.add_argument("--scenario", choices=[*SCENARIOS, "both"], default="both")
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenario == "both" else [args.scenario]
+    ok = all([run(args, name, SCENARIOS[name]) for name in names])
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Checks that listing endpoints run a constant number of SQL statements.
+
+Seeds a small and a large catalog and fails (non-zero exit) if any endpoint
+issues more queries for the large one, i.e. if an N+1 lazy load sneaks back in.
+
+    python benchmarks/query_counts.py
+"""
+
+import sys
+
+from flask_jwt_extended import create_access_token
+
+from common import base_parser, make_api_app, reset_database, temp_sqlite_url
+from models import Category, Event, Ticket, db
+from services.query_counter import count_queries
+from services.stats import reconcile
+
+# endpoint -> the most statements it may run, whatever the catalog size
+BUDGETS = {
+    "/events": 2,
+    "/events?limit=200": 2,
+    "/events?ids=1,2,3,4,5,6,7,8,9,10": 2,
+    "/events/1": 2,
+    "/events?fields=id,name": 1,
+    "/categories": 1,
+    "/stats/categories": 1,
+    "/stats/events/1": 2,
+}
+
+
+def seed(app, events, tickets_per_event=3):
+    with app.app_context():
+        categories = [Category(name=i) for i in range(5)]
+        db.session.add_all(categories)
+        db.session.flush()
+
+        for i in range(events):
+            event = Event(
+                name=f"Event {i}",
+                description="Benchmark event",
+                venue="Nairobi",
+                poster="poster.png",
+                category_id=categories[i % 5].id,
+                start_date="2030-01-01T18:00:00Z",
+                end_date="2030-01-01T23:00:00Z",
+            )
+            event.tickets = [
+                Ticket(name=f"Tier {t}", price=1000 * (t + 1), tickets_available=100)
+                for t in range(tickets_per_event)
+            ]
+            db.session.add(event)
+
+        db.session.commit()
+
+        reconcile()
+
+
+def measure(events, database_url):
+    app = make_api_app(database_url)
+
+    reset_database(app)
+    seed(app, events)
+
+    client = app.test_client()
+    counts = {}
+
+    with app.app_context():
+        # the stats endpoints are for admins, the role is read from the token
+        token = create_access_token(identity="1", additional_claims={"role": "admin"})
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # builds the revoked token filter, that query isn't the endpoint's
+        client.get("/stats/categories", headers=headers)
+
+        for url, budget in BUDGETS.items():
+            # every request starts with a fresh session, like in production
+            db.session.remove()
+
+            with count_queries(db.engine) as queries:
+                response = client.get(url, headers=headers)
+
+            assert response.status_code == 200, (url, response.status_code)
+            counts[url] = queries.count
+
+    return counts
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--small", type=int, default=10)
+    parser.add_argument("--large", type=int, default=150)
+    args = parser.parse_args()
+
+    small = measure(args.small, args.database_url or temp_sqlite_url())
+    large = measure(args.large, args.database_url or temp_sqlite_url())
+
+    failed = False
+
+    for url, budget in BUDGETS.items():
+        ok = large[url] == small[url] and large[url] <= budget
+        failed = failed or not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {url:45} {small[url]} -> {large[url]} queries (budget {budget})")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Runs EXPLAIN QUERY PLAN on each hot query and fails (non-zero exit) if sqlite
+would read a table from start to end instead of using an index.
+
+"SCAN table USING INDEX ..." is fine, that's an ordered walk that stops at the LIMIT.
+A bare "SCAN table" is a full table scan. Some queries legitimately read a whole
+(small) table, e.g. listing every category, those tables are listed in allow_scan.
+
+    python benchmarks/query_plans.py
+"""
+
+import re
+import sys
+from datetime import datetime
+
+from sqlalchemy import func, select, text
+
+from common import base_parser, make_app, reset_database, temp_sqlite_url
+from models import Category, Event, Payment, PaymentItem, Ticket, User, db
+
+NOW = datetime(2030, 1, 1)
+
+
+def hot_queries():
+    """name -> (statement, tables allowed to be scanned)"""
+    return {
+        "ticket by event and name": (
+            select(Ticket.id).where(Ticket.event_id == 1, Ticket.name == "VIP"),
+            (),
+        ),
+        "tickets of a page of events": (
+            select(Ticket).where(Ticket.event_id.in_([1, 2, 3])),
+            (),
+        ),
+        "category event counts": (
+            select(Category, func.count(Event.id))
+            .outerjoin(Event)
+            .group_by(Category.id),
+            ("categories",),
+        ),
+        "events page": (
+            select(Event).order_by(Event.start_date, Event.id).limit(50),
+            (),
+        ),
+        "events next page": (
+            select(Event)
+            .where(Event.start_date > NOW)
+            .order_by(Event.start_date, Event.id)
+            .limit(50),
+            (),
+        ),
+        "events by status": (
+            select(Event)
+            .where(Event.status == "active")
+            .order_by(Event.start_date, Event.id)
+            .limit(50),
+            (),
+        ),
+        "events by category": (
+            select(Event).where(Event.category_id == 1),
+            (),
+        ),
+        "items of a payment": (
+            select(PaymentItem).where(PaymentItem.payment_id == 1),
+            (),
+        ),
+        "items of a ticket": (
+            select(PaymentItem).where(PaymentItem.ticket_id == 1),
+            (),
+        ),
+        "payments of a user": (
+            select(Payment).where(Payment.user_id == 1),
+            (),
+        ),
+        "payment by mpesa code": (
+            select(Payment).where(Payment.mpesa_code == "QWE123RTY"),
+            (),
+        ),
+        "user by email": (
+            select(User).where(User.email == "someone@example.com"),
+            (),
+        ),
+    }
+
+
+FULL_SCAN = re.compile(r"\bSCAN (\w+)(?: AS \w+)?$")
+
+
+def full_scans(plan_rows):
+    scans = []
+
+    for row in plan_rows:
+        detail = row[-1]
+        match = FULL_SCAN.search(detail)
+
+        if match:
+            scans.append(match.group(1))
+
+    return scans
+
+
+def main():
+    parser = base_parser(__doc__)
+    args = parser.parse_args()
+
+    # EXPLAIN QUERY PLAN is sqlite specific
+    app = make_app(args.database_url or temp_sqlite_url())
+    reset_database(app)
+
+    failed = False
+
+    with app.app_context():
+        connection = db.session.connection()
+
+        for name, (statement, allow_scan) in hot_queries().items():
+            compiled = statement.compile(
+                dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+            )
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+            scans = [table for table in full_scans(plan) if table not in allow_scan]
+
+            ok = not scans
+            failed = failed or not ok
+
+            print(f"{'ok  ' if ok else 'FAIL'} {name}")
+            for row in plan:
+                print(f"       {row[-1]}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
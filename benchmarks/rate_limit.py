@@ -0,0 +1,98 @@
+"""
+What the login rate limiter costs and what it saves.
+
+1. The store on its own: take() calls per second with many distinct clients, and
+   that the number of buckets kept never goes past RATELIMIT_MAX_KEYS.
+2. A login flood from one address at a realistic bcrypt cost, with the limiter off
+   and on. Rejected attempts are answered without hashing, so the CPU they cost
+   should be a tiny fraction of an accepted one. --store-latency-ms puts a fake
+   network hop in front of the store, a stand-in for a shared store like redis.
+
+    python benchmarks/rate_limit.py --attempts 200 --bcrypt-rounds 10
+"""
+
+import random
+import time
+
+from common import Timer, base_parser, make_api_app, reset_database, temp_sqlite_url
+from seed import SEED_PASSWORD, seed
+from services.ratelimit import MemoryStore
+
+
+class SlowStore:
+    """A local stand-in for a shared store, adds a round trip to every take()"""
+
+    def __init__(self, store, latency):
+        self.store = store
+        self.latency = latency
+
+    def take(self, key, capacity, rate, cost=1):
+        time.sleep(self.latency)
+        return self.store.take(key, capacity, rate, cost)
+
+
+def store_throughput(clients, calls, max_keys):
+    store = MemoryStore(max_keys=max_keys)
+    rng = random.Random(1)
+    keys = [f"login:ip:10.0.{i // 256}.{i % 256}" for i in range(clients)]
+    rate = 5 / 60
+
+    with Timer() as timer:
+        for _ in range(calls):
+            store.take(rng.choice(keys), 5, rate)
+
+    return calls / timer.elapsed, len(store._buckets)
+
+
+def login_flood(args, enabled):
+    store = MemoryStore()
+
+    if args.store_latency_ms:
+        store = SlowStore(store, args.store_latency_ms / 1000)
+
+    app = make_api_app(
+        args.database_url or temp_sqlite_url(),
+        BCRYPT_LOG_ROUNDS=args.bcrypt_rounds,
+        RATELIMIT_ENABLED=enabled,
+        RATELIMIT_STORE=store,
+    )
+    reset_database(app)
+    seed(app, 0.01, rounds=args.bcrypt_rounds)
+
+    client = app.test_client()
+    timings = {}
+
+    # one address trying a handful of accounts, like a credential stuffing run
+    with Timer() as total:
+        for i in range(args.attempts):
+            body = {"email": f"user{i % 10}@example.com", "password": SEED_PASSWORD}
+            start = time.perf_counter()
+            status = client.post("/login", json=body).status_code
+            timings.setdefault(status, []).append(time.perf_counter() - start)
+
+    return total.elapsed, timings
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--attempts", type=int, default=200)
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--store-latency-ms", type=float, default=0)
+    parser.add_argument("--clients", type=int, default=200000)
+    parser.add_argument("--max-keys", type=int, default=100000)
+    args = parser.parse_args()
+
+    per_second, kept = store_throughput(args.clients, 500000, args.max_keys)
+    print(f"memory store: {per_second:,.0f} take() per second, {args.clients} clients, {kept} buckets kept")
+
+    for enabled in (False, True):
+        elapsed, timings = login_flood(args, enabled)
+        print(f"\nlimiter {'on' if enabled else 'off'}: {args.attempts} logins in {elapsed:.2f}s")
+
+        for status, samples in sorted(timings.items()):
+            average = sum(samples) / len(samples) * 1000
+            print(f"  {status}: {len(samples):5} requests, {average:8.2f}ms average")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Response encoding on the /events payload (services/representations.py).
+
+Encodes a full page of events (GET /events?limit=200, tickets and category included)
+with each encoder and prints the time per response and the body size:
+
+    restful   flask_restful's own output_json, the standard library with its defaults
+    json      the standard library, compact
+    orjson    when installed
+    msgpack   when installed
+
+The same page with the datetimes left as datetime objects is encoded too, the
+standard library has to call default() for each one, orjson and msgpack don't.
+
+Then the real endpoint, served from the response cache so what's left is mostly
+encoding: requests per second of GET /events?limit=200 for each JSON_ENCODER and
+for Accept: application/msgpack.
+
+    python benchmarks/representations.py --repeat 200
+"""
+
+import json
+from datetime import datetime
+
+from flask_restful.representations.json import output_json as restful_output_json
+
+from common import Timer, base_parser, make_api_app, reset_database, temp_sqlite_url
+from seed import seed
+from services.representations import ENCODERS, MSGPACK, default, msgpack
+
+PAGE = "/events?limit=200"
+
+
+def with_datetimes(events):
+    """The page as it would be without the serializer formatting the dates"""
+
+    def parse(value):
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+    return [
+        {
+            **event,
+            "start_date": parse(event["start_date"]),
+            "end_date": parse(event["end_date"]),
+            "created_at": parse(event["created_at"]),
+            "tickets": [{**ticket, "created_at": parse(ticket["created_at"])} for ticket in event["tickets"]],
+        }
+        for event in events
+    ]
+
+
+def encoders():
+    found = {"restful": lambda data: restful_output_json(data, 200).get_data()}
+
+    for name, dumps in ENCODERS.items():
+        found[name] = dumps
+
+    if msgpack is not None:
+        found["msgpack"] = lambda data: msgpack.packb(data, default=default)
+
+    return found
+
+
+def time_encoders(app, payloads, repeat):
+    print(f"\nencoding one page ({repeat} times)")
+    print(f"{'payload':14} {'encoder':8} {'ms/response':>12} {'KB':>8}")
+
+    with app.test_request_context():
+        for label, payload in payloads.items():
+            for name, dumps in encoders().items():
+                try:
+                    size = len(dumps(payload))
+                except TypeError:
+                    # flask_restful's output_json can't encode a datetime at all
+                    print(f"{label:14} {name:8} {'fails':>12}")
+                    continue
+
+                with Timer() as timer:
+                    for _ in range(repeat):
+                        dumps(payload)
+
+                print(f"{label:14} {name:8} {timer.elapsed / repeat * 1000:>12.3f} {size / 1024:>8.1f}")
+
+
+def time_endpoint(database_url, repeat):
+    print(f"\nGET {PAGE} from the response cache ({repeat} requests)")
+    print(f"{'encoder':24} {'req/s':>8}")
+
+    variants = [(name, "application/json") for name in ENCODERS]
+    if msgpack is not None:
+        variants.append(("json", MSGPACK[0]))
+
+    for name, accept in variants:
+        app = make_api_app(database_url, cache=True, JSON_ENCODER=name)
+        client = app.test_client()
+        headers = {"Accept": accept}
+
+        # fills the cache
+        assert client.get(PAGE, headers=headers).status_code == 200
+
+        with Timer() as timer:
+            for _ in range(repeat):
+                client.get(PAGE, headers=headers)
+
+        label = name if accept == "application/json" else accept
+        print(f"{label:24} {repeat / timer.elapsed:>8.0f}")
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--scale", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    database_url = args.database_url or temp_sqlite_url()
+    app = make_api_app(database_url)
+    reset_database(app)
+    seed(app, args.scale)
+
+    events = json.loads(app.test_client().get(PAGE).data)
+    payloads = {"events": events, "raw datetimes": with_datetimes(events)}
+
+    # every encoder has to give back the same data before the timings mean anything
+    with app.test_request_context():
+        for name, dumps in encoders().items():
+            if name in ENCODERS:
+                assert json.loads(dumps(events)) == events, name
+
+    time_encoders(app, payloads, args.repeat)
+    time_endpoint(database_url, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares the compiled request schemas with the reqparse parsers they replaced.
+
+Each request is a fresh test_request_context with a JSON body, so both sides pay
+for decoding the body once, the way they do in a real request. Also checks that
+a bad payload gets every error back in one 422.
+
+    python benchmarks/request_parsing.py --requests 20000
+"""
+
+from flask import Flask
+from flask_restful import reqparse
+from werkzeug.exceptions import HTTPException
+
+from common import Timer, base_parser
+from routes.checkout import checkout_schema
+from routes.event import event_schema
+from routes.users import signup_schema
+from services.schema import json_body
+
+# the parsers as they were before services/schema.py
+signup_parser = reqparse.RequestParser()
+signup_parser.add_argument("name", required=True, type=str, help="User name is required")
+signup_parser.add_argument("phone", required=True, type=str, help="Phone number is required")
+signup_parser.add_argument("email", required=True, type=str, help="Email address is required")
+signup_parser.add_argument("password", required=True, type=str, help="Password is required")
+
+event_parser = reqparse.RequestParser()
+for name in ("name", "description", "venue", "poster", "status", "category_id", "start_date", "end_date"):
+    event_parser.add_argument(name)
+
+checkout_parser = reqparse.RequestParser()
+checkout_parser.add_argument(
+    "items", type=dict, action="append", location="json", required=True, help="Cart items are required"
+)
+checkout_parser.add_argument("mpesa_code", type=str, location="json")
+
+PAYLOADS = {
+    "signup": (
+        signup_parser,
+        signup_schema,
+        {"name": "Jane", "phone": "+254712345678", "email": "jane@example.com", "password": "secret"},
+    ),
+    "event": (
+        event_parser,
+        event_schema,
+        {
+            "name": "Concert",
+            "description": "Live music",
+            "venue": "Nairobi",
+            "poster": "poster.png",
+            "status": "active",
+            "category_id": 3,
+            "start_date": "2030-01-01T18:00:00Z",
+            "end_date": "2030-01-01T23:00:00Z",
+        },
+    ),
+    "checkout": (
+        checkout_parser,
+        checkout_schema,
+        {"items": [{"ticket_id": i, "quantity": 2} for i in range(1, 6)], "mpesa_code": "QWE123RTY"},
+    ),
+}
+
+
+def time_parse(app, payload, parse, requests):
+    with Timer() as timer:
+        for _ in range(requests):
+            with app.test_request_context("/", method="POST", json=payload):
+                parse()
+
+    return timer.elapsed / requests * 1e6
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+
+    # the request context on its own, taken off both columns
+    empty = time_parse(app, {}, lambda: None, args.requests)
+
+    print(f"{'payload':10} {'reqparse us':>12} {'schema us':>10} {'speedup':>8}")
+
+    for name, (old, new, payload) in PAYLOADS.items():
+        before = time_parse(app, payload, old.parse_args, args.requests) - empty
+        after = time_parse(app, payload, new.parse, args.requests) - empty
+        print(f"{name:10} {before:12.1f} {after:10.1f} {before / after:7.1f}x")
+
+    # every problem comes back in one response
+    bad = {"name": "", "category_id": "three", "status": "sold out", "start_date": "tomorrow"}
+
+    with app.test_request_context("/", method="POST", json=bad):
+        try:
+            event_schema.parse()
+        except HTTPException as e:
+            print(f"\ninvalid event -> {e.code} {e.data['errors']}")
+
+        assert json_body() == bad
+
+
+if __name__ == "__main__":
+    main()
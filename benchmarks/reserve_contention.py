@@ -0,0 +1,124 @@
+"""
+Hammers a single ticket type with concurrent reservations and checks that we
+never sell more than was in stock.
+
+    python benchmarks/reserve_contention.py --workers 16 --attempts 200
+    python benchmarks/reserve_contention.py --mode processes
+    python benchmarks/reserve_contention.py --database-url postgresql://localhost/tickets_bench
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from common import Timer, base_parser, make_app, reset_database, temp_sqlite_url
+from models import Category, Event, Reservation, Ticket, db
+from services.inventory import reserve
+
+
+def seed(app, stock):
+    with app.app_context():
+        category = Category(name=1)
+        db.session.add(category)
+        db.session.flush()
+
+        event = Event(
+            name="On-sale",
+            description="Benchmark event",
+            venue="Nairobi",
+            poster="poster.png",
+            category_id=category.id,
+            start_date="2030-01-01T18:00:00Z",
+            end_date="2030-01-01T23:00:00Z",
+        )
+        db.session.add(event)
+        db.session.flush()
+
+        ticket = Ticket(name="Regular", price=1000, tickets_available=stock, event_id=event.id)
+        db.session.add(ticket)
+        db.session.commit()
+
+        return ticket.id
+
+
+# every hold in the benchmark is made by the same buyer
+BUYER_ID = 1
+
+
+def bench_app(database_url):
+    # the per-buyer cap would stop the one buyer straight away, the point here is the stock
+    return make_app(database_url, RESERVATION_MAX_TICKETS=10**9)
+
+
+def worker(database_url, ticket_id, attempts, quantity, app=None):
+    app = app or bench_app(database_url)
+    won = 0
+    errors = 0
+
+    with app.app_context():
+        for _ in range(attempts):
+            try:
+                if reserve(BUYER_ID, ticket_id, quantity) is not None:
+                    won += 1
+                db.session.commit()
+            except OperationalError:
+                # sqlite gives up with "database is locked" under heavy contention
+                db.session.rollback()
+                errors += 1
+
+    return won, errors
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--mode", choices=("threads", "processes"), default="threads")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--attempts", type=int, default=100)
+    parser.add_argument("--quantity", type=int, default=1)
+    parser.add_argument("--stock", type=int, default=500)
+    args = parser.parse_args()
+
+    database_url = args.database_url or temp_sqlite_url()
+    app = bench_app(database_url)
+    reset_database(app)
+    ticket_id = seed(app, args.stock)
+
+    if args.mode == "threads":
+        pool = ThreadPoolExecutor(args.workers)
+        shared_app = app
+    else:
+        pool = ProcessPoolExecutor(args.workers)
+        shared_app = None
+
+    with Timer() as timer, pool:
+        futures = [
+            pool.submit(worker, database_url, ticket_id, args.attempts, args.quantity, shared_app)
+            for _ in range(args.workers)
+        ]
+        results = [f.result() for f in futures]
+
+    won = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    attempts = args.workers * args.attempts
+
+    with app.app_context():
+        remaining = db.session.get(Ticket, ticket_id).tickets_available
+        held = db.session.query(db.func.sum(Reservation.quantity)).scalar() or 0
+
+    sold = won * args.quantity
+
+    print(f"database     {database_url}")
+    print(f"mode         {args.mode} x {args.workers}")
+    print(f"attempts     {attempts} in {timer.elapsed:.2f}s ({attempts / timer.elapsed:.0f}/s)")
+    print(f"reserved     {sold} of {args.stock} (lock errors: {errors})")
+    print(f"remaining    {remaining}")
+
+    assert sold <= args.stock, "oversold!"
+    assert held == sold, "holds do not match successful reservations"
+    assert remaining + held == args.stock, "stock leaked"
+    print("ok, no overselling", datetime.now().isoformat(timespec="seconds"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Full text search against the LIKE '%q%' scan clients effectively do today.
+
+The LIKE side returns every match (that's what filtering the whole /events
+download amounts to), the FTS side returns the 20 best ranked ones.
+
+    python benchmarks/search.py --events 100000
+"""
+
+import random
+
+from sqlalchemy import insert
+
+from common import Timer, base_parser, make_app, reset_database, temp_sqlite_url
+from models import Category, Event, db
+from services.search import _fts_search, _like_search
+
+WORDS = (
+    "jazz rock gospel comedy theatre festival marathon expo summit workshop "
+    "afrobeat benga reggae hiphop classical opera poetry film food wine art "
+    "tech startup fashion gaming esports yoga football rugby cricket tennis"
+).split()
+
+VENUES = ("Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret", "Naivasha", "Malindi", "Thika")
+
+QUERIES = ("jazz", "nai", "rock festival", "comedy nakuru", "fashion expo", "rugby")
+
+SYLLABLES = ("ka", "ri", "mo", "ta", "ne", "lu", "si", "po", "ze", "wa", "bi", "go")
+
+
+def vocabulary(rng, size=5000):
+    """Made up filler words so the real ones are about as rare as in actual listings"""
+    return ["".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(size)]
+
+
+def seed(app, events):
+    rng = random.Random(42)
+    filler = vocabulary(rng)
+
+    with app.app_context():
+        db.session.add_all([Category(name=i) for i in range(10)])
+        db.session.flush()
+
+        batch = []
+
+        for i in range(events):
+            batch.append(
+                {
+                    "name": f"{rng.choice(WORDS)} {' '.join(rng.choices(filler, k=2))}".title(),
+                    "description": " ".join(rng.choices(filler, k=30) + rng.choices(WORDS, k=1)),
+                    "venue": f"{rng.choice(VENUES)} Grounds",
+                    "poster": "poster.png",
+                    "category_id": rng.randint(1, 10),
+                    "start_date": Event.validate_start_date(None, None, "2030-01-01T18:00:00Z"),
+                    "end_date": Event.validate_end_date(None, None, "2030-01-01T23:00:00Z"),
+                }
+            )
+
+            if len(batch) == 5000:
+                db.session.execute(insert(Event), batch)
+                batch = []
+
+        if batch:
+            db.session.execute(insert(Event), batch)
+
+        db.session.commit()
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url or temp_sqlite_url())
+    reset_database(app)
+
+    with Timer() as seeding:
+        seed(app, args.events)
+
+    print(f"seeded {args.events} events (indexed as they were inserted) in {seeding.elapsed:.1f}s")
+
+    with app.app_context():
+        for query in QUERIES:
+            with Timer() as fts:
+                for _ in range(args.repeat):
+                    _fts_search(query, None, 20, True)
+
+            with Timer() as like:
+                for _ in range(args.repeat):
+                    _like_search(query, None, args.events, True)
+
+            print(
+                f"{query:16} fts {fts.elapsed / args.repeat * 1000:8.2f}ms"
+                f"   like {like.elapsed / args.repeat * 1000:8.2f}ms"
+                f"   {like.elapsed / fts.elapsed:6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
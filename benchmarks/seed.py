@@ -0,0 +1,168 @@
+"""
+Fills a database with a realistic looking catalog for the load tests.
+
+    python benchmarks/seed.py --database-url sqlite:////tmp/tickets-load.db --scale 1
+
+At scale 1: 10k users, 12 categories, 2k events with 2-4 ticket tiers each and
+20k payments of 1-3 items. Everything is inserted with executemany in batches.
+Every user's password is SEED_PASSWORD so the login scenarios can use any of them.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from flask_bcrypt import generate_password_hash
+from sqlalchemy import func, insert, select
+
+from common import Timer, base_parser, make_app, reset_database, temp_sqlite_url
+from models import Category, Event, Payment, PaymentItem, Ticket, User, db
+from services.stats import reconcile
+
+SEED_PASSWORD = "load-test-password"
+
+BATCH_SIZE = 5000
+
+CATEGORY_NAMES = 12
+
+TIERS = (("Early Bird", 800), ("Regular", 1500), ("VIP", 5000), ("VVIP", 12000))
+
+VENUES = (
+    "KICC Nairobi", "Uhuru Gardens", "Carnivore Grounds", "Sarit Expo Centre",
+    "Mombasa Sports Club", "Kisumu Impala Park", "Nakuru Athletic Club", "Naivasha Sopa",
+)
+
+KINDS = ("Jazz Night", "Comedy Special", "Gospel Fest", "Tech Summit", "Food Festival", "Marathon", "Art Expo")
+
+
+def volumes(scale):
+    return {
+        "users": int(10000 * scale),
+        "events": int(2000 * scale),
+        "payments": int(20000 * scale),
+    }
+
+
+def insert_batched(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start : start + BATCH_SIZE])
+
+
+def seed(app, scale=1.0, stock=1000, rounds=4, seed=42):
+    rng = random.Random(seed)
+    counts = volumes(scale)
+    now = datetime(2030, 1, 1)
+
+    # one hash for everyone, at the cost the app runs with so logins don't trigger a rehash
+    pw_hash = generate_password_hash(SEED_PASSWORD, rounds).decode("utf-8")
+
+    with app.app_context():
+        insert_batched(
+            User,
+            [
+                {
+                    "name": f"User {i}",
+                    "phone": f"+2547{i:08d}",
+                    "email": f"user{i}@example.com",
+                    "role": "admin" if i == 0 else "user",
+                    "password": pw_hash,
+                }
+                for i in range(counts["users"])
+            ],
+        )
+
+        insert_batched(Category, [{"name": i} for i in range(CATEGORY_NAMES)])
+
+        events = []
+        for i in range(counts["events"]):
+            start = now + timedelta(days=rng.randint(0, 365), hours=rng.choice((10, 14, 18, 20)))
+            events.append(
+                {
+                    "name": f"{rng.choice(KINDS)} {i}",
+                    "description": "A great night out. " * rng.randint(2, 10),
+                    "venue": rng.choice(VENUES),
+                    "poster": f"https://cdn.example.com/posters/{i}.jpg",
+                    "status": rng.choices(("active", "postponed", "cancelled"), (90, 7, 3))[0],
+                    "category_id": rng.randint(1, CATEGORY_NAMES),
+                    "start_date": start,
+                    "end_date": start + timedelta(hours=rng.randint(2, 8)),
+                }
+            )
+        insert_batched(Event, events)
+
+        tickets = []
+        for event_id in range(1, counts["events"] + 1):
+            for name, price in TIERS[: rng.randint(2, 4)]:
+                tickets.append(
+                    {"name": name, "price": price, "tickets_available": stock, "event_id": event_id}
+                )
+        insert_batched(Ticket, tickets)
+
+        ticket_prices = dict(db.session.execute(select(Ticket.id, Ticket.price)).all())
+        ticket_ids = list(ticket_prices)
+
+        items = []
+        amounts = {}
+        for payment_id in range(1, counts["payments"] + 1):
+            for ticket_id in rng.sample(ticket_ids, rng.randint(1, 3)):
+                quantity = rng.randint(1, 4)
+                items.append(
+                    {
+                        "payment_id": payment_id,
+                        "ticket_id": ticket_id,
+                        "quantity": quantity,
+                        "unit_price": ticket_prices[ticket_id],
+                    }
+                )
+                amounts[payment_id] = amounts.get(payment_id, 0) + quantity * ticket_prices[ticket_id]
+
+        # past sales, already confirmed
+        insert_batched(
+            Payment,
+            [
+                {
+                    "user_id": rng.randint(1, counts["users"]),
+                    "mpesa_code": f"S{i:09d}",
+                    "status": "paid",
+                    "amount": amounts[i + 1],
+                }
+                for i in range(counts["payments"])
+            ],
+        )
+        insert_batched(PaymentItem, items)
+
+        db.session.commit()
+
+        # the inserts above skip the app, the sales aggregates are computed from them
+        reconcile()
+
+        return {
+            "users": counts["users"],
+            "events": counts["events"],
+            "tickets": len(tickets),
+            "payments": counts["payments"],
+            "payment_items": len(items),
+        }
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    database_url = args.database_url or temp_sqlite_url()
+    app = make_app(database_url)
+    reset_database(app)
+
+    with Timer() as timer:
+        totals = seed(app, args.scale)
+
+    with app.app_context():
+        assert db.session.scalar(select(func.count(User.id))) == totals["users"]
+
+    print(f"seeded {database_url} in {timer.elapsed:.1f}s")
+    for table, count in totals.items():
+        print(f"  {table:14} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Compares the precompiled serializer with SerializerMixin.to_dict.
+
+    python benchmarks/serializer.py --rows 10000
+"""
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from common import Timer, base_parser, make_app, reset_database, temp_sqlite_url
+from models import Category, Event, Ticket, User, db
+from services.serializer import serializer_for
+
+EVENT_RULES = ("-tickets.event", "-tickets.payment_items")
+
+
+def seed(app, rows):
+    with app.app_context():
+        category = Category(name=1)
+        db.session.add(category)
+        db.session.flush()
+
+        for i in range(rows):
+            event = Event(
+                name=f"Event {i}",
+                description="Benchmark event",
+                venue="Nairobi",
+                poster="poster.png",
+                category_id=category.id,
+                start_date="2030-01-01T18:00:00Z",
+                end_date="2030-01-01T23:00:00Z",
+            )
+            event.tickets = [
+                Ticket(name="Regular", price=1000, tickets_available=100),
+                Ticket(name="VIP", price=5000, tickets_available=10),
+            ]
+            db.session.add(event)
+            db.session.add(
+                User(
+                    name=f"User {i}",
+                    phone=f"+2547{i:08d}",
+                    email=f"user{i}@example.com",
+                    password="hashed",
+                )
+            )
+
+        db.session.commit()
+
+
+def compare(label, rows, to_dict, compiled):
+    # same output first, otherwise the numbers mean nothing
+    for row in rows[:100]:
+        assert to_dict(row) == compiled(row), label
+
+    with Timer() as slow:
+        for row in rows:
+            to_dict(row)
+
+    with Timer() as fast:
+        for row in rows:
+            compiled(row)
+
+    print(
+        f"{label:8} to_dict {slow.elapsed * 1000:8.1f}ms   compiled {fast.elapsed * 1000:7.1f}ms"
+        f"   {slow.elapsed / fast.elapsed:5.1f}x"
+    )
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url or temp_sqlite_url())
+    reset_database(app)
+    seed(app, args.rows)
+
+    with app.app_context():
+        events = (
+            Event.query.options(joinedload(Event.category), selectinload(Event.tickets))
+            .all()
+        )
+        users = User.query.all()
+        categories = Category.query.all() * args.rows
+
+        compare(
+            "events",
+            events,
+            lambda e: e.to_dict(rules=EVENT_RULES),
+            serializer_for(Event, EVENT_RULES),
+        )
+        compare("users", users, lambda u: u.to_dict(), serializer_for(User))
+        compare("category", categories, lambda c: c.to_dict(), serializer_for(Category))
+
+
+if __name__ == "__main__":
+    main()
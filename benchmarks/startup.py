@@ -0,0 +1,145 @@
+"""
+Cold start time: importing app.py and building the app with create_app().
+
+Every run is a fresh python process, the way an autoscaled worker or a test run
+starts. Prints the median over --runs, the packages that take the longest to import
+(from python -X importtime) and fails if a module that's meant to load lazily
+(alembic, phonenumbers, redis) was imported during startup.
+
+    python benchmarks/startup.py --runs 10 --output startup.json
+    python benchmarks/startup.py --compare startup.json --budget-ms 800
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import base_parser, temp_sqlite_url
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# only needed by the flask db commands, a phone number, or a shared cache
+LAZY_MODULES = ("flask_migrate", "alembic", "phonenumbers", "redis")
+
+CHILD = f"""
+import json, sys, time
+
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app(migrations=False)
+built = time.perf_counter()
+
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "create_ms": (built - imported) * 1000,
+    "loaded_lazy_modules": [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def child_env(database_url, calibrate):
+    env = dict(os.environ)
+    env["DATABASE_URL"] = database_url
+    env.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-not-for-production")
+
+    if not calibrate:
+        # calibrating hashes once at startup, pin the cost to time our code only
+        env["BCRYPT_LOG_ROUNDS"] = "4"
+
+    return env
+
+
+def run_once(env, importtime=False):
+    command = [sys.executable]
+
+    if importtime:
+        command += ["-X", "importtime"]
+
+    result = subprocess.run(
+        command + ["-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_packages(importtime_output, count=10):
+    """Adds up the self time of every module by top level package"""
+    totals = {}
+
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+    return {package: round(us / 1000, 1) for package, us in ranked}
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--calibrate", action="store_true", help="include the bcrypt cost calibration")
+    parser.add_argument("--budget-ms", type=float, help="fail when import + create_app takes longer")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a JSON file from an earlier --output to compare against")
+    args = parser.parse_args()
+
+    env = child_env(args.database_url or temp_sqlite_url(), args.calibrate)
+
+    # the first run also writes the .pyc files, it isn't counted
+    run_once(env)
+    runs = [run_once(env)[0] for _ in range(args.runs)]
+    _, importtime_output = run_once(env, importtime=True)
+
+    report = {
+        "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+        "create_ms": round(statistics.median(run["create_ms"] for run in runs), 1),
+        "loaded_lazy_modules": sorted({name for run in runs for name in run["loaded_lazy_modules"]}),
+        "slowest_packages_ms": slowest_packages(importtime_output),
+    }
+    report["total_ms"] = round(report["import_ms"] + report["create_ms"], 1)
+
+    baseline = None
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(f"median of {args.runs} cold starts")
+
+    for key in ("import_ms", "create_ms", "total_ms"):
+        line = f"  {key:10} {report[key]:8.1f}"
+        if baseline:
+            line += f"   (was {baseline[key]:.1f})"
+        print(line)
+
+    print("\nslowest packages to import (self time, ms)")
+    for package, ms in report["slowest_packages_ms"].items():
+        print(f"  {package:24} {ms:8.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nsaved to {args.output}")
+
+    failed = False
+
+    if report["loaded_lazy_modules"]:
+        print(f"\nFAIL: loaded at startup, should be lazy: {', '.join(report['loaded_lazy_modules'])}")
+        failed = True
+
+    if args.budget_ms and report["total_ms"] > args.budget_ms:
+        print(f"\nFAIL: startup took {report['total_ms']}ms, budget is {args.budget_ms}ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Simulates an on-sale crowd with and without the waiting room and counts what the
+database sees (services/waitingroom.py).
+
+Every buyer in the crowd wants one event's tickets at the same moment.
+
+    without   everyone posts /checkout straight away
+    with      everyone joins the queue, polls GET /events/<id>/queue as often as
+              they're told to, and checks out once admitted
+
+The run goes through the real app in-process on a simulated clock, so a 30 second
+on-sale doesn't take 30 seconds. The database load is counted as SQL statements per
+simulated second. Without the waiting room the peak grows with the crowd, with it
+the peak stays at about --rate checkouts worth whatever the crowd size. The join and
+status requests never touch the tickets table (the only SQL they can run is the
+token revocation refresh every logged in request makes now and then, services/auth.py).
+
+    python benchmarks/waiting_room.py --crowds 250,1000,4000 --rate 20
+"""
+
+import random
+import sys
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import select
+
+from common import Timer, base_parser, make_api_app, reset_database, temp_sqlite_url
+from models import Ticket, db
+from seed import seed
+from services.query_counter import count_queries
+from services.waitingroom import TOKEN_HEADER, MemoryStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def setup(args, crowd):
+    clock = Clock()
+    app = make_api_app(args.database_url or temp_sqlite_url(), WAITING_ROOM_STORE=MemoryStore(clock=clock))
+    reset_database(app)
+    # one account per buyer
+    seed(app, max(0.02, crowd / 10000))
+
+    with app.app_context():
+        event_id = db.session.get(Ticket, 1).event_id
+        ticket_ids = db.session.execute(select(Ticket.id).where(Ticket.event_id == event_id)).scalars().all()
+        admin = create_access_token(identity="1", additional_claims={"role": "admin"})
+        tokens = [create_access_token(identity=str(i), additional_claims={"role": "user"}) for i in range(1, crowd + 1)]
+
+    return app, clock, event_id, ticket_ids, admin, tokens
+
+
+def checkout(client, rng, ticket_ids, token, queue_token=None):
+    headers = {"Authorization": f"Bearer {token}"}
+    if queue_token:
+        headers[TOKEN_HEADER] = queue_token
+
+    body = {"items": [{"ticket_id": rng.choice(ticket_ids), "quantity": 1}]}
+    return client.post("/checkout", json=body, headers=headers)
+
+
+def ticket_statements(queries):
+    return sum(1 for statement in queries.statements if "tickets" in statement)
+
+
+def without_room(args, crowd):
+    app, clock, event_id, ticket_ids, admin, tokens = setup(args, crowd)
+    client = app.test_client()
+    rng = random.Random(1)
+
+    with app.app_context():
+        engine = db.engine
+
+    # the whole crowd lands in the first second
+    with count_queries(engine) as queries:
+        for token in tokens:
+            checkout(client, rng, ticket_ids, token)
+
+    return {"peak": queries.count, "per_second": [queries.count], "polls": 0, "queue_sql": 0, "queue_tickets": 0}
+
+
+def with_room(args, crowd):
+    app, clock, event_id, ticket_ids, admin, tokens = setup(args, crowd)
+    client = app.test_client()
+    rng = random.Random(1)
+
+    with app.app_context():
+        engine = db.engine
+
+    response = client.put(
+        f"/events/{event_id}/queue",
+        json={"rate": args.rate, "burst": args.rate},
+        headers={"Authorization": f"Bearer {admin}"},
+    )
+    assert response.status_code == 200, response.get_json()
+
+    queue_sql = 0
+    queue_tickets = 0
+    polls = 0
+    # (next poll time, buyer, queue token), buyers drop out once they've checked out
+    waiting = []
+
+    with count_queries(engine) as queries:
+        for buyer, token in enumerate(tokens):
+            response = client.post(f"/events/{event_id}/queue", headers={"Authorization": f"Bearer {token}"})
+            assert response.status_code == 201, response.get_json()
+            joined = response.get_json()
+            waiting.append((joined["poll_after_seconds"], buyer, joined["token"]))
+
+    queue_sql += queries.count
+    queue_tickets += ticket_statements(queries)
+    per_second = []
+    refused = 0
+
+    for second in range(args.seconds):
+        statements = 0
+
+        for _ in range(args.ticks):
+            clock.now += 1 / args.ticks
+            due = [entry for entry in waiting if entry[0] <= clock.now]
+            waiting = [entry for entry in waiting if entry[0] > clock.now]
+
+            for _, buyer, queue_token in due:
+                with count_queries(engine) as queries:
+                    status = client.get(f"/events/{event_id}/queue", headers={TOKEN_HEADER: queue_token}).get_json()
+                polls += 1
+                queue_sql += queries.count
+                queue_tickets += ticket_statements(queries)
+
+                if not status["admitted"]:
+                    waiting.append((clock.now + status["poll_after_seconds"], buyer, queue_token))
+                    continue
+
+                with count_queries(engine) as queries:
+                    response = checkout(client, rng, ticket_ids, tokens[buyer], queue_token)
+                statements += queries.count
+                refused += response.status_code == 429
+
+        per_second.append(statements)
+
+        if not waiting:
+            break
+
+    assert refused == 0, f"{refused} admitted buyers were turned away"
+
+    return {
+        "peak": max(per_second),
+        "per_second": per_second,
+        "polls": polls,
+        "queue_sql": queue_sql,
+        "queue_tickets": queue_tickets,
+    }
+
+
+def main():
+    parser = base_parser(__doc__)
+    parser.add_argument("--crowds", default="250,1000,4000", help="comma separated crowd sizes")
+    parser.add_argument("--rate", type=int, default=20, help="buyers let in per second")
+    parser.add_argument("--seconds", type=int, default=30, help="simulated seconds of the on-sale")
+    parser.add_argument("--ticks", type=int, default=10, help="clock steps per simulated second")
+    args = parser.parse_args()
+
+    crowds = [int(crowd) for crowd in args.crowds.split(",")]
+    rows = []
+
+    for crowd in crowds:
+        with Timer() as timer:
+            before = without_room(args, crowd)
+            after = with_room(args, crowd)
+
+        rows.append((crowd, before, after))
+        print(f"crowd {crowd}: done in {timer.elapsed:.1f}s")
+
+    print(f"\nSQL statements per simulated second, waiting room letting in {args.rate}/s")
+    print(f"{'crowd':>8} {'no room peak':>14} {'room peak':>10} {'room mean':>10} {'polls':>8} {'queue SQL':>10}")
+
+    for crowd, before, after in rows:
+        busy = [count for count in after["per_second"] if count] or [0]
+        print(
+            f"{crowd:>8} {before['peak']:>14} {after['peak']:>10} {sum(busy) / len(busy):>10.0f}"
+            f" {after['polls']:>8} {after['queue_sql']:>10}"
+        )
+
+    peaks = [after["peak"] for _, _, after in rows]
+    flat = max(peaks) <= 1.5 * min(peaks)
+    no_queue_sql = all(after["queue_tickets"] == 0 for _, _, after in rows)
+
+    print(f"\n{'ok  ' if flat else 'FAIL'} database peak stays flat as the crowd grows")
+    print(f"{'ok  ' if no_queue_sql else 'FAIL'} joining and polling the queue never touch the tickets table")
+
+    sys.exit(0 if flat and no_queue_sql else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Environment driven configuration
+
+Everything can be set from the environment (or the .env file):
+
+    DATABASE_URL            primary database, defaults to sqlite:///tickets.db
+    READ_REPLICA_URL        optional read-only copy used by the GET endpoints
+    SQLALCHEMY_ECHO         "1" to log every statement (slow, development only)
+    DB_POOL_SIZE            connections kept open per worker (server databases only)
+    DB_MAX_OVERFLOW         extra connections allowed during a burst
+    DB_POOL_RECYCLE         seconds before a connection is replaced
+    SQLITE_BUSY_TIMEOUT_MS  how long sqlite waits for a lock before giving up
+    SQLITE_MMAP_SIZE        bytes of the database file sqlite may memory map
+
+M-Pesa (Daraja) payments, see services/mpesa.py and services/payments.py:
+
+    MPESA_URL               API base url, the sandbox unless set (or a local simulator)
+    MPESA_CONSUMER_KEY      app credentials for the OAuth token
+    MPESA_CONSUMER_SECRET
+    MPESA_SHORTCODE         paybill / till number payments go to
+    MPESA_PASSKEY           Lipa na M-Pesa online passkey
+    MPESA_CALLBACK_URL      public url M-Pesa posts results to, ends with MPESA_CALLBACK_TOKEN
+    MPESA_CALLBACK_TOKEN    secret part of the callback url, callbacks without it are refused
+    MPESA_TIMEOUT           seconds to wait for an answer from the API
+"""
+
+import os
+
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+
+    if value is None:
+        return default
+
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return default if value in (None, "") else int(value)
+
+
+def is_sqlite(url):
+    return url.startswith("sqlite")
+
+
+def engine_options(url):
+    if is_sqlite(url):
+        # sqlite has no server to pool connections to, the pragmas are set on connect instead
+        return {}
+
+    return {
+        "pool_size": env_int("DB_POOL_SIZE", 10),
+        "max_overflow": env_int("DB_MAX_OVERFLOW", 20),
+        "pool_recycle": env_int("DB_POOL_RECYCLE", 1800),
+        # checks the connection is still alive before handing it out
+        "pool_pre_ping": True,
+    }
+
+
+def database_config():
+    url = os.environ.get("DATABASE_URL", "sqlite:///tickets.db")
+    replica_url = os.environ.get("READ_REPLICA_URL")
+
+    config = {
+        "SQLALCHEMY_DATABASE_URI": url,
+        # logging every statement is synchronous and very slow, keep it for debugging
+        "SQLALCHEMY_ECHO": env_flag("SQLALCHEMY_ECHO"),
+        "SQLALCHEMY_ENGINE_OPTIONS": engine_options(url),
+        "SQLALCHEMY_BINDS": {},
+        "SQLITE_PRAGMAS": env_flag("SQLITE_PRAGMAS", True),
+        "SQLITE_BUSY_TIMEOUT_MS": env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        "SQLITE_MMAP_SIZE": env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+    }
+
+    if replica_url:
+        config["SQLALCHEMY_BINDS"]["replica"] = {
+            "url": replica_url,
+            **engine_options(replica_url),
+        }
+
+    return config
+
+
+def mpesa_config():
+    return {
+        "MPESA_URL": os.environ.get("MPESA_URL", "https://sandbox.safaricom.co.ke"),
+        "MPESA_CONSUMER_KEY": os.environ.get("MPESA_CONSUMER_KEY"),
+        "MPESA_CONSUMER_SECRET": os.environ.get("MPESA_CONSUMER_SECRET"),
+        "MPESA_SHORTCODE": os.environ.get("MPESA_SHORTCODE", "174379"),
+        "MPESA_PASSKEY": os.environ.get("MPESA_PASSKEY"),
+        "MPESA_CALLBACK_URL": os.environ.get("MPESA_CALLBACK_URL"),
+        "MPESA_CALLBACK_TOKEN": os.environ.get("MPESA_CALLBACK_TOKEN"),
+        "MPESA_TIMEOUT": env_int("MPESA_TIMEOUT", 10),
+    }
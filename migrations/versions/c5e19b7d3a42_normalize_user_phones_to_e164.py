@@ -0,0 +1,63 @@
+"""normalize user phones to e164
+
+Revision ID: c5e19b7d3a42
+Revises: a6c03d8e5b17
+Create Date: 2026-10-18 17:21:05.662310
+
+"""
+
+from alembic import op
+import phonenumbers
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "c5e19b7d3a42"
+down_revision = "a6c03d8e5b17"
+branch_labels = None
+depends_on = None
+
+users = sa.table("users", sa.column("id", sa.Integer()), sa.column("phone", sa.Text()))
+
+
+def to_e164(phone):
+    """
+    The E.164 form of a valid international number, None for anything else.
+    The rules of services/phones.py as they were at this revision, copied here so
+    later changes there don't change what this migration does.
+    """
+    if not isinstance(phone, str) or "+" not in phone:
+        return None
+
+    try:
+        parsed = phonenumbers.parse(phone.strip(), None)
+    except phonenumbers.NumberParseException:
+        return None
+
+    if not phonenumbers.is_valid_number(parsed):
+        return None
+
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+
+
+def upgrade():
+    # data only, new numbers are stored in E.164 form by the User validator,
+    # this rewrites the ones saved before ("+254 712 345 678" -> "+254712345678")
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(users.c.id, users.c.phone)).all()
+    taken = {phone for _, phone in rows}
+
+    for user_id, phone in rows:
+        e164 = to_e164(phone)
+
+        # two spellings of the same number, leave the second one alone rather than fail
+        if e164 is None or e164 == phone or e164 in taken:
+            continue
+
+        connection.execute(users.update().where(users.c.id == user_id).values(phone=e164))
+        taken.add(e164)
+
+
+def downgrade():
+    # the original spelling is gone, E.164 numbers are valid input anyway
+    pass
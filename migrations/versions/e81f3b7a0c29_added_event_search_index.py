@@ -0,0 +1,75 @@
+"""added event search index
+
+Revision ID: e81f3b7a0c29
+Revises: d4a9c61e2f85
+Create Date: 2026-10-18 12:41:09.863250
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "e81f3b7a0c29"
+down_revision = "d4a9c61e2f85"
+branch_labels = None
+depends_on = None
+
+# the index as it was at this revision, copied rather than imported from
+# services/search.py so later changes there don't change what this migration does
+FTS_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+        name, description, venue,
+        content='events', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts(rowid, name, description, venue)
+        VALUES (new.id, new.name, new.description, new.venue);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, name, description, venue)
+        VALUES ('delete', old.id, old.name, old.description, old.venue);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE OF name, description, venue ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, name, description, venue)
+        VALUES ('delete', old.id, old.name, old.description, old.venue);
+        INSERT INTO events_fts(rowid, name, description, venue)
+        VALUES (new.id, new.name, new.description, new.venue);
+    END
+    """,
+    # index whatever is already in the events table
+    "INSERT INTO events_fts(events_fts) VALUES ('rebuild')",
+)
+
+DROP_DDL = (
+    "DROP TRIGGER IF EXISTS events_fts_insert",
+    "DROP TRIGGER IF EXISTS events_fts_delete",
+    "DROP TRIGGER IF EXISTS events_fts_update",
+    "DROP TABLE IF EXISTS events_fts",
+)
+
+
+def upgrade():
+    # FTS5 is sqlite only, other databases use the LIKE fallback in services/search.py
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    for statement in FTS_DDL:
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    for statement in DROP_DDL:
+        op.execute(statement)
@@ -2,9 +2,10 @@ from sqlalchemy import MetaData
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.orm import validates
-import phonenumbers
 import re
 from datetime import datetime
+from services.database import RoutingSession
+from services.phones import normalize_phone
 
 naming_convention = {
     "ix": "ix_%(column_0_label)s",
@@ -16,7 +17,8 @@ naming_convention = {
 metadata = MetaData(naming_convention=naming_convention)
 
 # 2. create an instance of flask sqlalchemy and connect it to sqlalchemy
-db = SQLAlchemy(metadata=metadata)
+# the routing session lets read only endpoints use a replica when one is configured
+db = SQLAlchemy(metadata=metadata, session_options={"class_": RoutingSession})
 
 """
 Validations
@@ -29,6 +31,48 @@ Validations
 """
 
 
+# events are created with dates like 2030-01-01T18:00:00Z
+EVENT_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_event_date(date):
+    # the request schemas already hand over datetimes, only raw strings get parsed
+    if isinstance(date, datetime):
+        return date
+
+    # the exact format is by far the most common, slicing it is a lot cheaper than strptime
+    if (
+        isinstance(date, str)
+        and len(date) == 20
+        and date[4] == date[7] == "-"
+        and date[10] == "T"
+        and date[13] == date[16] == ":"
+        and date[19] == "Z"
+        and date.isascii()
+        and (date[0:4] + date[5:7] + date[8:10] + date[11:13] + date[14:16] + date[17:19]).isdigit()
+    ):
+        try:
+            return datetime(
+                int(date[0:4]),
+                int(date[5:7]),
+                int(date[8:10]),
+                int(date[11:13]),
+                int(date[14:16]),
+                int(date[17:19]),
+            )
+        except ValueError:
+            pass
+
+    return datetime.strptime(date, EVENT_DATE_FORMAT)
+
+
+# the user checks are plain functions too, bulk provisioning validates rows without building models
+def check_email(email):
+    if "@" not in email:
+        raise ValueError("Please provide a valid email")
+    return email
+
+
 # model the tables
 class User(db.Model, SerializerMixin):
     __tablename__ = "users"
@@ -49,9 +93,7 @@ class User(db.Model, SerializerMixin):
 
     @validates("email")
     def validate_email(self, key, email):
-        if "@" not in email:
-            raise ValueError("Please provide a valid email")
-        return email
+        return check_email(email)
 
     @validates("phone")
     def validate_phone(self, key, phone):
@@ -64,16 +106,8 @@ class User(db.Model, SerializerMixin):
         # if not re.match("^\+2547\d{8}$") or not re.match("^\+2541\d{8}$"):
         #     raise ValueError("Invalid kenyan phone number, must start with +254")
 
-        # this supports global phone numbers
-        parsed = phonenumbers.parse(phone, None)  # +
-        is_valid = phonenumbers.is_valid_number(parsed)
-
-        if not is_valid:
-            raise ValueError("Enter a valid phone number")
-        elif "+" not in phone:
-            raise ValueError("Must contain plus")
-
-        return phone
+        # this supports global phone numbers, stored in E.164 form (see services/phones.py)
+        return normalize_phone(phone)
 
     # manual serialization
     def to_json(self):
@@ -88,6 +122,22 @@ class User(db.Model, SerializerMixin):
         return password
 
 
+class RevokedToken(db.Model, SerializerMixin):
+    """
+    A revoked JWT (jti set), or every token of a user issued up to revoked_at (user_id set).
+    Kept until expires_at, after that the tokens it covers are expired anyway.
+    See services/auth.py, this table is what the in-memory revocation filter is built from.
+    """
+    __tablename__ = "revoked_tokens"
+
+    id = db.Column(db.Integer(), primary_key=True)
+    jti = db.Column(db.Text(), unique=True)
+    # no foreign key, revoking has to keep working for deleted users
+    user_id = db.Column(db.Integer(), index=True)
+    revoked_at = db.Column(db.DateTime(), nullable=False)
+    expires_at = db.Column(db.DateTime(), nullable=False, index=True)
+
+
 class Category(db.Model, SerializerMixin):
     __tablename__ = "categories"
 
@@ -104,6 +154,11 @@ class Category(db.Model, SerializerMixin):
 
 class Event(db.Model, SerializerMixin):
     __tablename__ = "events"
+    __table_args__ = (
+        # listings are ordered by (start_date, id), see routes/event.py
+        db.Index("ix_events_start_date_id", "start_date", "id"),
+        db.Index("ix_events_status_start_date", "status", "start_date", "id"),
+    )
 
     id = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.Text(), nullable=False)
@@ -115,7 +170,7 @@ class Event(db.Model, SerializerMixin):
         default="active",
     )
     category_id = db.Column(
-        db.Integer(), db.ForeignKey("categories.id"), nullable=False
+        db.Integer(), db.ForeignKey("categories.id"), nullable=False, index=True
     )
     start_date = db.Column(db.DateTime(), nullable=False)
     end_date = db.Column(db.DateTime(), nullable=False)
@@ -136,15 +191,20 @@ class Event(db.Model, SerializerMixin):
 
         # if d1 < now:
         #     raise ValueError("Start date has to be of a future date")
-        return datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
+        return parse_event_date(date)
 
     @validates("end_date")
     def validate_end_date(self, key, date):
-        return datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
+        return parse_event_date(date)
 
 
 class Ticket(db.Model, SerializerMixin):
     __tablename__ = "tickets"
+    __table_args__ = (
+        # for a single event, we cannot have the same ticket name
+        # it also serves as the index for looking up an event's tickets
+        db.UniqueConstraint("event_id", "name", name="uq_tickets_event_id_name"),
+    )
 
     id = db.Column(db.Integer(), primary_key=True)
     name = db.Column(db.Text(), nullable=False)
@@ -154,9 +214,34 @@ class Ticket(db.Model, SerializerMixin):
     created_at = db.Column(db.DateTime(), server_default=db.func.now())
     updated_at = db.Column(db.DateTime(), onupdate=db.func.now())
 
+    # holds are internal bookkeeping, they should not leak into event listings
+    serialize_rules = ("-reservations",)
+
     # relationships
     event = db.relationship("Event", back_populates="tickets", uselist=False)
     payment_items = db.relationship("PaymentItem", back_populates="ticket")
+    reservations = db.relationship("Reservation", back_populates="ticket")
+
+
+class Reservation(db.Model, SerializerMixin):
+    """
+    A time-limited hold on some of a ticket type's stock, for one buyer.
+    The quantity is taken out of Ticket.tickets_available when the hold is made
+    and goes back to stock if the hold expires before the buyer checks out.
+    """
+    __tablename__ = "reservations"
+
+    id = db.Column(db.Integer(), primary_key=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey("users.id"), nullable=False, index=True)
+    ticket_id = db.Column(db.Integer(), db.ForeignKey("tickets.id"), nullable=False)
+    quantity = db.Column(db.Integer(), nullable=False)
+    expires_at = db.Column(db.DateTime(), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(), server_default=db.func.now())
+
+    serialize_rules = ("-ticket",)
+
+    # relationships
+    ticket = db.relationship("Ticket", back_populates="reservations", uselist=False)
 
 
 class Payment(db.Model, SerializerMixin):
@@ -165,15 +250,72 @@ class Payment(db.Model, SerializerMixin):
     One payment = one checkout transaction = one M-Pesa code
     """
     __tablename__ = "payments"
+    __table_args__ = (
+        # the status reconciliation looks for payments stuck in pending
+        db.Index("ix_payments_status_requested_at", "status", "requested_at"),
+    )
 
     id = db.Column(db.Integer(), primary_key=True)
-    mpesa_code = db.Column(db.Text())
-    user_id = db.Column(db.Integer(), db.ForeignKey("users.id"), nullable=False)
+    # the M-Pesa receipt number, set when the payment is confirmed
+    mpesa_code = db.Column(db.Text(), index=True)
+    user_id = db.Column(
+        db.Integer(), db.ForeignKey("users.id"), nullable=False, index=True
+    )
+    # pending until M-Pesa confirms it (paid) or turns it down (failed), see services/payments.py
+    status = db.Column(
+        db.Enum("pending", "paid", "failed"),
+        nullable=False,
+        default="pending",
+    )
+    amount = db.Column(db.Integer())
+    # M-Pesa's id for the STK push, callbacks and status queries refer to it
+    checkout_request_id = db.Column(db.Text(), unique=True)
+    requested_at = db.Column(db.DateTime())
+    result_desc = db.Column(db.Text())
     created_at = db.Column(db.DateTime(), server_default=db.func.now())
     updated_at = db.Column(db.DateTime(), onupdate=db.func.now())
 
+    # the jobs are the workers' bookkeeping
+    serialize_rules = ("-jobs",)
+
     # relationships
     items = db.relationship("PaymentItem", back_populates="payment")
+    jobs = db.relationship("PaymentJob", back_populates="payment")
+
+
+class PaymentJob(db.Model, SerializerMixin):
+    """
+    Outbox of work for the payment workers, written in the same transaction as the
+    payment so a job can't get lost between the checkout and the worker.
+    """
+    __tablename__ = "payment_jobs"
+    __table_args__ = (
+        # the workers claim due jobs in run_at order
+        db.Index("ix_payment_jobs_status_run_at", "status", "run_at"),
+    )
+
+    id = db.Column(db.Integer(), primary_key=True)
+    payment_id = db.Column(
+        db.Integer(), db.ForeignKey("payments.id"), nullable=False, index=True
+    )
+    kind = db.Column(db.Enum("stk_push", "status_query"), nullable=False)
+    status = db.Column(
+        db.Enum("pending", "running", "done", "failed"),
+        nullable=False,
+        default="pending",
+    )
+    attempts = db.Column(db.Integer(), nullable=False, default=0)
+    run_at = db.Column(db.DateTime(), nullable=False)
+    # a running job whose lease has expired is picked up again (the worker died)
+    locked_by = db.Column(db.Text())
+    locked_until = db.Column(db.DateTime())
+    last_error = db.Column(db.Text())
+    created_at = db.Column(db.DateTime(), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(), onupdate=db.func.now())
+
+    serialize_rules = ("-payment",)
+
+    payment = db.relationship("Payment", back_populates="jobs", uselist=False)
 
 
 class PaymentItem(db.Model, SerializerMixin):
@@ -185,14 +327,49 @@ class PaymentItem(db.Model, SerializerMixin):
     __tablename__ = "payment_items"
 
     id = db.Column(db.Integer(), primary_key=True)
-    payment_id = db.Column(db.Integer(), db.ForeignKey("payments.id"), nullable=False)
-    ticket_id = db.Column(db.Integer(), db.ForeignKey("tickets.id"), nullable=False)
+    payment_id = db.Column(
+        db.Integer(), db.ForeignKey("payments.id"), nullable=False, index=True
+    )
+    ticket_id = db.Column(
+        db.Integer(), db.ForeignKey("tickets.id"), nullable=False, index=True
+    )
     quantity = db.Column(db.Integer(), nullable=False)
     # Store price at time of purchase (in case ticket price changes later)
     unit_price = db.Column(db.Integer(), nullable=False)
     created_at = db.Column(db.DateTime(), server_default=db.func.now())
     updated_at = db.Column(db.DateTime(), onupdate=db.func.now())
 
+    # the ticket_id is enough, following the ticket would pull in the whole event
+    serialize_rules = ("-payment", "-ticket")
+
     # relationships
     payment = db.relationship("Payment", back_populates="items", uselist=False)
     ticket = db.relationship("Ticket", back_populates="payment_items", uselist=False)
+
+
+# sales aggregates, kept up to date in the same transaction as the rows they count
+# and checked against them by the reconciliation job (see services/stats.py)
+class CategoryStats(db.Model, SerializerMixin):
+    __tablename__ = "category_stats"
+
+    category_id = db.Column(db.Integer(), db.ForeignKey("categories.id"), primary_key=True)
+    event_count = db.Column(db.Integer(), nullable=False, default=0)
+    tickets_sold = db.Column(db.Integer(), nullable=False, default=0)
+    revenue = db.Column(db.Integer(), nullable=False, default=0)
+
+
+class EventStats(db.Model, SerializerMixin):
+    __tablename__ = "event_stats"
+
+    event_id = db.Column(db.Integer(), db.ForeignKey("events.id"), primary_key=True)
+    tickets_sold = db.Column(db.Integer(), nullable=False, default=0)
+    revenue = db.Column(db.Integer(), nullable=False, default=0)
+
+
+class TicketStats(db.Model, SerializerMixin):
+    """Sales of one ticket tier"""
+    __tablename__ = "ticket_stats"
+
+    ticket_id = db.Column(db.Integer(), db.ForeignKey("tickets.id"), primary_key=True)
+    tickets_sold = db.Column(db.Integer(), nullable=False, default=0)
+    revenue = db.Column(db.Integer(), nullable=False, default=0)
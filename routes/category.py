@@ -1,14 +1,19 @@
-from flask_restful import Resource, reqparse
-from sqlalchemy import func
-from models import Category, Event, db
+from flask_restful import Resource
+from sqlalchemy import func, select
+from models import Category, CategoryStats, db
+from services.cache import response_cache
+from services.database import read_only
+from services.schema import Field, Schema
+from services.serializer import serializer_for
 
-parser = reqparse.RequestParser()
-parser.add_argument("name", type=str, required=True, help="Category name is required")
+serialize_category = serializer_for(Category)
+
+category_schema = Schema(name=Field(str, required="Category name is required"))
 
 
 class CategoryResource(Resource):
     def post(self):
-        data = parser.parse_args()
+        data = category_schema.parse()
 
         # We check name is not taken
         exists = Category.query.filter(Category.name == data["name"]).first()
@@ -22,21 +27,32 @@ class CategoryResource(Resource):
 
         db.session.commit()
 
+        response_cache.invalidate("categories")
+
         return {"message": "Category created successfully"}, 201
 
+    @response_cache.cached("categories")
+    @read_only
     def get(self):
-        results = []
+        return category_list(db.session.execute(categories_statement()))
+
+
+# shared with the async mode (asgi.py), which runs the statement on its own session
+
+
+def categories_statement():
+    # the counts are kept in category_stats, no need to count the events every time
+    return select(Category, func.coalesce(CategoryStats.event_count, 0)).outerjoin(
+        CategoryStats, CategoryStats.category_id == Category.id
+    )
+
 
-        categories = (
-            db.session.query(Category, func.count(Event.id).label("event_count"))
-            .outerjoin(Event)
-            .group_by(Category.id)
-            .all()
-        )
+def category_list(result):
+    results = []
 
-        for category, count in categories:
-            data = category.to_dict()
-            data["event_count"] = count
-            results.append(data)
+    for category, count in result:
+        data = serialize_category(category)
+        data["event_count"] = count
+        results.append(data)
 
-        return results
+    return results
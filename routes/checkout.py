@@ -0,0 +1,42 @@
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import db
+from services.checkout import CheckoutError, checkout
+from services.schema import Field, Schema, json_body, list_of, to_dict
+from services.waitingroom import waiting_room
+
+checkout_schema = Schema(items=Field(list_of(to_dict), required="Cart items are required"))
+
+
+def cart_tickets():
+    """The ticket ids in the cart, whatever shape the body is in (the schema reports the problems)"""
+    body = json_body()
+    items = body.get("items") if isinstance(body, dict) else None
+
+    ticket_ids = []
+
+    for item in items if isinstance(items, list) else []:
+        try:
+            ticket_ids.append(int(item["ticket_id"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    return ticket_ids
+
+
+class CheckoutResource(Resource):
+    @jwt_required()
+    @waiting_room.guard(cart_tickets)
+    def post(self):
+        data = checkout_schema.parse()
+
+        try:
+            result = checkout(int(get_jwt_identity()), data["items"])
+        except CheckoutError as e:
+            db.session.rollback()
+            return {"message": e.message}, e.status
+
+        db.session.commit()
+
+        # the customer gets an M-Pesa prompt, GET /payments/<id> tells when it's paid
+        return {"message": "Confirm the payment on your phone", **result}, 201
@@ -1,30 +1,59 @@
-from flask_restful import Resource, reqparse
+from flask_restful import Resource
 from flask import request
-from models import Event, db
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from models import Event, db, parse_event_date
+from services.search import search_events
+from services.importer import import_events, read_csv, read_ndjson
+from services.serializer import serialize_all, serializer_for
+from services.cache import response_cache
+from services.auth import role_required
+from services.database import read_only
+from services.export import export_format, stream
+from services.pagination import after_cursor, encode_cursor, page_size
+from services.schema import Field, Schema, event_date
+from services.stats import record_events
 
-parser = reqparse.RequestParser()
-parser.add_argument("name")
-parser.add_argument("description")
-parser.add_argument("venue")
-parser.add_argument("poster")
-parser.add_argument("status")
-parser.add_argument("category_id")
-parser.add_argument("start_date")
-parser.add_argument("end_date")
+# eager loading profile for serializing full events.
+# without it serializing lazy loads the tickets and the category one event at a time (N+1 queries),
+# with it a page of events costs 2 queries: the events joined to their category + one IN query for the tickets
+EVENT_LOAD_OPTIONS = (joinedload(Event.category), selectinload(Event.tickets))
+
+# compiled once, same output as event.to_dict(rules=...)
+serialize_event = serializer_for(Event, rules=("-tickets.event", "-tickets.payment_items"))
+
+event_schema = Schema(
+    name=Field(str, required=True),
+    description=Field(str, required=True),
+    venue=Field(str, required=True),
+    poster=Field(str, required=True),
+    status=Field(str, choices=Event.__table__.c.status.type.enums, default="active"),
+    category_id=Field(int, required=True),
+    # parsed here, once, the Event validators pass datetimes straight through
+    start_date=Field(event_date, required=True),
+    end_date=Field(event_date, required=True),
+)
 
 
 class EventResource(Resource):
     def post(self):
-        data = parser.parse_args()
+        data = event_schema.parse()
 
         event = Event(**data)
 
         db.session.add(event)
+        record_events([event.category_id])
 
         db.session.commit()
 
+        # listings embed the event and categories count their events
+        response_cache.invalidate("events", "categories")
+
         return {"message": "Event created successfully"}
 
+    @response_cache.cached("events")
+    @read_only
     def get(self, id=None):
         if id is None:
             # Check if 'ids' query parameter is provided for batch fetching
@@ -37,19 +66,225 @@ class EventResource(Resource):
                 event_ids = [int(id.strip()) for id in ids_param.split(",") if id.strip()]
 
                 # Fetch only events matching the provided IDs
-                events = Event.query.filter(Event.id.in_(event_ids)).all()
-            else:
-                # Fetch all events if no ids parameter provided
-                events = Event.query.all()
-
-            results = []
-            for event in events:
-                results.append(
-                    event.to_dict(rules=("-tickets.event", "-tickets.payment_items"))
+                events = (
+                    Event.query.options(*EVENT_LOAD_OPTIONS)
+                    .filter(Event.id.in_(event_ids))
+                    .all()
                 )
 
-            return results
+                return serialize_all(serialize_event, events)
+
+            return self.list_events()
+
+        event = db.session.execute(event_statement(id)).scalar()
+
+        if event is None:
+            return {"message": "Event not found"}, 404
+
+        return serialize_event(event)
+
+    def list_events(self):
+        """
+        Lists events one page at a time, ordered by (start_date, id)
+        Example: /events?status=active&category_id=2&limit=20&fields=id,name,start_date
+
+        The cursor for the next page is returned in the X-Next-Cursor header,
+        pass it back as ?cursor= to continue. No header means this was the last page.
+        """
+        try:
+            statement, fields, limit = events_page_statement(request.args)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        return events_page(db.session.execute(statement), fields, limit)
+
+
+# the listing is built in two halves so the async mode (asgi.py) can run the same
+# statement on its own session and shape the rows the same way
+
+
+def event_statement(id):
+    return select(Event).options(*EVENT_LOAD_OPTIONS).where(Event.id == id)
+
+
+def events_page_statement(args):
+    """The select for a page of GET /events, with (fields, limit). ValueError for bad arguments"""
+    limit = page_size(args.get("limit"))
+    filters = event_filters(args)
+
+    if args.get("cursor"):
+        filters.append(after_cursor(Event.start_date, Event.id, args["cursor"]))
+
+    fields = event_fields(args.get("fields"))
+    order = (Event.start_date, Event.id)
+
+    if fields is None:
+        # full events, including their tickets and category
+        statement = select(Event).options(*EVENT_LOAD_OPTIONS)
+    else:
+        # sparse fieldset, only the requested columns leave the database
+        statement = select(*[getattr(Event, field) for field in fields], *order)
+
+    return statement.where(*filters).order_by(*order).limit(limit + 1), fields, limit
+
+
+def events_page(result, fields, limit):
+    """(body, status, headers) for the result of events_page_statement"""
+    if fields is None:
+        events = result.scalars().all()
+        has_more = len(events) > limit
+        events = events[:limit]
+
+        results = serialize_all(serialize_event, events)
+        last = (events[-1].start_date, events[-1].id) if events else None
+    else:
+        rows = result.all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = [
+            {field: serialize_value(row[i]) for i, field in enumerate(fields)}
+            for row in rows
+        ]
+        last = tuple(rows[-1][-2:]) if rows else None
+
+    headers = {}
+
+    if has_more:
+        headers["X-Next-Cursor"] = encode_cursor(*last)
+
+    return results, 200, headers
+
+
+class EventImportResource(Resource):
+    """
+    Bulk import, see services/importer.py for the formats
+    Example: curl -X POST --data-binary @events.ndjson -H "Content-Type: application/x-ndjson" /events/import
+    """
+
+    readers = {
+        "application/x-ndjson": read_ndjson,
+        "application/jsonl": read_ndjson,
+        "text/csv": read_csv,
+    }
+
+    def post(self):
+        reader = self.readers.get(request.mimetype)
+
+        if reader is None:
+            return {"message": "Send application/x-ndjson or text/csv"}, 415
+
+        report = import_events(reader(request.stream))
+
+        if report.events:
+            response_cache.invalidate("events", "categories")
+
+        return report.to_dict(), 201 if report.events else 422
+
+
+class EventExportResource(Resource):
+    """
+    Every event with its tickets and category, streamed in batches (see services/export.py)
+    Takes the same filters as the listing: /events/export?status=active&category_id=2&format=ndjson
+    """
+
+    @role_required("admin")
+    @read_only
+    def get(self):
+        try:
+            format = export_format()
+            filters = event_filters(request.args)
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        statement = select(Event).options(*EVENT_LOAD_OPTIONS).where(*filters).order_by(Event.id)
+
+        return stream(statement, serialize_event, format)
+
+
+class EventSearchResource(Resource):
+    """
+    Full text search over the event name, description and venue
+    Example: /events/search?q=jazz nai&category_id=2&limit=10
+    Add prefix=0 to only match whole words
+    """
+
+    @response_cache.cached("events")
+    @read_only
+    def get(self):
+        query = request.args.get("q", "").strip()
+
+        if not query:
+            return {"message": "Provide a search query with ?q="}, 400
+
+        try:
+            category_id = request.args.get("category_id", type=int)
+            limit = int(request.args.get("limit", 20))
+        except ValueError:
+            return {"message": "limit must be a number"}, 400
+
+        prefix = request.args.get("prefix", "1") not in ("0", "false")
+
+        rows = search_events(query, category_id=category_id, limit=limit, prefix=prefix)
+
+        return [
+            {key: serialize_value(value) for key, value in row._mapping.items()}
+            for row in rows
+        ]
+
+
+EVENT_FIELDS = [column.key for column in Event.__table__.columns]
+
+
+def query_date(args, name):
+    try:
+        return parse_event_date(args[name])
+    except ValueError:
+        raise ValueError(f"{name} must look like 2030-01-01T18:00:00Z")
+
+
+def event_filters(args):
+    filters = []
+
+    if args.get("status"):
+        filters.append(Event.status == args["status"])
+
+    if args.get("category_id"):
+        try:
+            category_id = int(args["category_id"])
+        except ValueError:
+            raise ValueError("category_id must be a number")
+
+        filters.append(Event.category_id == category_id)
+
+    if args.get("venue"):
+        filters.append(Event.venue == args["venue"])
+
+    # date range on the start date, same format the events are created with
+    if args.get("start_from"):
+        filters.append(Event.start_date >= query_date(args, "start_from"))
+
+    if args.get("start_to"):
+        filters.append(Event.start_date <= query_date(args, "start_to"))
+
+    return filters
+
+
+def event_fields(fields_param):
+    if not fields_param:
+        return None
+
+    fields = [field.strip() for field in fields_param.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in EVENT_FIELDS]
+
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    return fields
 
-        event = Event.query.filter(Event.id == id).first()
 
-        return event.to_dict(rules=("-tickets.event", "-tickets.payment_items"))
+def serialize_value(value):
+    # keep the same datetime format to_dict uses
+    if isinstance(value, datetime):
+        return value.strftime(Event.datetime_format)
+    return value
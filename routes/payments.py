@@ -0,0 +1,81 @@
+import hmac
+
+from flask import current_app
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask_restful import Resource
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from models import Payment, db
+from services.auth import role_required
+from services.database import read_only
+from services.export import export_format, stream
+from services.mpesa import parse_callback
+from services.payments import settle
+from services.schema import json_body
+from services.serializer import serializer_for
+
+# a payment with its line items, the jobs are internal
+serialize_payment = serializer_for(Payment)
+
+
+class PaymentResource(Resource):
+    # the customer polls this after checkout until the payment is paid or failed
+    @jwt_required()
+    def get(self, id):
+        payment = db.session.get(Payment, id)
+
+        if payment is None or payment.user_id != int(get_jwt_identity()):
+            return {"message": "Payment not found"}, 404
+
+        return {
+            "id": payment.id,
+            "status": payment.status,
+            "amount": payment.amount,
+            "mpesa_code": payment.mpesa_code,
+            "result_desc": payment.result_desc,
+        }
+
+
+class PaymentCallbackResource(Resource):
+    """
+    M-Pesa posts the result of every STK push here. The answer has to be quick and
+    M-Pesa may send the same result again, settle() makes repeats a no-op.
+    """
+
+    def post(self, token):
+        expected = current_app.config.get("MPESA_CALLBACK_TOKEN")
+
+        # M-Pesa doesn't sign callbacks, the secret in the url is what tells them apart.
+        # compared as bytes, compare_digest refuses str with anything but ASCII in it
+        if not expected or not hmac.compare_digest(token.encode(), expected.encode()):
+            return {"message": "Not found"}, 404
+
+        try:
+            result = parse_callback(json_body())
+        except ValueError as e:
+            return {"ResultCode": 1, "ResultDesc": str(e)}, 400
+
+        outcome = settle(result)
+        db.session.commit()
+
+        if outcome == "unknown":
+            current_app.logger.warning("M-Pesa callback for unknown request %s", result.checkout_request_id)
+
+        # anything but a 200 makes M-Pesa retry, and retrying won't change the outcome
+        return {"ResultCode": 0, "ResultDesc": "Accepted"}
+
+
+class PaymentExportResource(Resource):
+    """Every payment with its items, streamed in batches (see services/export.py). ?format=ndjson"""
+
+    @role_required("admin")
+    @read_only
+    def get(self):
+        try:
+            format = export_format()
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        statement = select(Payment).options(selectinload(Payment.items)).order_by(Payment.id)
+
+        return stream(statement, serialize_payment, format)
@@ -0,0 +1,57 @@
+from flask_restful import Resource
+from sqlalchemy import func, select
+from models import Category, CategoryStats, Event, EventStats, Ticket, TicketStats, db
+from services.auth import role_required
+from services.database import read_only
+
+# the totals are kept up to date by event creation and confirmed payments (see services/stats.py),
+# these endpoints only look them up, nothing is counted at request time
+
+
+def totals(stats):
+    return (
+        func.coalesce(stats.tickets_sold, 0).label("tickets_sold"),
+        func.coalesce(stats.revenue, 0).label("revenue"),
+    )
+
+
+class CategoryStatsResource(Resource):
+    @role_required("admin")
+    @read_only
+    def get(self):
+        rows = db.session.execute(
+            select(
+                Category.id,
+                Category.name,
+                func.coalesce(CategoryStats.event_count, 0).label("event_count"),
+                *totals(CategoryStats),
+            )
+            .outerjoin(CategoryStats, CategoryStats.category_id == Category.id)
+            .order_by(Category.id)
+        )
+
+        return [dict(row._mapping) for row in rows]
+
+
+class EventStatsResource(Resource):
+    @role_required("admin")
+    @read_only
+    def get(self, id):
+        event = db.session.execute(
+            select(Event.id, Event.name, *totals(EventStats))
+            .outerjoin(EventStats, EventStats.event_id == Event.id)
+            .where(Event.id == id)
+        ).first()
+
+        if event is None:
+            return {"message": "Event not found"}, 404
+
+        # one row per tier
+        tiers = db.session.execute(
+            select(Ticket.id, Ticket.name, Ticket.price, Ticket.tickets_available, *totals(TicketStats))
+            .outerjoin(TicketStats, TicketStats.ticket_id == Ticket.id)
+            .where(Ticket.event_id == id)
+            .order_by(Ticket.id)
+        )
+
+        return {**event._mapping, "tiers": [dict(tier._mapping) for tier in tiers]}
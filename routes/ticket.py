@@ -1,32 +1,73 @@
-from flask_restful import Resource, reqparse
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
 from models import Ticket, db
+from services.cache import response_cache
+from services.inventory import HoldLimitReached, reserve
+from services.schema import Field, Schema
+from services.waitingroom import waiting_room
 
-parser = reqparse.RequestParser()
-parser.add_argument("name", type=str, required=True, help="Ticket name is required")
-parser.add_argument("price", type=int, required=True, help="Price is required")
-parser.add_argument(
-    "tickets_available", type=int, required=True, help="Provide tickets available"
+ticket_schema = Schema(
+    name=Field(str, required="Ticket name is required"),
+    price=Field(int, required="Price is required", minimum=0),
+    tickets_available=Field(int, required="Provide tickets available", minimum=0),
+    event_id=Field(int, required="Event is required"),
 )
-parser.add_argument("event_id", type=int, required=True, help="Event is required")
 
 
 class TicketResource(Resource):
     def post(self):
-        data = parser.parse_args()
+        data = ticket_schema.parse()
 
-        # for a single event, we cannot have the same ticket name
-        # so we add a check for that using both the name and event id
-        exists = Ticket.query.filter_by(
-            name=data["name"], event_id=data["event_id"]
-        ).first()
+        ticket = Ticket(**data)
+
+        db.session.add(ticket)
 
-        if exists is not None:
+        # for a single event, we cannot have the same ticket name.
+        # the uq_tickets_event_id_name constraint checks that for us as part of the insert
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
             return {"message": f"Ticket with name {data['name']} already exists"}, 422
 
-        ticket = Ticket(**data)
+        # events are listed together with their tickets.
+        # reservations and checkouts don't invalidate, so the stock shown in listings
+        # can be up to CACHE_TTL seconds old, /reserve and /checkout always check the real count
+        response_cache.invalidate("events")
+
+        return {"message": "Ticket created successfully"}, 201
 
-        db.session.add(ticket)
+
+reserve_schema = Schema(quantity=Field(int, required="Quantity is required", minimum=1))
+
+
+class TicketReservationResource(Resource):
+    # a hold belongs to the buyer who made it, only their checkout can use it.
+    # during an on-sale only buyers let through the event's waiting room get this far
+    @jwt_required()
+    @waiting_room.guard(lambda id: [id])
+    def post(self, id):
+        data = reserve_schema.parse()
+
+        if db.session.get(Ticket, id) is None:
+            return {"message": "Ticket not found"}, 404
+
+        try:
+            reservation = reserve(int(get_jwt_identity()), id, data["quantity"])
+        except HoldLimitReached as e:
+            # the expired holds we released still need to be saved
+            db.session.commit()
+            return {"message": e.message}, 409
+
+        if reservation is None:
+            # the expired holds we released still need to be saved
+            db.session.commit()
+            return {"message": "Not enough tickets available"}, 409
 
         db.session.commit()
 
-        return {"message": "Ticket created successfully"}, 201
+        return {
+            "message": "Tickets reserved",
+            "reservation": reservation.to_dict(),
+        }, 201
@@ -0,0 +1,39 @@
+from routes.users import (
+    UserResource,
+    UserBulkResource,
+    UserSignup,
+    LoginResource,
+    RefreshResource,
+    LogoutResource,
+)
+from routes.category import CategoryResource
+from routes.event import EventResource, EventImportResource, EventExportResource, EventSearchResource
+from routes.ticket import TicketResource, TicketReservationResource
+from routes.checkout import CheckoutResource
+from routes.stats import CategoryStatsResource, EventStatsResource
+from routes.payments import PaymentResource, PaymentCallbackResource, PaymentExportResource
+from routes.waitingroom import QueueResource
+
+
+# kept in one place so the app and the benchmark scripts register the same endpoints
+def register_routes(api):
+    api.add_resource(UserResource, "/users")
+    api.add_resource(UserBulkResource, "/users/bulk")
+    api.add_resource(UserSignup, "/sign-up")
+    api.add_resource(LoginResource, "/login")
+    api.add_resource(RefreshResource, "/refresh")
+    api.add_resource(LogoutResource, "/logout")
+    api.add_resource(CategoryResource, "/categories")
+    api.add_resource(EventResource, "/events", "/events/<int:id>")
+    api.add_resource(EventImportResource, "/events/import")
+    api.add_resource(EventExportResource, "/events/export")
+    api.add_resource(EventSearchResource, "/events/search")
+    api.add_resource(TicketResource, "/tickets")
+    api.add_resource(TicketReservationResource, "/tickets/<int:id>/reserve")
+    api.add_resource(CheckoutResource, "/checkout")
+    api.add_resource(QueueResource, "/events/<int:id>/queue")
+    api.add_resource(PaymentResource, "/payments/<int:id>")
+    api.add_resource(PaymentExportResource, "/payments/export")
+    api.add_resource(PaymentCallbackResource, "/payments/callback/<string:token>")
+    api.add_resource(CategoryStatsResource, "/stats/categories")
+    api.add_resource(EventStatsResource, "/stats/events/<int:id>")
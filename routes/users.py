@@ -1,49 +1,67 @@
 # flask restful
-from flask_restful import Resource, reqparse
+from flask_restful import Resource
 from models import User, db
-import phonenumbers
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-from flask_bcrypt import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt
+from flask_jwt_extended import (
+    create_access_token,
+    create_refresh_token,
+    get_jwt,
+    get_jwt_identity,
+    jwt_required,
+)
+from services.auth import revocations, role_required
+from services.database import read_only
+from services.export import export_format, stream
+from services.integrity import violated_constraint
+from services.passwords import HasherBusy, password_hasher
+from services.phones import InvalidPhone
+from services.provisioning import MAX_PROVISION_USERS, USER_CONFLICTS, provision_users
+from services.ratelimit import rate_limiter
+from services.schema import Field, Schema, list_of, to_dict
+from services.serializer import serializer_for
+
+serialize_user = serializer_for(User)
 
 
 class UserResource(Resource):
-    # @jwt_required()
+    # the role comes from the token, no need to look the admin up
+    @role_required("admin")
+    @read_only
     def get(self):
-        # print("JWT", get_jwt())
-        # role = get_jwt()["role"]
+        # every user, streamed in batches so memory doesn't grow with the table (see services/export.py).
+        # ?format=ndjson for one user per line
+        try:
+            format = export_format()
+        except ValueError as e:
+            return {"message": str(e)}, 400
 
-        # if role != 'admin':
-        #     return {"message": "Unauthorized request"}, 401
+        return stream(select(User).order_by(User.id), serialize_user, format)
 
-        data = User.query.all()
 
-        result = []
+bulk_schema = Schema(users=Field(list_of(to_dict), required="A list of users is required"))
 
-        print(data)
 
-        for user in data:
-            # result.append(user.to_dict(rules=("-updated_at", "-created_at")))
-            # result.append(user.to_dict(only=("id", "name")))
-            result.append(user.to_dict())
+class UserBulkResource(Resource):
+    # corporate onboarding, creates up to MAX_PROVISION_USERS users in one request
+    @role_required("admin")
+    def post(self):
+        users = bulk_schema.parse()["users"]
 
-        print(result)
+        if len(users) > MAX_PROVISION_USERS:
+            return {"message": f"At most {MAX_PROVISION_USERS} users per request"}, 413
 
-        return result
+        report = provision_users(users)
 
+        # partial success is still a success, the report says which rows were skipped
+        return report.to_dict(), 201 if report.created else 422
 
-signup_parser = reqparse.RequestParser()
-signup_parser.add_argument(
-    "name", required=True, type=str, help="User name is required"
-)
-signup_parser.add_argument(
-    "phone", required=True, type=str, help="Phone number is required"
-)
-signup_parser.add_argument(
-    "email", required=True, type=str, help="Email address is required"
-)
-signup_parser.add_argument(
-    "password", required=True, type=str, help="Password is required"
+
+signup_schema = Schema(
+    name=Field(str, required="User name is required"),
+    phone=Field(str, required="Phone number is required"),
+    email=Field(str, required="Email address is required"),
+    password=Field(str, required="Password is required"),
 )
 
 
@@ -52,28 +70,21 @@ For security reasons, look into supporting the following
     1. Oauth
     2. 2fa (especially if using password auth)
     3. Passwordless auth -> provide an email where will a link that will automatically login in the user
-    4. Rate limiting (i.e 3 attempts to login the disable the account temporarily)
+    4. Rate limiting (done, per IP and per account, see services/ratelimit.py)
 """
 
 
 class UserSignup(Resource):
+    # before anything else, an over the limit request never gets to bcrypt
+    @rate_limiter.limit("signup", account_field="email")
     def post(self):
         try:
             # validate on the route level
-            data = signup_parser.parse_args()
-
-            # check for unique columns
-            email = User.query.filter(User.email == data["email"]).first()
-
-            if email:
-                return {"message": "Email already taken"}, 422
-
-            phone = User.query.filter(User.phone == data["phone"]).first()
+            data = signup_schema.parse()
 
-            if phone:
-                return {"message": "Phone number already taken"}, 422
-
-            pw_hash = generate_password_hash(data["password"]).decode("utf-8")
+            # no SELECTs to check the email and phone are free, the unique constraints
+            # decide when we insert (a check first would still race with other signups)
+            pw_hash = password_hasher.hash(data["password"])
 
             # handover to sqlalchemy
             # user = User(
@@ -92,50 +103,89 @@ class UserSignup(Resource):
             db.session.commit()
 
             return {"message": "User created successfully"}, 201
-        except phonenumbers.NumberParseException as e:
+        except HasherBusy as e:
+            return {"message": str(e)}, 503, {"Retry-After": "1"}
+        except InvalidPhone as e:
             return {"message": str(e), "error": "ValidationError"}, 422
         except ValueError as e:
             return {"message": str(e), "error": "ValueError"}, 422
         except IntegrityError as e:
-            print(str(e))
+            db.session.rollback()
+
+            message = USER_CONFLICTS.get(violated_constraint(e))
+
+            if message:
+                return {"message": message}, 422
+
             return {"message": "Missing Values", "error": "IntegrityError"}, 422
 
 
-login_parser = reqparse.RequestParser()
-login_parser.add_argument(
-    "email", required=True, type=str, help="Email address is required"
-)
-login_parser.add_argument(
-    "password", required=True, type=str, help="Password is required"
+login_schema = Schema(
+    email=Field(str, required="Email address is required"),
+    password=Field(str, required="Password is required"),
 )
 
 
 class LoginResource(Resource):
+    @rate_limiter.limit("login", account_field="email")
     def post(self):
-        data = login_parser.parse_args()
+        data = login_schema.parse()
 
         # 1. check if user with email exists
         exists = User.query.filter(User.email == data["email"]).first()
 
-        if exists is None:
+        # provisioned accounts have no password until one is set
+        if exists is None or exists.password is None:
             return {"message": "Invalid email or password"}, 401
 
         # generate otp and send to provided email (should have a route that validates the sent otp)
         # use magic links (generate a random unique link and send it to the provided email), once the user clicks on the link, we log them in automatically
 
         # 2. validate the password
-        is_valid_password = check_password_hash(exists.password, data["password"])
+        try:
+            is_valid_password = password_hasher.verify(exists.password, data["password"])
+        except HasherBusy as e:
+            return {"message": str(e)}, 503, {"Retry-After": "1"}
 
         if not is_valid_password:
             return {"message": "Invalid email or password"}, 401
 
-        # 3. create a jwt access token
-        access_token = create_access_token(
-            identity=exists.id, additional_claims={"role": exists.role}
-        )
+        # the cost factor changed since this hash was made, upgrade it while we have the password
+        if password_hasher.needs_rehash(exists.password):
+            try:
+                exists.password = password_hasher.hash(data["password"])
+                db.session.commit()
+            except HasherBusy:
+                # not urgent, it will be picked up on a later login
+                pass
+
+        # 3. create a short lived access token and a refresh token to get new ones with
+        claims = {"role": exists.role}
 
         return {
             "message": "Login successful",
-            "user": exists.to_dict(),
-            "access_token": access_token,
+            "user": serialize_user(exists),
+            "access_token": create_access_token(identity=str(exists.id), additional_claims=claims),
+            "refresh_token": create_refresh_token(identity=str(exists.id), additional_claims=claims),
         }
+
+
+class RefreshResource(Resource):
+    @jwt_required(refresh=True)
+    def post(self):
+        # the role is carried over from the refresh token, a demoted user gets
+        # revocations.revoke_user so their old refresh tokens stop working
+        access_token = create_access_token(
+            identity=get_jwt_identity(), additional_claims={"role": get_jwt()["role"]}
+        )
+
+        return {"access_token": access_token}
+
+
+class LogoutResource(Resource):
+    # send the access token and the refresh token, one request each, to revoke both
+    @jwt_required(verify_type=False)
+    def post(self):
+        revocations.revoke_token(get_jwt())
+
+        return {"message": "Logged out"}
@@ -0,0 +1,66 @@
+from flask import request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask_restful import Resource
+from sqlalchemy import select
+from models import Event, Ticket, db
+from services.auth import role_required
+from services.ratelimit import rate_limiter
+from services.schema import Field, Schema
+from services.waitingroom import TOKEN_HEADER, waiting_room
+
+room_schema = Schema(
+    rate=Field(int, required="Rate (buyers let in per second) is required", minimum=1),
+    burst=Field(int, default=0, minimum=0),
+)
+
+
+class QueueResource(Resource):
+    """
+    The waiting room of an event (see services/waitingroom.py). Joining and polling
+    only talk to the waiting room store, so the crowd never reaches the database.
+    """
+
+    @jwt_required()
+    @rate_limiter.limit("join", account=get_jwt_identity)
+    def post(self, id):
+        joined = waiting_room.join(id, get_jwt_identity())
+
+        if joined is None:
+            return {"message": "There is no queue for this event, go ahead"}, 404
+
+        token, status = joined
+
+        return {"token": token, **status}, 201
+
+    def get(self, id):
+        data = waiting_room.read_token(request.headers.get(TOKEN_HEADER, ""))
+
+        if data is None or data[0] != id:
+            return {"message": "Invalid queue token"}, 401
+
+        status = waiting_room.status(id, data[1])
+
+        if status is None:
+            # closed while they waited
+            return {"event_id": id, "number": data[1], "position": 0, "admitted": True}
+
+        return status
+
+    @role_required("admin")
+    def put(self, id):
+        data = room_schema.parse()
+
+        if db.session.get(Event, id) is None:
+            return {"message": "Event not found"}, 404
+
+        # the only time the tickets are read, the gate on reserve and checkout works off this list
+        ticket_ids = db.session.execute(select(Ticket.id).where(Ticket.event_id == id)).scalars().all()
+        waiting_room.open(id, data["rate"], data["burst"], ticket_ids)
+
+        return {"message": "Waiting room open", "event_id": id, **data}
+
+    @role_required("admin")
+    def delete(self, id):
+        waiting_room.close(id)
+
+        return {"message": "Waiting room closed", "event_id": id}
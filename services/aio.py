@@ -0,0 +1,122 @@
+"""
+Async database access and CPU offloading for the ASGI mode (asgi.py)
+
+The async routes use the same models and statements as the Flask ones, run on an
+async engine for the same database:
+
+    sqlite:///...        -> sqlite+aiosqlite:///...     (needs aiosqlite)
+    postgresql://...     -> postgresql+asyncpg://...    (needs asyncpg)
+    mysql://...          -> mysql+aiomysql://...        (needs aiomysql)
+
+A read replica (READ_REPLICA_URL) gets an async engine too and read sessions go to
+it, like @read_only does for the Flask routes. Pool sizes and the sqlite pragmas
+are the same as the sync engines'.
+
+While a query is waiting on the database the event loop serves other requests.
+Serializing rows and encoding the body are pure CPU and would stall the loop for
+the whole page, so they go to a small thread pool with offload():
+
+    events = (await session.execute(statement)).scalars().all()
+    body = await async_db.offload(encode_page, events)
+
+ASYNC_CPU_WORKERS sets the size of that pool (the number of CPUs by default).
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+from services.database import REPLICA_BIND, sqlite_pragmas
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_url(url):
+    """The same database through its async driver, a url that already names one is kept"""
+    url = make_url(url)
+    backend, _, driver = url.drivername.partition("+")
+
+    if driver in ("aiosqlite", "asyncpg", "aiomysql"):
+        return url
+
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {url.drivername}")
+
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncDatabase:
+    def __init__(self):
+        self.engines = {}
+        self._sessions = {}
+        self._pool = None
+
+    def init_app(self, app):
+        # only needed by the ASGI mode, the WSGI app never loads the async drivers
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        app.config.setdefault("ASYNC_CPU_WORKERS", os.cpu_count() or 1)
+
+        # the urls flask-sqlalchemy settled on (relative sqlite paths are in the instance folder)
+        with app.app_context():
+            urls = {name: engine.url for name, engine in db.engines.items()}
+
+        options = {None: app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})}
+
+        for name, bind in app.config.get("SQLALCHEMY_BINDS", {}).items():
+            if isinstance(bind, dict):
+                options[name] = {key: value for key, value in bind.items() if key != "url"}
+
+        for name, url in urls.items():
+            engine = create_async_engine(async_url(url), **options.get(name, {}))
+
+            if engine.dialect.name == "sqlite" and app.config.get("SQLITE_PRAGMAS", True):
+                on_connect = sqlite_pragmas(
+                    app.config.get("SQLITE_BUSY_TIMEOUT_MS", 5000),
+                    app.config.get("SQLITE_MMAP_SIZE", 0),
+                )
+                event.listen(engine.sync_engine, "connect", on_connect)
+
+            self.engines[name] = engine
+            # the rows are serialized after the session is gone, nothing may be expired by then
+            self._sessions[name] = async_sessionmaker(engine, expire_on_commit=False)
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=app.config["ASYNC_CPU_WORKERS"], thread_name_prefix="async-cpu"
+        )
+
+    @asynccontextmanager
+    async def session(self, read_only=True):
+        """An AsyncSession, on the replica when there is one and read_only is set"""
+        name = REPLICA_BIND if read_only and REPLICA_BIND in self._sessions else None
+
+        async with self._sessions[name]() as session:
+            yield session
+
+    async def offload(self, fn, *args, **kwargs):
+        """Runs fn on the CPU pool, with the caller's context variables"""
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(self._pool, call)
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+async_db = AsyncDatabase()
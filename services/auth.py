@@ -0,0 +1,198 @@
+"""
+Authentication
+
+Everything a protected endpoint needs is in the token itself: the user id is the
+subject and the role is a claim, so checking access never loads the user.
+
+    @role_required("admin")
+    def get(self): ...
+
+Logging out (or locking a user out) has to be able to take a token back before it
+expires though. Revocations are stored in the revoked_tokens table and every worker
+keeps a bloom filter of them in memory:
+
+- a token that isn't in the filter is definitely not revoked, no query at all.
+  That is nearly every request.
+- a token that is in the filter is confirmed against the table, the filter has
+  false positives (about REVOCATION_ERROR_RATE of them) but no false negatives.
+- every REVOCATION_REFRESH_SECONDS the filter picks up the rows added since it last
+  looked (WHERE id > last seen id), so a revocation made by another worker takes
+  at most that long to apply. Revocations made by this worker apply straight away.
+
+Access tokens are short lived (JWT_ACCESS_TOKEN_EXPIRES), POST /refresh swaps a
+refresh token for a new access token, again using only the claims in the token.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from sqlalchemy import delete, exists, insert, select
+
+from models import RevokedToken, db
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        # the standard sizing for n items at false positive rate p
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # two 64 bit hashes combined give as many independent ones as we need
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+class RevocationList:
+    def __init__(self):
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.refresh_seconds = 5
+        self.refresh_expires = timedelta(days=30)
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        self._last_id = 0
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("REVOCATION_CAPACITY", 100000)
+        app.config.setdefault("REVOCATION_ERROR_RATE", 0.001)
+        app.config.setdefault("REVOCATION_REFRESH_SECONDS", 5)
+
+        self.capacity = app.config["REVOCATION_CAPACITY"]
+        self.error_rate = app.config["REVOCATION_ERROR_RATE"]
+        self.refresh_seconds = app.config["REVOCATION_REFRESH_SECONDS"]
+        # a user wide revocation has to outlive the longest lived token it covers
+        self.refresh_expires = app.config.get("JWT_REFRESH_TOKEN_EXPIRES") or timedelta(days=30)
+
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        self._last_id = 0
+        self._refreshed_at = 0.0
+
+        app.extensions["flask-jwt-extended"].token_in_blocklist_loader(self.is_revoked)
+
+    def _load(self, rows):
+        for row_id, jti, user_id in rows:
+            self._filter.add(jti if jti is not None else user_key(user_id))
+            self._last_id = max(self._last_id, row_id)
+
+    def refresh(self):
+        """Adds the revocations made since the last refresh, rebuilds the filter when it's full"""
+        with self._lock:
+            if self._filter.count >= self.capacity:
+                db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at < datetime.now()))
+                db.session.commit()
+                self._filter = BloomFilter(self.capacity, self.error_rate)
+                self._last_id = 0
+
+            rows = db.session.execute(
+                select(RevokedToken.id, RevokedToken.jti, RevokedToken.user_id)
+                .where(RevokedToken.id > self._last_id)
+                .order_by(RevokedToken.id)
+            ).all()
+
+            self._load(rows)
+            self._refreshed_at = time.monotonic()
+
+    def is_revoked(self, jwt_header, jwt_payload):
+        if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh()
+
+        jti = jwt_payload["jti"]
+
+        if jti in self._filter and db.session.scalar(select(exists().where(RevokedToken.jti == jti))):
+            return True
+
+        user_id = jwt_payload["sub"]
+
+        if user_key(user_id) in self._filter:
+            # every token the user had at the time was revoked, newer ones are fine
+            issued_at = datetime.fromtimestamp(jwt_payload["iat"])
+            return db.session.scalar(
+                select(
+                    exists().where(
+                        RevokedToken.jti.is_(None),
+                        RevokedToken.user_id == int(user_id),
+                        RevokedToken.revoked_at >= issued_at,
+                    )
+                )
+            )
+
+        return False
+
+    def _insert(self, values):
+        row_id = db.session.execute(insert(RevokedToken).returning(RevokedToken.id), values).scalar()
+        db.session.commit()
+
+        # no need to wait for the next refresh in this worker
+        with self._lock:
+            self._filter.add(values["jti"] if values.get("jti") else user_key(values["user_id"]))
+
+        return row_id
+
+    def revoke_token(self, jwt_payload):
+        now = datetime.now()
+        # tokens made with JWT_*_TOKEN_EXPIRES=False have no exp
+        expires_at = (
+            datetime.fromtimestamp(jwt_payload["exp"]) if "exp" in jwt_payload else now + self.refresh_expires
+        )
+
+        return self._insert(
+            {
+                "jti": jwt_payload["jti"],
+                "user_id": int(jwt_payload["sub"]),
+                "revoked_at": now,
+                "expires_at": expires_at,
+            }
+        )
+
+    def revoke_user(self, user_id):
+        """Revokes every token issued to the user so far, e.g. when they are removed or demoted"""
+        now = datetime.now()
+        return self._insert(
+            {"jti": None, "user_id": user_id, "revoked_at": now, "expires_at": now + self.refresh_expires}
+        )
+
+
+def role_required(*roles):
+    """Like @jwt_required() but the token's role claim also has to be one of roles"""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            verify_jwt_in_request()
+
+            if get_jwt().get("role") not in roles:
+                return {"message": "Unauthorized request"}, 403
+
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+revocations = RevocationList()
@@ -0,0 +1,195 @@
+"""
+Response cache for catalog reads
+
+The event and category listings are read thousands of times for every write, so
+we keep the serialized result around instead of going to the database each time.
+
+Invalidation: every cached key belongs to a namespace ("events", "categories") and
+carries that namespace's current version. A write bumps the version, so all the old
+keys simply stop being looked up and age out of the cache on their own. This works
+the same for the in-process store and a shared one like redis (no key scanning).
+
+Every cached response also gets an ETag. When the client sends it back in
+If-None-Match we answer 304 straight from the cache without re-serializing anything.
+The same entry is sent as JSON or MessagePack depending on Accept, each encoding
+has its own ETag (see representation_etag) and every answer varies on Accept.
+
+Backends:
+    LRUCache     in-process, bounded size, per entry TTL (the default)
+    RedisCache   shared between workers, used when CACHE_URL is set (needs the redis package)
+
+Any object with get/set/delete can stand in for a shared backend, e.g. in a benchmark.
+"""
+
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from services.representations import negotiate, representation_etag
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                return None
+
+            value, expires_at = item
+
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    def __init__(self, url, ttl=30, prefix="tickets:"):
+        # only needed when a shared cache is configured
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCache()
+        self.enabled = True
+
+    def init_app(self, app):
+        app.config.setdefault("CACHE_ENABLED", True)
+        app.config.setdefault("CACHE_URL", None)
+        app.config.setdefault("CACHE_TTL", 30)
+        app.config.setdefault("CACHE_MAX_ENTRIES", 1024)
+
+        self.enabled = app.config["CACHE_ENABLED"]
+
+        if app.config["CACHE_URL"]:
+            self.backend = RedisCache(app.config["CACHE_URL"], ttl=app.config["CACHE_TTL"])
+        else:
+            self.backend = LRUCache(
+                max_entries=app.config["CACHE_MAX_ENTRIES"], ttl=app.config["CACHE_TTL"]
+            )
+
+    def version(self, namespace):
+        key = f"version:{namespace}"
+        version = self.backend.get(key)
+
+        if version is None:
+            # a random token rather than a counter, if the version itself gets evicted
+            # we must never end up back on an old number and serve stale entries
+            version = uuid.uuid4().hex
+            self.backend.set(key, version, ttl=0)
+
+        return version
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.set(f"version:{namespace}", uuid.uuid4().hex, ttl=0)
+
+    def key(self, namespace, full_path):
+        """The cache key of a GET for full_path (path?query, as request.full_path gives it)"""
+        return f"{namespace}:{self.version(namespace)}:{full_path}"
+
+    def cached(self, namespace):
+        """Caches successful GET responses of a Resource method under namespace"""
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+
+                key = self.key(namespace, request.full_path)
+                entry = self.backend.get(key)
+
+                if entry is None:
+                    data, status, headers = unpack(fn(*args, **kwargs))
+
+                    # only successful responses are cached
+                    if status != 200:
+                        return data, status, headers
+
+                    entry = make_entry(data, headers)
+                    self.backend.set(key, entry)
+
+                etag = representation_etag(entry["etag"], negotiate(request.accept_mimetypes))
+
+                if request.if_none_match.contains(etag):
+                    return Response(status=304, headers={"ETag": f'"{etag}"', "Vary": "Accept"})
+
+                return entry["data"], 200, {**entry["headers"], "ETag": f'"{etag}"'}
+
+            return wrapper
+
+        return decorator
+
+
+def unpack(result):
+    """Normalizes what a Resource method returned into (data, status, headers)"""
+    if isinstance(result, tuple):
+        data = result[0]
+        status = result[1] if len(result) > 1 else 200
+        headers = dict(result[2]) if len(result) > 2 else {}
+        return data, status, headers
+
+    return result, 200, {}
+
+
+def make_entry(data, headers):
+    return {"data": data, "headers": headers, "etag": make_etag(data)}
+
+
+def make_etag(data):
+    body = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(body.encode()).hexdigest()
+
+
+response_cache = ResponseCache()
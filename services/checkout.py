@@ -0,0 +1,163 @@
+"""
+Checkout
+
+Turns a cart into one Payment and one PaymentItem per ticket type, in a single
+transaction and with a fixed number of statements no matter how long the cart is:
+
+    0. the sweep of expired holds (services/inventory.py, two statements)
+    1. one SELECT ... WHERE id IN (...) to load prices and stock
+    2. one DELETE ... RETURNING for the buyer's live holds on those tickets
+    3. one conditional UPDATE (with a CASE per ticket) to take the rest of the stock
+    4. one INSERT for the payment
+    5. one executemany INSERT for all the payment items
+    6. one INSERT for the job that sends the M-Pesa prompt
+
+Tickets the buyer is holding (POST /tickets/<id>/reserve) were taken out of stock
+when the hold was made, so the hold is used up instead of taking them again. Only
+what the holds don't cover comes out of stock, and when more was held than bought
+the rest goes back. Expired holds don't count, their stock is returned by the
+sweep, which runs first so stock held by abandoned holds is back on sale even when
+nobody calls /reserve any more.
+
+The payment starts out pending, the customer confirms it on their phone and
+the payment workers take it from there (see services/payments.py). The stock
+stays taken meanwhile and goes back if the payment fails.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import case, delete, insert, select, update
+
+from models import Payment, PaymentItem, Reservation, Ticket, db
+from services.inventory import release_expired
+from services.payments import enqueue
+
+
+class CheckoutError(Exception):
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def merge_cart(items):
+    """Collapses repeated ticket types into a single line, {ticket_id: quantity}"""
+    cart = {}
+
+    for item in items:
+        try:
+            ticket_id = int(item["ticket_id"])
+            quantity = int(item["quantity"])
+        except (KeyError, TypeError, ValueError):
+            raise CheckoutError("Each item needs a ticket_id and a quantity")
+
+        if quantity < 1:
+            raise CheckoutError("Quantity must be at least 1")
+
+        cart[ticket_id] = cart.get(ticket_id, 0) + quantity
+
+    if not cart:
+        raise CheckoutError("Cart is empty")
+
+    return cart
+
+
+def use_holds(user_id, ticket_ids):
+    """Deletes the user's live holds on ticket_ids, {ticket_id: quantity held}"""
+    held = {}
+
+    # a hold that expires meanwhile is either deleted here or by the sweep that returns
+    # its stock, never both, whichever DELETE gets the row
+    rows = db.session.execute(
+        delete(Reservation)
+        .where(
+            Reservation.user_id == user_id,
+            Reservation.ticket_id.in_(ticket_ids),
+            Reservation.expires_at > datetime.now(),
+        )
+        .returning(Reservation.ticket_id, Reservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    for ticket_id, quantity in rows:
+        held[ticket_id] = held.get(ticket_id, 0) + quantity
+
+    return held
+
+
+def checkout(user_id, items):
+    """
+    Creates the payment for a cart and takes the stock, using up the user's holds first.
+    Raises CheckoutError when the cart can't be fulfilled, in which case the
+    caller has to roll back. The caller is responsible for committing.
+    """
+    cart = merge_cart(items)
+
+    # buyers who go straight to checkout would otherwise never see expired holds come back
+    release_expired()
+
+    prices = dict(
+        db.session.execute(
+            select(Ticket.id, Ticket.price).where(Ticket.id.in_(cart.keys()))
+        ).all()
+    )
+
+    missing = [ticket_id for ticket_id in cart if ticket_id not in prices]
+
+    if missing:
+        raise CheckoutError(f"Tickets not found: {missing}", 404)
+
+    held = use_holds(user_id, cart.keys())
+
+    # what still has to come out of stock per ticket, negative when more was held than bought
+    needed = {t: q - held.get(t, 0) for t, q in cart.items() if q != held.get(t, 0)}
+
+    if needed:
+        # one statement for the whole cart, every line has to have enough stock
+        # otherwise the row count will be short and we undo the lot (holds included).
+        # a negative line gives the extra back and always matches
+        requested = case(needed, value=Ticket.id)
+
+        result = db.session.execute(
+            update(Ticket)
+            .where(Ticket.id.in_(needed.keys()), Ticket.tickets_available >= requested)
+            .values(tickets_available=Ticket.tickets_available - requested)
+            .execution_options(synchronize_session=False)
+        )
+
+        if result.rowcount != len(needed):
+            raise CheckoutError("Not enough tickets available", 409)
+
+    total = sum(prices[t] * q for t, q in cart.items())
+
+    payment_id = db.session.execute(
+        insert(Payment)
+        .values(user_id=user_id, status="pending", amount=total)
+        .returning(Payment.id)
+    ).scalar_one()
+
+    db.session.execute(
+        insert(PaymentItem),
+        [
+            {
+                "payment_id": payment_id,
+                "ticket_id": ticket_id,
+                "quantity": quantity,
+                "unit_price": prices[ticket_id],
+            }
+            for ticket_id, quantity in cart.items()
+        ],
+    )
+
+    # written with the payment, so the prompt can't get lost if we crash after committing
+    enqueue([payment_id], "stk_push")
+
+    return {
+        "payment_id": payment_id,
+        "status": "pending",
+        "total": total,
+        "items": [
+            {"ticket_id": t, "quantity": q, "unit_price": prices[t]}
+            for t, q in cart.items()
+        ],
+    }
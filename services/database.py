@@ -0,0 +1,77 @@
+"""
+Database engine setup
+
+- sqlite pragmas: WAL lets readers carry on while a write is in progress,
+  synchronous=NORMAL is safe with WAL and avoids an fsync per commit,
+  busy_timeout makes writers wait for the lock instead of failing at once,
+  mmap_size lets reads come straight from the OS page cache.
+
+- read replica: GET handlers decorated with @read_only send their queries to the
+  "replica" bind when one is configured (READ_REPLICA_URL). Anything that writes,
+  or any request without the decorator, keeps using the primary.
+"""
+
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and has_app_context()
+            and g.get("use_replica")
+            and REPLICA_BIND in self._db.engines
+        ):
+            return self._db.engines[REPLICA_BIND]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(fn):
+    """Routes the queries of a Resource method to the read replica"""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            g.use_replica = False
+
+    return wrapper
+
+
+def sqlite_pragmas(busy_timeout_ms, mmap_size):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.close()
+
+    return on_connect
+
+
+def configure_engines(app, db):
+    """Call after db.init_app, applies the per connection settings to every engine"""
+    if not app.config.get("SQLITE_PRAGMAS", True):
+        return
+
+    on_connect = sqlite_pragmas(
+        app.config.get("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        app.config.get("SQLITE_MMAP_SIZE", 0),
+    )
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", on_connect)
@@ -0,0 +1,107 @@
+"""
+Streaming exports
+
+Dumping a whole table the way the list endpoints answer (all the rows as ORM
+objects, then a list of dicts, then one big JSON string) needs the table in memory
+three times over, and the first byte only goes out once the last row is encoded.
+Here the rows are read yield_per at a time, each batch is serialized and encoded as
+it arrives and sent as one chunk of the response, so memory stays flat however big
+the table gets:
+
+    return stream(select(User).order_by(User.id), serialize_user)
+
+Two formats, picked with ?format= or the Accept header:
+
+    json     (default) one JSON array, the same objects the list endpoints return
+    ndjson   one object per line, application/x-ndjson, easy to process line by line
+
+Eager loading still works: joinedload for many-to-one and selectinload for
+collections run once per batch. The statement runs before the response starts, so
+a bad query is still a normal error response. Once rows are on their way the status
+can't change any more, a failure part way through is logged and cuts the body short
+(invalid JSON, or a missing last line for ndjson).
+
+EXPORT_BATCH_SIZE sets the rows per batch (and per chunk), 1000 by default.
+"""
+
+from flask import Response, current_app, request, stream_with_context
+
+from models import db
+from services.representations import json_encoder
+
+NDJSON = "application/x-ndjson"
+FORMATS = {"json": "application/json", "ndjson": NDJSON}
+
+
+def export_format():
+    """json or ndjson, from ?format= or else the Accept header. ValueError for anything else"""
+    name = request.args.get("format")
+
+    if name is None:
+        return "ndjson" if request.accept_mimetypes.best_match(FORMATS.values()) == NDJSON else "json"
+
+    if name not in FORMATS:
+        raise ValueError(f"Unknown format {name}, use one of: {', '.join(FORMATS)}")
+
+    return name
+
+
+def batches(result, serializer, encode):
+    """Encoded rows, one list per batch"""
+    for partition in result.partitions():
+        yield [encode(serializer(row)) for row in partition]
+
+
+def json_array(encoded):
+    yield b"["
+    first = True
+
+    for rows in encoded:
+        if not rows:
+            continue
+
+        yield (b"," if not first else b"") + b",".join(rows)
+        first = False
+
+    yield b"]\n"
+
+
+def ndjson_lines(encoded):
+    for rows in encoded:
+        if rows:
+            yield b"\n".join(rows) + b"\n"
+
+
+def stream(statement, serializer, format=None):
+    """
+    Streams the rows of a select() of one entity as a JSON array or NDJSON.
+    format defaults to export_format() (call that first to turn a bad ?format= into a 400).
+    """
+    format = format or export_format()
+    batch_size = current_app.config.get("EXPORT_BATCH_SIZE", 1000)
+
+    # the body is sent after the request's app context has been torn down, and db.session with it,
+    # so the export has a session of its own that lives as long as the response
+    session = db.session.session_factory()
+
+    try:
+        # executed here, inside the view (and its read_only replica routing), only the fetching is streamed
+        result = session.execute(statement.execution_options(yield_per=batch_size)).scalars()
+    except Exception:
+        session.close()
+        raise
+
+    # the same JSON_ENCODER as every other response, always compact so a row stays on one line
+    encoded = batches(result, serializer, json_encoder())
+    body = json_array(encoded) if format == "json" else ndjson_lines(encoded)
+
+    def generate():
+        try:
+            yield from body
+        except Exception:
+            current_app.logger.exception("export of %s failed part way through", request.path)
+        finally:
+            result.close()
+            session.close()
+
+    return Response(stream_with_context(generate()), mimetype=FORMATS[format])
@@ -0,0 +1,340 @@
+"""
+Bulk event import
+
+Promoters upload whole catalogs at once. The body is read as a stream, one row at a
+time, so a large upload never has to sit in memory in full. Rows are validated and
+inserted in chunks of IMPORT_BATCH_SIZE, each chunk in its own transaction:
+
+    1. one SELECT to check the chunk's category ids exist
+    2. one executemany INSERT ... RETURNING for the events
+    3. one executemany INSERT for all their tickets
+    4. one upsert of the categories' event counts (see services/stats.py)
+
+Rows that fail validation (missing fields, values of the wrong type, lines that
+aren't valid UTF-8) are skipped and reported back with their row number, the rest
+of the upload carries on. A chunk the database refuses (a constraint, a value it won't
+take) is retried one row per transaction, so only the rows that actually fail are
+reported, each with the database's own error.
+
+Formats:
+
+NDJSON, one event per line, tickets nested
+    {"name": "...", "description": "...", "venue": "...", "poster": "...",
+     "category_id": 1, "start_date": "2030-01-01T18:00:00Z", "end_date": "...",
+     "tickets": [{"name": "Regular", "price": 1000, "tickets_available": 500}]}
+
+CSV, one event per row with a header line, tickets as name:price:available separated by ";"
+    name,description,venue,poster,category_id,start_date,end_date,status,tickets
+    Concert,...,2030-01-01T18:00:00Z,2030-01-01T23:00:00Z,active,Regular:1000:500;VIP:5000:50
+"""
+
+import csv
+import json
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError
+
+from models import Category, Event, Ticket, db, parse_event_date
+from services.stats import record_events
+
+IMPORT_BATCH_SIZE = 500
+
+# keep the response a reasonable size when a whole file is bad
+MAX_REPORTED_ERRORS = 1000
+
+REQUIRED_FIELDS = ("name", "description", "venue", "poster", "category_id", "start_date", "end_date")
+
+# NDJSON can put anything in a field, these have to be strings
+TEXT_FIELDS = ("name", "description", "venue", "poster", "status")
+
+STATUSES = Event.__table__.c.status.type.enums
+
+
+class ImportReport:
+    def __init__(self):
+        self.events = 0
+        self.tickets = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, row, errors):
+        self.failed += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "errors": errors})
+
+    def to_dict(self):
+        return {
+            "imported": self.events,
+            "tickets": self.tickets,
+            "failed": self.failed,
+            # category checks happen per chunk, so put the report back in file order
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def decoded_lines(stream, bad):
+    """
+    The lines of a binary stream as text. A line that isn't valid UTF-8 comes out with
+    replacement characters and its line number is added to bad, for the reader to report.
+    """
+    for number, line in enumerate(stream, start=1):
+        try:
+            yield line.decode("utf-8", errors="strict")
+        except UnicodeDecodeError:
+            bad.add(number)
+            yield line.decode("utf-8", errors="replace")
+
+
+def read_ndjson(stream):
+    """Yields (row number, dict or error message) for each non empty line"""
+    bad = set()
+
+    for number, line in enumerate(decoded_lines(stream, bad), start=1):
+        if number in bad:
+            yield number, "Line is not valid UTF-8"
+            continue
+
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+
+        if not isinstance(row, dict):
+            yield number, "Each line must be a JSON object"
+            continue
+
+        yield number, row
+
+
+def parse_csv_tickets(value):
+    tickets = []
+
+    for tier in filter(None, (part.strip() for part in value.split(";"))):
+        parts = tier.split(":")
+
+        if len(parts) != 3:
+            raise ValueError(f"Ticket '{tier}' must look like name:price:available")
+
+        name, price, available = parts
+        tickets.append({"name": name, "price": price, "tickets_available": available})
+
+    return tickets
+
+
+def read_csv(stream):
+    bad = set()
+    reader = csv.DictReader(decoded_lines(stream, bad))
+
+    # reads the header, line 1
+    if reader.fieldnames is None:
+        return
+
+    if bad:
+        yield 1, "Header line is not valid UTF-8"
+        return
+
+    # a quoted value can span lines, a row is bad when any of its lines is
+    last_line = reader.line_num
+    number = 1
+
+    while True:
+        number += 1
+
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            last_line = reader.line_num
+            yield number, f"Invalid CSV: {e}"
+            continue
+
+        lines = range(last_line + 1, reader.line_num + 1)
+        last_line = reader.line_num
+
+        if any(line in bad for line in lines):
+            yield number, "Row is not valid UTF-8"
+            continue
+
+        try:
+            row["tickets"] = parse_csv_tickets(row.get("tickets") or "")
+        except ValueError as e:
+            yield number, str(e)
+            continue
+
+        yield number, row
+
+
+def to_int(value, field, errors, minimum=0):
+    # int(1.5) and int(True) would both pass silently
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        errors.append(f"{field} must be a whole number")
+        return None
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        errors.append(f"{field} must be a whole number")
+        return None
+
+    if number < minimum:
+        errors.append(f"{field} must be at least {minimum}")
+
+    return number
+
+
+def validate_row(row):
+    """Returns (event values, list of ticket values, errors)"""
+    errors = []
+
+    for field in REQUIRED_FIELDS:
+        if row.get(field) in (None, ""):
+            errors.append(f"{field} is required")
+
+    for field in TEXT_FIELDS:
+        if row.get(field) is not None and not isinstance(row[field], str):
+            errors.append(f"{field} must be a string")
+
+    if not isinstance(row.get("tickets") or [], list):
+        errors.append("tickets must be a list")
+
+    if errors:
+        return None, None, errors
+
+    event = {field: row[field] for field in ("name", "description", "venue", "poster")}
+    event["category_id"] = to_int(row["category_id"], "category_id", errors, minimum=1)
+    event["status"] = row.get("status") or "active"
+
+    if event["status"] not in STATUSES:
+        errors.append(f"status must be one of {', '.join(STATUSES)}")
+
+    # same parsing as the Event validators
+    for field in ("start_date", "end_date"):
+        try:
+            event[field] = parse_event_date(row[field])
+        except (TypeError, ValueError):
+            errors.append(f"{field} must look like 2030-01-01T18:00:00Z")
+
+    tickets = []
+    names = set()
+
+    for i, ticket in enumerate(row.get("tickets") or []):
+        if not isinstance(ticket, dict) or not ticket.get("name"):
+            errors.append(f"ticket {i + 1} needs a name")
+            continue
+
+        if not isinstance(ticket["name"], str):
+            errors.append(f"ticket {i + 1} name must be a string")
+            continue
+
+        if ticket["name"] in names:
+            errors.append(f"ticket {ticket['name']} appears twice")
+
+        names.add(ticket["name"])
+        tickets.append(
+            {
+                "name": ticket["name"],
+                "price": to_int(ticket.get("price"), f"ticket {i + 1} price", errors),
+                "tickets_available": to_int(
+                    ticket.get("tickets_available"), f"ticket {i + 1} tickets_available", errors
+                ),
+            }
+        )
+
+    return event, tickets, errors
+
+
+def insert_rows(rows):
+    """Inserts (row number, event values, ticket values) rows, returns how many tickets that was"""
+    event_ids = db.session.execute(
+        insert(Event).returning(Event.id, sort_by_parameter_order=True),
+        [event for _, event, _ in rows],
+    ).scalars().all()
+
+    ticket_rows = [
+        {**ticket, "event_id": event_id}
+        for event_id, (_, _, tickets) in zip(event_ids, rows)
+        for ticket in tickets
+    ]
+
+    if ticket_rows:
+        db.session.execute(insert(Ticket), ticket_rows)
+
+    record_events(event["category_id"] for _, event, _ in rows)
+
+    return len(ticket_rows)
+
+
+def insert_chunk(chunk, report):
+    """chunk is a list of (row number, event values, ticket values)"""
+    category_ids = {event["category_id"] for _, event, _ in chunk}
+    existing = set(
+        db.session.execute(select(Category.id).where(Category.id.in_(category_ids))).scalars()
+    )
+
+    valid = []
+
+    for number, event, tickets in chunk:
+        if event["category_id"] in existing:
+            valid.append((number, event, tickets))
+        else:
+            report.fail(number, [f"category {event['category_id']} does not exist"])
+
+    if not valid:
+        return
+
+    try:
+        report.tickets += insert_rows(valid)
+        db.session.commit()
+        report.events += len(valid)
+        return
+    except DBAPIError:
+        # constraint violations, and values the database won't take
+        db.session.rollback()
+
+    # one bad row shouldn't take the rest of the chunk with it, find it a row at a time
+    for row in valid:
+        try:
+            tickets = insert_rows([row])
+            db.session.commit()
+        except DBAPIError as e:
+            db.session.rollback()
+            report.fail(row[0], [f"Could not save: {e.orig}"])
+            continue
+
+        report.events += 1
+        report.tickets += tickets
+
+
+def import_events(rows, batch_size=IMPORT_BATCH_SIZE):
+    """rows yields (row number, dict or error message), commits every batch_size rows"""
+    report = ImportReport()
+    chunk = []
+
+    for number, row in rows:
+        if isinstance(row, str):
+            report.fail(number, [row])
+            continue
+
+        event, tickets, errors = validate_row(row)
+
+        if errors:
+            report.fail(number, errors)
+            continue
+
+        chunk.append((number, event, tickets))
+
+        if len(chunk) >= batch_size:
+            insert_chunk(chunk, report)
+            chunk = []
+
+    if chunk:
+        insert_chunk(chunk, report)
+
+    return report
@@ -0,0 +1,71 @@
+"""
+Which constraint did an IntegrityError come from?
+
+Rather than SELECTing to check a value is free and then inserting (two round trips,
+and another request can still take the value in between), we insert straight away
+and let the unique constraints decide. The error then has to be mapped back to the
+constraint that failed, which every database reports differently:
+
+    postgres   the driver gives us the name (error.orig.diag.constraint_name)
+    mysql      "Duplicate entry 'x' for key 'users.uq_users_email'"
+    sqlite     "UNIQUE constraint failed: users.email", only the columns, so the
+               name is looked up from the columns in the models' metadata
+"""
+
+import re
+
+from sqlalchemy import UniqueConstraint
+
+from models import db
+
+MYSQL_KEY = re.compile(r"for key '(?:\w+\.)?(\w+)'")
+
+SQLITE_UNIQUE = re.compile(r"UNIQUE constraint failed: (.+)$")
+
+_unique_columns = None
+
+
+def unique_constraints():
+    """{(table, (columns...)): constraint name} for every unique constraint and index"""
+    global _unique_columns
+
+    if _unique_columns is None:
+        found = {}
+
+        for table in db.metadata.tables.values():
+            for constraint in table.constraints:
+                if isinstance(constraint, UniqueConstraint) and constraint.name:
+                    found[(table.name, tuple(column.name for column in constraint.columns))] = str(
+                        constraint.name
+                    )
+
+            for index in table.indexes:
+                if index.unique and index.name:
+                    found[(table.name, tuple(column.name for column in index.columns))] = str(index.name)
+
+        _unique_columns = found
+
+    return _unique_columns
+
+
+def violated_constraint(error):
+    """Returns the name of the constraint behind an IntegrityError, or None when it can't tell"""
+    orig = getattr(error, "orig", error)
+
+    diag = getattr(orig, "diag", None)
+    if diag is not None and getattr(diag, "constraint_name", None):
+        return diag.constraint_name
+
+    message = str(orig)
+
+    match = MYSQL_KEY.search(message)
+    if match:
+        return match.group(1)
+
+    match = SQLITE_UNIQUE.search(message)
+    if match:
+        columns = [part.strip().split(".") for part in match.group(1).split(",")]
+        table = columns[0][0]
+        return unique_constraints().get((table, tuple(column for _, column in columns)))
+
+    return None
@@ -0,0 +1,143 @@
+"""
+Ticket inventory
+
+Stock lives in Ticket.tickets_available. During an on-sale many buyers hit the
+same few rows at once, so we never do "read the count, check it in python, write
+it back" (two buyers can both read 1 and both buy the last ticket).
+
+Instead the check and the decrement happen in one conditional UPDATE:
+
+    UPDATE tickets SET tickets_available = tickets_available - :qty
+    WHERE id = :id AND tickets_available >= :qty
+
+The database applies it atomically, so if the row count is 0 there was not
+enough stock and nothing was changed.
+
+A hold belongs to the buyer who made it and only their checkout can use it. One
+buyer can hold at most RESERVATION_MAX_TICKETS tickets at a time (10 by default),
+so nobody can lock up an event's stock by reserving over and over.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, delete, func, select, update
+
+from models import Reservation, Ticket, db
+
+# how long a hold lasts before the tickets go back to stock
+DEFAULT_RESERVATION_TTL = 600
+
+# how many tickets one buyer can hold at a time, across all their holds
+DEFAULT_MAX_HELD_TICKETS = 10
+
+# how many expired holds to release in one go
+RELEASE_BATCH_SIZE = 500
+
+
+class HoldLimitReached(Exception):
+    def __init__(self, limit):
+        super().__init__(f"You can hold at most {limit} tickets at a time")
+        self.message = str(self)
+
+
+def take_stock(ticket_id, quantity):
+    """Atomically removes quantity from a ticket's stock, returns False when there is not enough"""
+    result = db.session.execute(
+        update(Ticket)
+        .where(Ticket.id == ticket_id, Ticket.tickets_available >= quantity)
+        .values(tickets_available=Ticket.tickets_available - quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+    return result.rowcount == 1
+
+
+def return_stock(quantities):
+    """Puts stock back, {ticket_id: quantity}, one UPDATE however many tickets"""
+    if not quantities:
+        return
+
+    returned = case(quantities, value=Ticket.id)
+
+    db.session.execute(
+        update(Ticket)
+        .where(Ticket.id.in_(quantities.keys()))
+        .values(tickets_available=Ticket.tickets_available + returned)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release_expired(now=None):
+    """
+    Puts the stock of expired holds back and deletes them, up to RELEASE_BATCH_SIZE
+    at a time. It runs on every reserve and checkout, so it's two statements however
+    many holds expired: one DELETE ... RETURNING, one UPDATE for all their tickets.
+
+    Only what a DELETE actually removed is given back, so two requests sweeping at
+    the same time can never return the same hold twice.
+    """
+    now = now or datetime.now()
+
+    expired = select(Reservation.id).where(Reservation.expires_at <= now).limit(RELEASE_BATCH_SIZE)
+
+    rows = db.session.execute(
+        delete(Reservation)
+        .where(Reservation.id.in_(expired.scalar_subquery()))
+        .returning(Reservation.ticket_id, Reservation.quantity)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    quantities = {}
+
+    for ticket_id, quantity in rows:
+        quantities[ticket_id] = quantities.get(ticket_id, 0) + quantity
+
+    return_stock(quantities)
+
+    return len(rows)
+
+
+def held_by(user_id, now=None):
+    """How many tickets the user is holding right now"""
+    now = now or datetime.now()
+
+    return db.session.scalar(
+        select(func.coalesce(func.sum(Reservation.quantity), 0)).where(
+            Reservation.user_id == user_id, Reservation.expires_at > now
+        )
+    )
+
+
+def reserve(user_id, ticket_id, quantity):
+    """
+    Holds quantity tickets for user_id for a limited time.
+    Returns the Reservation, or None when there is not enough stock.
+    Raises HoldLimitReached when the user would be holding too many tickets.
+    The caller is responsible for committing.
+    """
+    # expired holds are released lazily, on the next reservation attempt
+    release_expired()
+
+    # two requests from the same buyer at the same moment can both pass this,
+    # the cap is there to stop one client hoarding the stock, not to be exact
+    limit = current_app.config.get("RESERVATION_MAX_TICKETS", DEFAULT_MAX_HELD_TICKETS)
+
+    if held_by(user_id) + quantity > limit:
+        raise HoldLimitReached(limit)
+
+    if not take_stock(ticket_id, quantity):
+        return None
+
+    ttl = current_app.config.get("RESERVATION_TTL_SECONDS", DEFAULT_RESERVATION_TTL)
+
+    reservation = Reservation(
+        user_id=user_id,
+        ticket_id=ticket_id,
+        quantity=quantity,
+        expires_at=datetime.now() + timedelta(seconds=ttl),
+    )
+
+    db.session.add(reservation)
+
+    return reservation
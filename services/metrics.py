@@ -0,0 +1,240 @@
+"""
+Request metrics
+
+For every request we record, per route:
+    - latency (as a histogram, so we can read p50/p95/p99 off it)
+    - number of SQL statements and the time spent in the database
+    - time spent serializing (model -> dict and dict -> JSON)
+    - response size
+
+They are exposed in the Prometheus text format at GET /metrics. The numbers are
+per worker process, Prometheus adds up the workers when it scrapes each of them.
+
+Set SLOW_REQUEST_MS to log every request slower than that, together with the SQL it ran.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# seconds, roughly doubling, the same spread the prometheus clients default to
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# statements kept per request for the slow request log
+MAX_CAPTURED_STATEMENTS = 50
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = defaultdict(int)
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.response_bytes = 0
+
+
+class Metrics:
+    def __init__(self):
+        self.routes = defaultdict(RouteStats)
+        self.slow_request_ms = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("SLOW_REQUEST_MS", None)
+        self.slow_request_ms = app.config["SLOW_REQUEST_MS"]
+        self.logger = app.logger
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule("/metrics", "metrics", self.export)
+
+        listen_to_engines()
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+        g.serialization_seconds = 0.0
+        g.captured_sql = [] if self.slow_request_ms else None
+
+    def finish_request(self, response):
+        start = g.get("metrics_start")
+
+        if start is None:
+            return response
+
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        size = 0 if response.is_streamed else response.calculate_content_length() or 0
+
+        with self._lock:
+            stats = self.routes[(request.method, route)]
+            stats.latency.observe(elapsed)
+            stats.statuses[response.status_code] += 1
+            stats.sql_statements += g.sql_statements
+            stats.sql_seconds += g.sql_seconds
+            stats.serialization_seconds += g.serialization_seconds
+            stats.response_bytes += size
+
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            self.log_slow_request(route, elapsed, response)
+
+        return response
+
+    def log_slow_request(self, route, elapsed, response):
+        statements = "\n".join(
+            f"  {seconds * 1000:7.1f}ms  {statement}" for statement, seconds in g.captured_sql
+        )
+
+        self.logger.warning(
+            "slow request %s %s (%s) %.0fms, %d statements in %.0fms, serialization %.0fms\n%s",
+            request.method,
+            request.full_path,
+            route,
+            elapsed * 1000,
+            g.sql_statements,
+            g.sql_seconds * 1000,
+            g.serialization_seconds * 1000,
+            statements,
+        )
+
+    def export(self):
+        lines = []
+
+        def metric(name, kind, help):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            routes = sorted(self.routes.items())
+
+            metric("http_requests_total", "counter", "Requests by route and status")
+            for (method, route), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(
+                        f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}'
+                    )
+
+            metric("http_request_duration_seconds", "histogram", "Request latency")
+            for (method, route), stats in routes:
+                labels = f'method="{method}",route="{route}"'
+                for bound, count in stats.latency.cumulative():
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {stats.latency.sum}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats.latency.count}")
+
+            totals = (
+                ("http_request_sql_statements_total", "SQL statements run", "sql_statements"),
+                ("http_request_sql_seconds_total", "Time spent waiting on the database", "sql_seconds"),
+                (
+                    "http_request_serialization_seconds_total",
+                    "Time spent serializing responses",
+                    "serialization_seconds",
+                ),
+                ("http_response_bytes_total", "Response body bytes sent", "response_bytes"),
+            )
+
+            for name, help, attribute in totals:
+                metric(name, "counter", help)
+                for (method, route), stats in routes:
+                    value = getattr(stats, attribute)
+                    lines.append(f'{name}{{method="{method}",route="{route}"}} {value}')
+
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+def add_serialization_time(seconds):
+    if has_request_context() and "serialization_seconds" in g:
+        g.serialization_seconds += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "sql_statements" in g:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or "sql_statements" not in g:
+        return
+
+    starts = conn.info.get("query_start")
+
+    if not starts:
+        return
+
+    elapsed = time.perf_counter() - starts.pop()
+    g.sql_statements += 1
+    g.sql_seconds += elapsed
+
+    captured = g.captured_sql
+
+    if captured is not None and len(captured) < MAX_CAPTURED_STATEMENTS:
+        captured.append((statement, elapsed))
+
+
+def _handle_error(context):
+    # the statement failed, after_cursor_execute won't run for it
+    if context.connection is not None:
+        starts = context.connection.info.get("query_start")
+        if starts:
+            starts.pop()
+
+
+def timed_representation(output):
+    """Wraps a flask_restful representation so encoding counts as serialization time"""
+
+    def wrapper(data, code, headers=None):
+        start = time.perf_counter()
+        response = output(data, code, headers)
+        add_serialization_time(time.perf_counter() - start)
+        return response
+
+    return wrapper
+
+
+_listening = False
+
+
+def listen_to_engines():
+    # on the Engine class so it covers every engine (primary, replica) whenever it's created
+    global _listening
+
+    if not _listening:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _listening = True
+
+
+metrics = Metrics()
@@ -0,0 +1,199 @@
+"""
+M-Pesa (Daraja) API client
+
+Only the calls the payment workers need:
+
+    stk_push(phone, amount, reference)   prompt the customer's phone to pay, returns
+                                         the CheckoutRequestID M-Pesa will answer about
+    query(checkout_request_id)           ask for the result when no callback came
+
+and parse_callback() for the result M-Pesa posts to MPESA_CALLBACK_URL.
+
+These calls can take seconds, so they are never made while handling a request,
+only from the workers in services/payments.py. Point MPESA_URL at
+benchmarks/mpesa_simulator.py to run everything offline.
+"""
+
+import base64
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from datetime import datetime
+
+# "The transaction is being processed", the customer hasn't answered the prompt yet
+STILL_PROCESSING = "500.001.1001"
+
+Result = namedtuple("Result", "checkout_request_id state result_code result_desc mpesa_code")
+
+
+class MpesaError(Exception):
+    def __init__(self, message, retry=True):
+        """retry: False when sending the same request again can't work (a bad request)"""
+        super().__init__(message)
+        self.retry = retry
+
+
+def result_state(result_code):
+    return "paid" if str(result_code) == "0" else "failed"
+
+
+def parse_callback(body):
+    """The stkCallback M-Pesa posts to the callback url, raises ValueError when it isn't one"""
+    try:
+        callback = body["Body"]["stkCallback"]
+        checkout_request_id = callback["CheckoutRequestID"]
+        result_code = callback["ResultCode"]
+    except (KeyError, TypeError):
+        raise ValueError("Not an STK callback")
+
+    # the url is public, anything that isn't shaped like M-Pesa's payload is refused here
+    if not isinstance(callback, dict) or not isinstance(checkout_request_id, str):
+        raise ValueError("Not an STK callback")
+
+    if isinstance(result_code, bool) or not isinstance(result_code, (int, str)):
+        raise ValueError("ResultCode must be a number")
+
+    # only successful payments carry the metadata, the receipt number is in there
+    callback_metadata = callback.get("CallbackMetadata") or {}
+    items = (callback_metadata.get("Item") or []) if isinstance(callback_metadata, dict) else None
+
+    if not isinstance(items, list):
+        raise ValueError("CallbackMetadata must be an object with a list of Item")
+
+    metadata = {item.get("Name"): item.get("Value") for item in items if isinstance(item, dict)}
+    result_desc = callback.get("ResultDesc")
+    receipt = metadata.get("MpesaReceiptNumber")
+
+    return Result(
+        checkout_request_id,
+        result_state(result_code),
+        str(result_code),
+        result_desc if isinstance(result_desc, str) else None,
+        str(receipt) if isinstance(receipt, (str, int)) else None,
+    )
+
+
+class MpesaClient:
+    def __init__(self):
+        self.config = {}
+        self._token = None
+        self._token_expires = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.config = {key: value for key, value in app.config.items() if key.startswith("MPESA_")}
+        self._token = None
+
+    def call(self, method, path, body=None, headers=None):
+        url = self.config["MPESA_URL"].rstrip("/") + path
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+
+        if data is not None:
+            request.add_header("Content-Type", "application/json")
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.config["MPESA_TIMEOUT"]) as response:
+                return json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read() or b"{}")
+            except ValueError:
+                error = {}
+
+            if error.get("errorCode") == STILL_PROCESSING:
+                return error
+
+            # 4xx won't get better by trying again, apart from an expired token
+            if e.code == 401:
+                self._token = None
+            raise MpesaError(
+                f"{e.code} {error.get('errorMessage') or e.reason}", retry=e.code >= 500 or e.code in (401, 429)
+            )
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise MpesaError(f"M-Pesa unreachable: {e}")
+
+    def access_token(self):
+        """OAuth token, shared by all the worker threads until shortly before it expires"""
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._token_expires:
+                key = self.config.get("MPESA_CONSUMER_KEY") or ""
+                secret = self.config.get("MPESA_CONSUMER_SECRET") or ""
+                basic = base64.b64encode(f"{key}:{secret}".encode()).decode()
+
+                response = self.call(
+                    "GET",
+                    "/oauth/v1/generate?grant_type=client_credentials",
+                    headers={"Authorization": f"Basic {basic}"},
+                )
+
+                self._token = response["access_token"]
+                self._token_expires = time.monotonic() + int(response.get("expires_in", 3599)) - 60
+
+            return self._token
+
+    def authorized(self, path, body):
+        return self.call("POST", path, body, headers={"Authorization": f"Bearer {self.access_token()}"})
+
+    def credentials(self):
+        shortcode = self.config["MPESA_SHORTCODE"]
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        password = base64.b64encode(
+            f"{shortcode}{self.config.get('MPESA_PASSKEY') or ''}{timestamp}".encode()
+        ).decode()
+
+        return {"BusinessShortCode": shortcode, "Password": password, "Timestamp": timestamp}
+
+    def stk_push(self, phone, amount, reference, description="Tickets"):
+        # numbers are stored as +254..., the API wants them without the plus
+        phone = phone.lstrip("+")
+
+        response = self.authorized(
+            "/mpesa/stkpush/v1/processrequest",
+            {
+                **self.credentials(),
+                "TransactionType": "CustomerPayBillOnline",
+                "Amount": amount,
+                "PartyA": phone,
+                "PartyB": self.config["MPESA_SHORTCODE"],
+                "PhoneNumber": phone,
+                "CallBackURL": self.config.get("MPESA_CALLBACK_URL"),
+                "AccountReference": str(reference),
+                "TransactionDesc": description,
+            },
+        )
+
+        if str(response.get("ResponseCode")) != "0" or not response.get("CheckoutRequestID"):
+            raise MpesaError(f"STK push refused: {response.get('ResponseDescription')}", retry=False)
+
+        return response["CheckoutRequestID"]
+
+    def query(self, checkout_request_id):
+        """The payment's Result, with state "pending" while the customer hasn't answered"""
+        response = self.authorized(
+            "/mpesa/stkpushquery/v1/query",
+            {**self.credentials(), "CheckoutRequestID": checkout_request_id},
+        )
+
+        if response.get("errorCode") == STILL_PROCESSING:
+            return Result(checkout_request_id, "pending", None, response.get("errorMessage"), None)
+
+        result_code = response.get("ResultCode")
+
+        if result_code is None:
+            raise MpesaError(f"Unexpected query response: {response}")
+
+        return Result(
+            checkout_request_id,
+            result_state(result_code),
+            str(result_code),
+            response.get("ResultDesc"),
+            # Daraja's query doesn't return the receipt, the simulator does
+            response.get("MpesaReceiptNumber"),
+        )
+
+
+mpesa = MpesaClient()
@@ -0,0 +1,57 @@
+"""
+Keyset (cursor) pagination
+
+OFFSET pagination gets slower the deeper you go because the database still has
+to walk past every skipped row. With keyset pagination the client hands back the
+sort key of the last row it saw and we continue with a plain
+WHERE (start_date, id) > (:start_date, :id), which an index can jump straight to.
+
+The cursor is just that sort key, base64 encoded so clients treat it as opaque.
+"""
+
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+CURSOR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def encode_cursor(date, id):
+    raw = f"{date.strftime(CURSOR_DATE_FORMAT)}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (date, id), raises ValueError for anything we didn't hand out"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date, id = raw.split("|")
+        return datetime.strptime(date, CURSOR_DATE_FORMAT), int(id)
+    except (UnicodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValueError("limit must be a number")
+
+    if size < 1:
+        raise ValueError("limit must be at least 1")
+
+    return min(size, MAX_PAGE_SIZE)
+
+
+def after_cursor(date_column, id_column, cursor):
+    """The WHERE clause for rows that come after the cursor in (date, id) order"""
+    date, id = decode_cursor(cursor)
+
+    return or_(date_column > date, and_(date_column == date, id_column > id))
@@ -0,0 +1,141 @@
+"""
+Password hashing
+
+bcrypt is slow on purpose, a single hash takes a few hundred milliseconds of CPU.
+Done inline, a burst of logins ties up every worker thread and the rest of the API
+stalls behind it. So hashing runs on a small dedicated pool:
+
+- at most PASSWORD_HASH_WORKERS hashes run at the same time
+- at most PASSWORD_HASH_QUEUE more can wait for a slot
+- anything beyond that is rejected straight away with HasherBusy (the routes answer 503)
+  instead of piling up
+
+Bulk jobs (hash_many, used by provisioning) get a pool of their own with
+PASSWORD_HASH_BULK_WORKERS threads (2 by default). A 10k user upload then waits its
+turn there and logins keep every worker and queue slot of the main pool.
+
+The cost factor (rounds) is calibrated at startup so one hash takes about
+BCRYPT_TARGET_MS on this machine, unless BCRYPT_LOG_ROUNDS is set explicitly.
+When the cost goes up, old hashes are upgraded on the user's next successful login.
+Hashes are never downgraded, a slower machine (or a worker that calibrated lower)
+leaves the stronger hashes alone.
+
+A hash that doesn't finish within PASSWORD_HASH_TIMEOUT seconds is reported as
+HasherBusy too, the pool is too far behind to answer in time.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from flask_bcrypt import check_password_hash, generate_password_hash
+
+# never go below the bcrypt default of 10 rounds, however slow the machine is
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def calibrate(target_ms, min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS):
+    """Returns the highest cost whose hash still takes at most target_ms"""
+    rounds = min_rounds
+
+    # every extra round doubles the work, so one measurement is enough to extrapolate
+    start = time.perf_counter()
+    generate_password_hash("calibration", min_rounds)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+
+    return rounds
+
+
+def hash_rounds(pw_hash):
+    # bcrypt hashes look like $2b$12$<salt+hash>, the middle part is the cost
+    try:
+        return int(pw_hash.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self):
+        self.rounds = 12
+        self.timeout = 10
+        self._pool = None
+        self._bulk_pool = None
+        self._slots = None
+
+    def init_app(self, app):
+        app.config.setdefault("BCRYPT_LOG_ROUNDS", None)
+        app.config.setdefault("BCRYPT_TARGET_MS", 250)
+        app.config.setdefault("PASSWORD_HASH_WORKERS", 4)
+        app.config.setdefault("PASSWORD_HASH_QUEUE", 32)
+        app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)
+        app.config.setdefault("PASSWORD_HASH_BULK_WORKERS", 2)
+
+        if app.config["BCRYPT_LOG_ROUNDS"]:
+            self.rounds = int(app.config["BCRYPT_LOG_ROUNDS"])
+        else:
+            self.rounds = calibrate(app.config["BCRYPT_TARGET_MS"])
+            app.config["BCRYPT_LOG_ROUNDS"] = self.rounds
+
+        workers = app.config["PASSWORD_HASH_WORKERS"]
+
+        self.timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + app.config["PASSWORD_HASH_QUEUE"])
+        self._bulk_pool = ThreadPoolExecutor(
+            max_workers=app.config["PASSWORD_HASH_BULK_WORKERS"], thread_name_prefix="bcrypt-bulk"
+        )
+
+    def _run(self, fn, *args):
+        if self._pool is None:
+            # not set up (e.g. a script using the models directly), just hash inline
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many requests, please try again shortly")
+
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # the hash keeps its slot until it's done, the caller just stops waiting for it
+            raise HasherBusy("Too many requests, please try again shortly")
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.rounds).decode("utf-8")
+
+    def hash_many(self, passwords):
+        """Hashes a batch on the bulk pool, for admin jobs like bulk provisioning"""
+        if self._bulk_pool is None:
+            return [self.hash(password) for password in passwords]
+
+        # not on the main pool, a big batch there would leave logins nothing but timeouts
+        hashes = self._bulk_pool.map(generate_password_hash, passwords, [self.rounds] * len(passwords))
+        return [pw_hash.decode("utf-8") for pw_hash in hashes]
+
+    def verify(self, pw_hash, password):
+        return self._run(check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        # only ever upwards, otherwise workers calibrated to different costs rehash each other's hashes
+        rounds = hash_rounds(pw_hash)
+        return rounds is None or rounds < self.rounds
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,412 @@
+"""
+M-Pesa payment pipeline
+
+A checkout only writes rows: the payment (pending), its items, and an stk_push job
+in payment_jobs, all in one transaction. Nothing waits on M-Pesa while the request
+is being handled. The slow part happens in the workers (flask payments work):
+
+    1. claim a batch of due jobs (locked_by / locked_until, so several worker
+       processes can share the table and a job of a dead worker is picked up again
+       once its lease runs out)
+    2. run them on a thread pool, the API calls happen outside any transaction
+    3. stk_push: prompt the customer's phone, keep the CheckoutRequestID
+       status_query: ask M-Pesa what happened to a payment we heard nothing about
+    4. errors are retried with exponential backoff, up to PAYMENT_MAX_ATTEMPTS
+
+M-Pesa answers by posting to the callback url (routes/payments.py). settle() applies
+the result and is safe to run any number of times for the same payment:
+
+- a receipt number (mpesa_code) we already have is a repeated callback, nothing to do
+- the payment only moves out of pending once, with a conditional UPDATE, so a
+  callback racing a status query can't count the sale (or give the stock back) twice
+- paid counts the sale in the aggregates, failed puts the tickets back in stock
+
+Callbacks get lost, so every PAYMENT_RECONCILE_SECONDS the workers look for payments
+still pending PAYMENT_STALE_SECONDS after the prompt and queue status queries for
+them in batches. A payment nobody answered for PAYMENT_TIMEOUT_SECONDS fails.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import and_, case, exists, insert, or_, select, update
+
+from models import Event, Payment, PaymentItem, PaymentJob, Ticket, User, db
+from services.mpesa import MpesaError, mpesa
+from services.stats import record_sales
+
+DEFAULTS = {
+    "PAYMENT_WORKERS": 8,
+    "PAYMENT_JOB_BATCH": 50,
+    "PAYMENT_JOB_LEASE_SECONDS": 60,
+    "PAYMENT_MAX_ATTEMPTS": 5,
+    "PAYMENT_RETRY_SECONDS": 2,
+    "PAYMENT_POLL_SECONDS": 1,
+    "PAYMENT_RECONCILE_SECONDS": 30,
+    "PAYMENT_STALE_SECONDS": 60,
+    "PAYMENT_TIMEOUT_SECONDS": 300,
+    "PAYMENT_RECONCILE_BATCH": 500,
+}
+
+
+def setting(name):
+    return current_app.config.get(name, DEFAULTS[name])
+
+
+def enqueue(payment_ids, kind, run_at=None):
+    """Adds a job per payment, in the caller's transaction"""
+    run_at = run_at or datetime.now()
+
+    db.session.execute(
+        insert(PaymentJob),
+        [{"payment_id": payment_id, "kind": kind, "run_at": run_at} for payment_id in payment_ids],
+    )
+
+
+# settling payments
+
+
+def release_stock(payment_id):
+    """Puts a failed payment's tickets back in stock, one UPDATE for all its items"""
+    items = dict(
+        db.session.execute(
+            select(PaymentItem.ticket_id, PaymentItem.quantity).where(PaymentItem.payment_id == payment_id)
+        ).all()
+    )
+
+    if items:
+        db.session.execute(
+            update(Ticket)
+            .where(Ticket.id.in_(items.keys()))
+            .values(tickets_available=Ticket.tickets_available + case(items, value=Ticket.id))
+            .execution_options(synchronize_session=False)
+        )
+
+
+def count_sale(payment_id):
+    lines = db.session.execute(
+        select(PaymentItem.ticket_id, Ticket.event_id, Event.category_id, PaymentItem.quantity, PaymentItem.unit_price)
+        .join(Ticket, Ticket.id == PaymentItem.ticket_id)
+        .join(Event, Event.id == Ticket.event_id)
+        .where(PaymentItem.payment_id == payment_id)
+    ).all()
+
+    record_sales(lines)
+
+
+def finish_payment(condition, state, mpesa_code=None, result_desc=None):
+    """
+    Moves the pending payment matching condition to paid or failed.
+    Returns the payment id, or None when there was no pending payment to move.
+    """
+    payment_id = db.session.execute(select(Payment.id).where(condition)).scalar()
+
+    if payment_id is None:
+        return None
+
+    # only one caller gets a row count of 1, the others see it's no longer pending
+    result = db.session.execute(
+        update(Payment)
+        .where(Payment.id == payment_id, Payment.status == "pending")
+        .values(status=state, mpesa_code=mpesa_code, result_desc=result_desc)
+        .execution_options(synchronize_session=False)
+    )
+
+    if result.rowcount != 1:
+        return None
+
+    if state == "paid":
+        count_sale(payment_id)
+    else:
+        release_stock(payment_id)
+
+    return payment_id
+
+
+def settle(result):
+    """
+    Applies an M-Pesa result (a callback or a status query), the caller commits.
+    Returns "paid", "failed", "duplicate" (already applied) or "unknown" (not our payment).
+    """
+    if result.state == "pending":
+        return "pending"
+
+    if result.mpesa_code and db.session.execute(
+        select(Payment.id).where(Payment.mpesa_code == result.mpesa_code)
+    ).first():
+        return "duplicate"
+
+    condition = Payment.checkout_request_id == result.checkout_request_id
+
+    if finish_payment(condition, result.state, result.mpesa_code, result.result_desc):
+        return result.state
+
+    status = db.session.execute(select(Payment.status).where(condition)).scalar()
+
+    if status is None:
+        return "unknown"
+
+    if status == "failed" and result.state == "paid":
+        # the money came in after we gave up on the payment, someone has to refund it
+        current_app.logger.warning(
+            "M-Pesa payment %s (%s) confirmed after the payment failed",
+            result.mpesa_code,
+            result.checkout_request_id,
+        )
+
+    return "duplicate"
+
+
+def fail_payment(payment_id, reason):
+    return finish_payment(Payment.id == payment_id, "failed", result_desc=reason)
+
+
+# the outbox workers
+
+
+def due_jobs(now):
+    return or_(
+        and_(PaymentJob.status == "pending", PaymentJob.run_at <= now),
+        # a worker that died halfway, its lease has run out
+        and_(PaymentJob.status == "running", PaymentJob.locked_until < now),
+    )
+
+
+def claim_jobs(limit):
+    """Takes up to limit due jobs for this worker, returns [(id, payment_id, kind, attempts, token)]"""
+    now = datetime.now()
+    token = uuid.uuid4().hex
+
+    ids = db.session.execute(
+        select(PaymentJob.id)
+        .where(due_jobs(now))
+        .order_by(PaymentJob.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+
+    if not ids:
+        db.session.rollback()
+        return []
+
+    # the condition is checked again, another worker may have taken some of them meanwhile
+    db.session.execute(
+        update(PaymentJob)
+        .where(PaymentJob.id.in_(ids), due_jobs(now))
+        .values(
+            status="running",
+            locked_by=token,
+            locked_until=now + timedelta(seconds=setting("PAYMENT_JOB_LEASE_SECONDS")),
+            attempts=PaymentJob.attempts + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    jobs = db.session.execute(
+        select(PaymentJob.id, PaymentJob.payment_id, PaymentJob.kind, PaymentJob.attempts, PaymentJob.locked_by)
+        .where(PaymentJob.locked_by == token, PaymentJob.status == "running")
+    ).all()
+    db.session.rollback()
+
+    return jobs
+
+
+def update_job(job, **values):
+    # only while we still hold the lease, otherwise another worker owns the job now
+    db.session.execute(
+        update(PaymentJob)
+        .where(PaymentJob.id == job.id, PaymentJob.locked_by == job.locked_by)
+        .values(locked_by=None, locked_until=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def push(job):
+    row = db.session.execute(
+        select(Payment.status, Payment.amount, User.phone)
+        .join(User, User.id == Payment.user_id)
+        .where(Payment.id == job.payment_id)
+    ).first()
+    # nothing is held open while we wait for M-Pesa
+    db.session.rollback()
+
+    if row is not None and row.status == "pending":
+        checkout_request_id = mpesa.stk_push(row.phone, row.amount, reference=job.payment_id)
+
+        db.session.execute(
+            update(Payment)
+            .where(Payment.id == job.payment_id, Payment.status == "pending")
+            .values(checkout_request_id=checkout_request_id, requested_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+
+
+def query(job):
+    row = db.session.execute(
+        select(Payment.status, Payment.checkout_request_id, Payment.requested_at).where(Payment.id == job.payment_id)
+    ).first()
+    db.session.rollback()
+
+    if row is None or row.status != "pending" or row.checkout_request_id is None:
+        return
+
+    result = mpesa.query(row.checkout_request_id)
+
+    if result.state != "pending":
+        settle(result)
+    elif row.requested_at < datetime.now() - timedelta(seconds=setting("PAYMENT_TIMEOUT_SECONDS")):
+        fail_payment(job.payment_id, "No answer from the customer")
+
+
+HANDLERS = {"stk_push": push, "status_query": query}
+
+
+def run_job(job):
+    """Runs one claimed job and records how it went, returns the job's new status"""
+    try:
+        HANDLERS[job.kind](job)
+        status = "done"
+        update_job(job, status=status, last_error=None)
+    except Exception as e:
+        db.session.rollback()
+
+        retry = not isinstance(e, MpesaError) or e.retry
+
+        if retry and job.attempts < setting("PAYMENT_MAX_ATTEMPTS"):
+            status = "pending"
+            delay = setting("PAYMENT_RETRY_SECONDS") * 2 ** (job.attempts - 1)
+            update_job(job, status=status, run_at=datetime.now() + timedelta(seconds=delay), last_error=str(e))
+        else:
+            status = "failed"
+            update_job(job, status=status, last_error=str(e))
+
+            # the customer was never prompted, the tickets go back on sale
+            if job.kind == "stk_push":
+                fail_payment(job.payment_id, f"Could not reach M-Pesa: {e}")
+
+        if not isinstance(e, MpesaError):
+            current_app.logger.exception("payment job %s failed", job.id)
+
+    db.session.commit()
+    return status
+
+
+def reconcile_pending(batch_size=None):
+    """Queues a status query for every payment still pending long after its prompt, returns how many"""
+    batch_size = batch_size or setting("PAYMENT_RECONCILE_BATCH")
+    stale = datetime.now() - timedelta(seconds=setting("PAYMENT_STALE_SECONDS"))
+
+    open_query = exists().where(
+        PaymentJob.payment_id == Payment.id,
+        PaymentJob.kind == "status_query",
+        PaymentJob.status.in_(("pending", "running")),
+    )
+
+    queued = 0
+    last_id = 0
+
+    while True:
+        ids = db.session.execute(
+            select(Payment.id)
+            .where(
+                Payment.status == "pending",
+                Payment.requested_at <= stale,
+                Payment.id > last_id,
+                ~open_query,
+            )
+            .order_by(Payment.id)
+            .limit(batch_size)
+        ).scalars().all()
+
+        if not ids:
+            break
+
+        enqueue(ids, "status_query")
+        db.session.commit()
+
+        queued += len(ids)
+        last_id = ids[-1]
+
+    db.session.rollback()
+    return queued
+
+
+class PaymentWorker:
+    """
+    Claims jobs and runs them on a thread pool. Each thread has its own app context
+    and so its own session. Run as many worker processes as needed, they share the
+    job table safely.
+    """
+
+    def __init__(self, app, threads=None, batch_size=None):
+        self.app = app
+        self.threads = threads or app.config.get("PAYMENT_WORKERS", DEFAULTS["PAYMENT_WORKERS"])
+        self.batch_size = batch_size or app.config.get("PAYMENT_JOB_BATCH", DEFAULTS["PAYMENT_JOB_BATCH"])
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="payments")
+        self.stopped = threading.Event()
+
+    def _run_job(self, job):
+        with self.app.app_context():
+            return run_job(job)
+
+    def run_once(self):
+        """Claims and runs one batch of jobs, returns {status: count}"""
+        with self.app.app_context():
+            jobs = claim_jobs(self.batch_size)
+
+        counts = {}
+
+        for status in self.pool.map(self._run_job, jobs):
+            counts[status] = counts.get(status, 0) + 1
+
+        return counts
+
+    def run(self):
+        with self.app.app_context():
+            poll = setting("PAYMENT_POLL_SECONDS")
+            every = setting("PAYMENT_RECONCILE_SECONDS")
+
+        next_reconcile = time.monotonic() + every
+
+        while not self.stopped.is_set():
+            if time.monotonic() >= next_reconcile:
+                with self.app.app_context():
+                    reconcile_pending()
+                next_reconcile = time.monotonic() + every
+
+            if not self.run_once():
+                self.stopped.wait(poll)
+
+    def stop(self):
+        self.stopped.set()
+        self.pool.shutdown(wait=True)
+
+
+payments_cli = AppGroup("payments", help="M-Pesa payment workers.")
+
+
+@payments_cli.command("work")
+@click.option("--threads", type=int, help="concurrent M-Pesa calls (PAYMENT_WORKERS)")
+@with_appcontext
+def work_command(threads):
+    """Run the payment workers until interrupted."""
+    worker = PaymentWorker(current_app._get_current_object(), threads=threads)
+    click.echo(f"payment worker running with {worker.threads} threads")
+
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+@payments_cli.command("reconcile")
+def reconcile_command():
+    """Queue status queries for payments M-Pesa hasn't answered about."""
+    click.echo(f"{reconcile_pending()} status queries queued")
@@ -0,0 +1,80 @@
+"""
+Phone number validation
+
+Every User built (signup, bulk provisioning) validates its phone number with the
+phonenumbers library. That is costly in three ways, all handled here:
+
+- importing phonenumbers takes tens of milliseconds, so it only happens on the
+  first number we see, not when the app starts. The library itself then loads the
+  metadata of each region the first time a number from it comes up, so we only ever
+  load the regions our users are actually in.
+- parsing and validating a number runs a pile of regular expressions. The result
+  for a given input never changes, so it is kept in a bounded LRU cache.
+- the same number can be written many ways ("+254 712 345 678", "+254-712345678").
+  We store the E.164 form (+254712345678), so the unique constraint and lookups
+  by phone see one value per number.
+
+    normalize_phone("+254 712 345 678")   # "+254712345678", or raises InvalidPhone
+    validate_phones(column_of_numbers)    # [(e164 or None, error or None), ...]
+"""
+
+from functools import lru_cache
+
+PHONE_CACHE_SIZE = 65536
+
+
+class InvalidPhone(ValueError):
+    pass
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def _check(phone):
+    """Returns (e164, None) or (None, error message), cached so each distinct input is parsed once"""
+    import phonenumbers
+
+    # only international numbers, we don't know which country a local one is from
+    if "+" not in phone:
+        return None, "Must contain plus"
+
+    try:
+        parsed = phonenumbers.parse(phone, None)
+    except phonenumbers.NumberParseException as e:
+        return None, str(e)
+
+    if not phonenumbers.is_valid_number(parsed):
+        return None, "Enter a valid phone number"
+
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164), None
+
+
+def normalize_phone(phone):
+    """Returns the E.164 form of a valid phone number, raises InvalidPhone otherwise"""
+    if not isinstance(phone, str):
+        raise InvalidPhone("Enter a valid phone number")
+
+    e164, error = _check(phone.strip())
+
+    if error:
+        raise InvalidPhone(error)
+
+    return e164
+
+
+def validate_phones(phones):
+    """
+    Validates a whole column of numbers at once, for imports and bulk provisioning.
+    Each distinct number is checked once however often it appears.
+    """
+    results = {}
+
+    for phone in set(phones):
+        try:
+            results[phone] = (normalize_phone(phone), None)
+        except InvalidPhone as e:
+            results[phone] = (None, str(e))
+
+    return [results[phone] for phone in phones]
+
+
+def cache_info():
+    return _check.cache_info()
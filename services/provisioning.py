@@ -0,0 +1,185 @@
+"""
+Bulk user provisioning
+
+Companies onboard their staff in one go, thousands of users at a time. Rows are
+validated in Python and then written PROVISION_BATCH_SIZE at a time, each batch in
+a single transaction:
+
+    1. one SELECT to find which of the batch's emails and phones are already taken
+    2. one executemany INSERT for the rest
+
+Rows that fail (bad email or phone, duplicate in the upload, already registered)
+are skipped and reported back with their position in the list.
+
+Passwords are optional. Hashing thousands of them at a real bcrypt cost takes
+minutes on the hasher's bulk pool (logins don't wait behind it), so for big
+uploads leave them out, those accounts can't log in until a password is set.
+"""
+
+from sqlalchemy import insert, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from models import User, check_email, db
+from services.integrity import violated_constraint
+from services.passwords import password_hasher
+from services.phones import validate_phones
+
+PROVISION_BATCH_SIZE = 2000
+
+MAX_PROVISION_USERS = 10000
+
+# keep the response a reasonable size when a whole upload is bad
+MAX_REPORTED_ERRORS = 1000
+
+# the messages for the users table's unique constraints, signup uses them too
+USER_CONFLICTS = {
+    "uq_users_email": "Email already taken",
+    "uq_users_phone": "Phone number already taken",
+}
+
+
+class ProvisionReport:
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, row, errors):
+        self.failed += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "errors": errors})
+
+    def to_dict(self):
+        return {
+            "created": self.created,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["row"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def validate_user(row, phone):
+    """phone is the (e164, error) validate_phones gave for the row, returns (user values, errors)"""
+    if not isinstance(row, dict):
+        return None, ["Each user must be an object"]
+
+    errors = []
+
+    for field in ("name", "phone", "email"):
+        if not isinstance(row.get(field), str) or not row[field]:
+            errors.append(f"{field} is required")
+
+    if errors:
+        return None, errors
+
+    # the same checks as the User validators
+    try:
+        check_email(row["email"])
+    except ValueError as e:
+        errors.append(str(e))
+
+    e164, phone_error = phone
+
+    if phone_error:
+        errors.append(phone_error)
+
+    password = row.get("password")
+
+    if password is not None and (not isinstance(password, str) or len(password) < 3):
+        errors.append("Password is too short")
+
+    values = {"name": row["name"], "phone": e164, "email": row["email"], "role": "user"}
+
+    return (values, password), errors
+
+
+def insert_batch(batch, report):
+    """batch is a list of (row number, values, password)"""
+    emails = [values["email"] for _, values, _ in batch]
+    phones = [values["phone"] for _, values, _ in batch]
+
+    taken = db.session.execute(
+        select(User.email, User.phone).where(or_(User.email.in_(emails), User.phone.in_(phones)))
+    ).all()
+    taken_emails = {email for email, _ in taken}
+    taken_phones = {phone for _, phone in taken}
+
+    valid = []
+
+    for number, values, password in batch:
+        if values["email"] in taken_emails:
+            report.fail(number, [USER_CONFLICTS["uq_users_email"]])
+        elif values["phone"] in taken_phones:
+            report.fail(number, [USER_CONFLICTS["uq_users_phone"]])
+        else:
+            valid.append((number, values, password))
+
+    if not valid:
+        return
+
+    passwords = [password for _, _, password in valid if password is not None]
+    hashes = iter(password_hasher.hash_many(passwords))
+
+    rows = [
+        {**values, "password": next(hashes) if password is not None else None}
+        for _, values, password in valid
+    ]
+
+    try:
+        db.session.execute(insert(User), rows)
+        db.session.commit()
+    except IntegrityError as e:
+        # somebody registered one of these since the SELECT above
+        db.session.rollback()
+        message = USER_CONFLICTS.get(violated_constraint(e), "Could not save batch")
+
+        for number, _, _ in valid:
+            report.fail(number, [f"{message}, the whole batch was rolled back"])
+
+        return
+
+    report.created += len(rows)
+
+
+def provision_users(rows, batch_size=PROVISION_BATCH_SIZE):
+    """rows is a list of user dicts, phone numbers are stored in E.164 form"""
+    report = ProvisionReport()
+    batch = []
+    seen_emails = set()
+    seen_phones = set()
+
+    # the whole phone column in one go, repeated numbers are only parsed once
+    phones = validate_phones(
+        [row.get("phone") if isinstance(row, dict) and isinstance(row.get("phone"), str) else "" for row in rows]
+    )
+
+    for number, (row, phone) in enumerate(zip(rows, phones), start=1):
+        user, errors = validate_user(row, phone)
+
+        if errors:
+            report.fail(number, errors)
+            continue
+
+        values, password = user
+
+        # duplicates inside the upload would fail the whole batch's INSERT
+        if values["email"] in seen_emails:
+            report.fail(number, ["Email appears more than once in the upload"])
+            continue
+        if values["phone"] in seen_phones:
+            report.fail(number, ["Phone number appears more than once in the upload"])
+            continue
+
+        seen_emails.add(values["email"])
+        seen_phones.add(values["phone"])
+        batch.append((number, values, password))
+
+        if len(batch) >= batch_size:
+            insert_batch(batch, report)
+            batch = []
+
+    if batch:
+        insert_batch(batch, report)
+
+    return report
@@ -0,0 +1,53 @@
+"""
+Counts the SQL statements an engine runs, used to catch N+1 queries creeping back in.
+
+    with count_queries(db.engine) as queries:
+        client.get("/events")
+    print(queries.count, queries.statements)
+
+    with assert_max_queries(db.engine, 3):
+        client.get("/events")
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCount:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    queries = QueryCount()
+    event.listen(engine, "before_cursor_execute", queries.record)
+
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", queries.record)
+
+
+class TooManyQueries(AssertionError):
+    pass
+
+
+@contextmanager
+def assert_max_queries(engine, limit):
+    with count_queries(engine) as queries:
+        yield queries
+
+    if queries.count > limit:
+        listing = "\n".join(queries.statements)
+        raise TooManyQueries(
+            f"expected at most {limit} queries, got {queries.count}:\n{listing}"
+        )
@@ -0,0 +1,236 @@
+"""
+Rate limiting for login, signup and joining a waiting room
+
+Login and signup run bcrypt, so anyone hammering them costs us a lot more CPU than it
+costs them, and a waiting room join is the one request the whole on-sale crowd sends
+at once. Every request takes a token from two buckets:
+
+    per IP        the client address, stops one machine trying many accounts
+    per account   the email in the body (the logged in user for joins), stops many
+                  machines trying one account
+
+A bucket holds up to N tokens and refills at N per period ("5/minute" is a burst of
+5, then one more every 12 seconds). With an empty bucket the request gets a 429 and
+a Retry-After header, before the payload is validated or the users table and the hash
+pool are touched. The IP bucket is checked first and doesn't read the body at all, the
+account bucket reads the email from the body (decoded once, the request schema reuses it).
+
+Stores:
+    MemoryStore   in-process, one entry per key, LRU eviction past RATELIMIT_MAX_KEYS
+    RedisStore    shared between workers, used when RATELIMIT_URL is set (needs the redis package)
+
+Any object with take(key, capacity, rate, cost) can stand in for a shared store,
+pass it as RATELIMIT_STORE (the benchmark does this to simulate the network hop).
+
+Behind a proxy request.remote_addr is the proxy, wrap the app in werkzeug's ProxyFix.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request
+
+from services.schema import json_body
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+DEFAULT_LIMITS = {
+    "RATELIMIT_LOGIN_IP": "20/minute",
+    "RATELIMIT_LOGIN_ACCOUNT": "5/minute",
+    "RATELIMIT_SIGNUP_IP": "10/minute",
+    "RATELIMIT_SIGNUP_ACCOUNT": "3/hour",
+    # a whole office or campus can share one address at an on-sale, so the IP limit is loose
+    "RATELIMIT_JOIN_IP": "120/minute",
+    "RATELIMIT_JOIN_ACCOUNT": "10/minute",
+}
+
+
+def parse_limit(limit):
+    """Turns "5/minute" into (capacity 5, refill rate in tokens per second)"""
+    count, _, period = limit.partition("/")
+
+    try:
+        count = int(count)
+        seconds = PERIODS[period.strip().rstrip("s")]
+    except (KeyError, ValueError):
+        raise ValueError(f"Rate limit '{limit}' must look like 5/minute")
+
+    return count, count / seconds
+
+
+class MemoryStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        """Returns (allowed, seconds until enough tokens are back)"""
+        now = time.monotonic()
+
+        with self._lock:
+            state = self._buckets.get(key)
+
+            if state is None:
+                tokens = capacity
+            else:
+                tokens, updated_at = state
+                tokens = min(capacity, tokens + (now - updated_at) * rate)
+                self._buckets.move_to_end(key)
+
+            allowed = tokens >= cost
+
+            if allowed:
+                tokens -= cost
+
+            self._buckets[key] = (tokens, now)
+
+            # an evicted bucket starts over full, the least recently seen keys are the
+            # ones least likely to be in the middle of an attack
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# refill and take in one step on the redis server, with the server's clock so
+# workers on different machines agree on the time
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+
+tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+
+local allowed = 0
+local retry_after = 0
+
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+
+return {allowed, tostring(retry_after)}
+"""
+
+
+class RedisStore:
+    def __init__(self, url, prefix="ratelimit:"):
+        # only needed when a shared store is configured
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.errors = redis.RedisError
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate, cost=1):
+        try:
+            allowed, retry_after = self._take(keys=[self.prefix + key], args=[capacity, rate, cost])
+        except self.errors:
+            # redis being down shouldn't lock everyone out of their accounts
+            return True, 0.0
+
+        return bool(allowed), float(retry_after)
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self.enabled = True
+        self.limits = {}
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", True)
+        app.config.setdefault("RATELIMIT_URL", None)
+        app.config.setdefault("RATELIMIT_STORE", None)
+        app.config.setdefault("RATELIMIT_MAX_KEYS", 100000)
+
+        for name, limit in DEFAULT_LIMITS.items():
+            app.config.setdefault(name, limit)
+
+        self.enabled = app.config["RATELIMIT_ENABLED"]
+
+        # parsed once here, a typo fails at startup rather than on the first login
+        self.limits = {name: parse_limit(app.config[name]) for name in DEFAULT_LIMITS}
+
+        if app.config["RATELIMIT_STORE"] is not None:
+            self.store = app.config["RATELIMIT_STORE"]
+        elif app.config["RATELIMIT_URL"]:
+            self.store = RedisStore(app.config["RATELIMIT_URL"])
+        else:
+            self.store = MemoryStore(max_keys=app.config["RATELIMIT_MAX_KEYS"])
+
+    def check(self, scope, account_field=None, account=None):
+        """
+        Returns how many seconds the client has to wait, 0 if the request can go ahead.
+        The account is read from the body's account_field, or is whatever account() returns.
+        """
+        prefix = f"RATELIMIT_{scope.upper()}"
+
+        capacity, rate = self.limits[f"{prefix}_IP"]
+        allowed, retry_after = self.store.take(f"{scope}:ip:{request.remote_addr}", capacity, rate)
+
+        if not allowed:
+            return retry_after
+
+        if account is not None:
+            account = account()
+        elif account_field is not None:
+            body = json_body()
+            account = body.get(account_field) if isinstance(body, dict) else None
+
+        if not isinstance(account, str) or not account:
+            # nothing to key on, the request schema will reject it anyway
+            return 0
+
+        capacity, rate = self.limits[f"{prefix}_ACCOUNT"]
+        allowed, retry_after = self.store.take(
+            f"{scope}:account:{account.strip().lower()}", capacity, rate
+        )
+
+        return 0 if allowed else retry_after
+
+    def limit(self, scope, account_field=None, account=None):
+        """Rate limits a Resource method, scope picks the RATELIMIT_<SCOPE>_* limits"""
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    retry_after = self.check(scope, account_field, account)
+
+                    if retry_after:
+                        seconds = max(1, math.ceil(retry_after))
+                        return (
+                            {"message": f"Too many attempts, try again in {seconds} seconds"},
+                            429,
+                            {"Retry-After": str(seconds)},
+                        )
+
+                return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+rate_limiter = RateLimiter()
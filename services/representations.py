@@ -0,0 +1,157 @@
+"""
+Response encoding
+
+flask_restful turns whatever a Resource returns into the response body through the
+representations registered on the Api. The stock output_json runs the standard
+library json.dumps, which is most of the time spent on a big listing once the rows
+are loaded. Here the Api gets:
+
+    application/json      orjson when it's installed, the standard library otherwise
+    application/msgpack   MessagePack, smaller and quicker to decode (needs the msgpack package)
+
+The client picks with the Accept header, anything else (or */*) gets JSON. Errors
+come back in the format that was asked for too.
+
+Both JSON encoders write the same compact output. datetimes and dates come out as
+ISO 8601, enums as their value and Decimals (postgres SUM and AVG) as numbers,
+without a per value callback on orjson. The serializer already turns model datetimes
+into strings, this is for values a handler returns as they are.
+
+    JSON_ENCODER   "orjson" (the default when it's installed) or "json", any name in ENCODERS
+
+In debug mode, or with RESTFUL_JSON settings, the standard library encoder is used
+with those settings, the way output_json did it.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+from flask import current_app, make_response
+
+from services.metrics import timed_representation
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library does the same job a bit slower
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, without it every client gets JSON
+    msgpack = None
+
+JSON = "application/json"
+# application/x-msgpack is the older name, some clients still send it
+MSGPACK = ("application/msgpack", "application/x-msgpack")
+
+
+def default(value):
+    """The values neither encoder knows on its own"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+
+    if isinstance(value, Enum):
+        return value.value
+
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def stdlib_dumps(data):
+    return json.dumps(data, default=default, separators=(",", ":")).encode()
+
+
+ENCODERS = {"json": stdlib_dumps}
+
+if orjson is not None:
+
+    def orjson_dumps(data):
+        # int keys are allowed by json.dumps, orjson needs telling
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    ENCODERS["orjson"] = orjson_dumps
+
+
+def json_encoder():
+    """The JSON_ENCODER of the current app"""
+    return ENCODERS[current_app.config["JSON_ENCODER"]]
+
+
+def output_json(data, code, headers=None):
+    settings = current_app.config.get("RESTFUL_JSON")
+
+    if settings or current_app.debug:
+        settings = dict(settings or {})
+
+        if current_app.debug:
+            settings.setdefault("indent", 4)
+
+        body = json.dumps(data, default=default, **settings).encode()
+    else:
+        body = json_encoder()(data)
+
+    # always end with a new line, like output_json
+    response = make_response(body + b"\n", code)
+    response.headers.extend(headers or {})
+    response.vary.add("Accept")
+
+    return response
+
+
+def mediatypes():
+    """What a response can be encoded as, JSON first (the default)"""
+    return (JSON, *MSGPACK) if msgpack is not None else (JSON,)
+
+
+def negotiate(accept):
+    """The media type to answer with for a werkzeug MIMEAccept, the same pick flask_restful makes"""
+    return accept.best_match(mediatypes(), default=JSON)
+
+
+def representation_etag(etag, mediatype):
+    """
+    The ETag of one encoding of a response. The JSON body keeps the plain one, any other
+    format gets its own, so a msgpack body is never revalidated against a JSON one.
+    """
+    if mediatype == JSON:
+        return etag
+
+    name = mediatype.split("/")[-1]
+
+    return f"{etag}-{name[2:] if name.startswith('x-') else name}"
+
+
+def encode(data, mediatype, encoder):
+    """The body for one of mediatypes(), encoder names the JSON encoder. Used outside flask_restful (asgi.py)"""
+    if mediatype in MSGPACK:
+        return msgpack.packb(data, default=default)
+
+    return ENCODERS[encoder](data) + b"\n"
+
+
+def output_msgpack(data, code, headers=None):
+    response = make_response(encode(data, MSGPACK[0], None), code)
+    response.headers.extend(headers or {})
+    response.vary.add("Accept")
+
+    return response
+
+
+def register_representations(app, api):
+    """Replaces flask_restful's representations on api, encoding counts as serialization time"""
+    app.config.setdefault("JSON_ENCODER", "orjson" if orjson is not None else "json")
+
+    if app.config["JSON_ENCODER"] not in ENCODERS:
+        raise ValueError(
+            f"Unknown JSON_ENCODER {app.config['JSON_ENCODER']}, use one of: {', '.join(ENCODERS)}"
+        )
+
+    api.representations[JSON] = timed_representation(output_json)
+
+    if msgpack is not None:
+        for mediatype in MSGPACK:
+            api.representations[mediatype] = timed_representation(output_msgpack)
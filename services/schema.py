@@ -0,0 +1,190 @@
+"""
+Request schemas
+
+reqparse works out how to handle every argument again on each request: it copies
+the Argument objects, looks for each one in the JSON body, the form and the query
+string, and builds a fresh namespace. Here a schema is turned into a flat tuple of
+(field, converter) pairs once, when the route module is imported, and a request is
+one pass over that tuple against the decoded body.
+
+    signup_schema = Schema(
+        name=Field(str, required="User name is required"),
+        category_id=Field(int),
+        start_date=Field(event_date, required=True),
+    )
+
+    data = signup_schema.parse()   # a plain dict with only the declared fields
+
+- the body is decoded once per request (orjson when it's installed) and shared
+  with anything else that reads it, like the rate limiter
+- values come out already converted: ints are ints, event dates are datetimes,
+  so the model validators don't parse them a second time
+- every problem in the payload is reported at once, as a 422:
+    {"message": "Invalid request", "errors": {"price": "must be a whole number", ...}}
+
+JSON bodies are read, and form posts too (the values come in as strings and are
+converted the same way). The query string is not looked at.
+"""
+
+import json
+
+from flask import g, request
+from flask_restful import abort
+
+from models import parse_event_date
+
+try:
+    import orjson
+
+    decode_json = orjson.loads
+except ImportError:  # optional, the standard library does the same job a bit slower
+    decode_json = json.loads
+
+MISSING = object()
+
+
+def json_body():
+    """The request body as a dict, decoded once per request. None when there's no usable body"""
+    if "json_body" not in g:
+        body = None
+
+        if request.is_json:
+            try:
+                body = decode_json(request.get_data(cache=True))
+            except ValueError:
+                body = None
+        elif request.form:
+            body = request.form.to_dict()
+
+        g.json_body = body
+
+    return g.json_body
+
+
+# converters take the raw value and return the converted one or raise ValueError
+
+
+def to_str(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # reqparse's type=str did the same
+        return str(value)
+    raise ValueError("must be a string")
+
+
+def to_int(value):
+    if isinstance(value, bool):
+        raise ValueError("must be a whole number")
+    if isinstance(value, int):
+        return value
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("must be a whole number")
+
+
+def event_date(value):
+    try:
+        return parse_event_date(value)
+    except (TypeError, ValueError):
+        raise ValueError("must look like 2030-01-01T18:00:00Z")
+
+
+def list_of(item):
+    """A JSON list whose items all go through the item converter"""
+
+    def convert(value):
+        if not isinstance(value, list):
+            raise ValueError("must be a list")
+        return [item(element) for element in value]
+
+    return convert
+
+
+def to_dict(value):
+    if not isinstance(value, dict):
+        raise ValueError("must be an object")
+    return value
+
+
+class Field:
+    def __init__(self, type=to_str, required=False, default=None, choices=None, minimum=None):
+        """
+        type: a converter, str and int are accepted as shorthands
+        required: True, or the message to give when the field is missing
+        """
+        self.type = {str: to_str, int: to_int, dict: to_dict}.get(type, type)
+        self.required = required
+        self.default = default
+        self.choices = tuple(choices) if choices else None
+        self.minimum = minimum
+
+    def compile(self, name):
+        convert = self.type
+        choices = self.choices
+        minimum = self.minimum
+
+        if choices is not None:
+            inner = convert
+
+            def convert(value):
+                value = inner(value)
+                if value not in choices:
+                    raise ValueError(f"must be one of {', '.join(map(str, choices))}")
+                return value
+
+        if minimum is not None:
+            inner_minimum = convert
+
+            def convert(value):
+                value = inner_minimum(value)
+                if value < minimum:
+                    raise ValueError(f"must be at least {minimum}")
+                return value
+
+        missing = self.required if isinstance(self.required, str) else f"{name} is required"
+
+        return name, convert, bool(self.required), missing, self.default
+
+
+class Schema:
+    def __init__(self, **fields):
+        # compiled here, once, parse() only walks this tuple
+        self.fields = tuple(field.compile(name) for name, field in fields.items())
+
+    def load(self, body):
+        """Returns (data, errors) for an already decoded body"""
+        if not isinstance(body, dict):
+            return None, {"body": "must be a JSON object"}
+
+        data = {}
+        errors = {}
+
+        for name, convert, required, missing, default in self.fields:
+            value = body.get(name, MISSING)
+
+            if value is MISSING or value is None or value == "":
+                if required:
+                    errors[name] = missing
+                else:
+                    data[name] = default
+                continue
+
+            try:
+                data[name] = convert(value)
+            except ValueError as e:
+                message = str(e)
+                errors[name] = message if message.startswith(name) else f"{name} {message}"
+
+        return data, errors
+
+    def parse(self):
+        """Validates the current request's body, aborts with a 422 listing every error"""
+        data, errors = self.load(json_body())
+
+        if errors:
+            abort(422, message="Invalid request", errors=errors)
+
+        return data
@@ -0,0 +1,165 @@
+"""
+Event search
+
+On sqlite the events are indexed with FTS5. events_fts is an "external content"
+table: it only stores the search index and reads the text from the events table,
+and three triggers keep it up to date on every insert, update and delete, so the
+index is maintained incrementally in the same transaction as the write (this also
+covers the bulk import, which inserts with plain INSERT statements).
+
+Results are ranked with bm25, a name match counts more than a venue match, which
+counts more than a match in the description. The last word is matched as a prefix
+("nai" finds "Nairobi") so search-as-you-type works.
+
+Other databases fall back to a LIKE scan until they get their own index.
+"""
+
+import re
+
+from sqlalchemy import DDL, column, event, literal_column, or_, select, table
+
+from models import Event, db
+
+FTS_TABLE = "events_fts"
+
+# bm25 weights for name, description, venue
+RANK_WEIGHTS = (10.0, 1.0, 3.0)
+
+MAX_RESULTS = 100
+
+FTS_DDL = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, venue,
+        content='events', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, venue)
+        VALUES (new.id, new.name, new.description, new.venue);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, venue)
+        VALUES ('delete', old.id, old.name, old.description, old.venue);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE OF name, description, venue ON events BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, venue)
+        VALUES ('delete', old.id, old.name, old.description, old.venue);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, venue)
+        VALUES (new.id, new.name, new.description, new.venue);
+    END
+    """,
+    # index whatever is already in the events table
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+DROP_DDL = (
+    "DROP TRIGGER IF EXISTS events_fts_insert",
+    "DROP TRIGGER IF EXISTS events_fts_delete",
+    "DROP TRIGGER IF EXISTS events_fts_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+# db.create_all() (benchmarks, fresh databases) builds the index too, migrations do it for existing ones
+for statement in FTS_DDL:
+    event.listen(Event.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
+for statement in DROP_DDL:
+    event.listen(Event.__table__, "before_drop", DDL(statement).execute_if(dialect="sqlite"))
+
+
+def exclude_search_tables(object, name, type_, reflected, compare_to):
+    """Keeps alembic autogenerate from trying to drop the FTS tables, they are not in the models"""
+    return not (type_ == "table" and name.startswith(FTS_TABLE))
+
+
+def words(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def fts_query(query, prefix=True):
+    """
+    Turns user input into an FTS5 query. Every word is quoted so characters like
+    " - * : in the input can't change the meaning of the query, all words must match.
+    """
+    terms = [f'"{word}"' for word in words(query)]
+
+    if terms and prefix:
+        terms[-1] += "*"
+
+    return " ".join(terms)
+
+
+SUMMARY_COLUMNS = (
+    Event.id,
+    Event.name,
+    Event.venue,
+    Event.status,
+    Event.category_id,
+    Event.start_date,
+    Event.end_date,
+    Event.poster,
+)
+
+
+def _fts_search(query, category_id, limit, prefix):
+    match = fts_query(query, prefix)
+
+    if not match:
+        return []
+
+    weights = ", ".join(str(weight) for weight in RANK_WEIGHTS)
+    # lower bm25 is better. not called "rank", fts5 tables already have a hidden column by that name
+    score = literal_column(f"bm25({FTS_TABLE}, {weights})").label("score")
+    fts = table(FTS_TABLE, column("rowid"))
+
+    statement = (
+        select(*SUMMARY_COLUMNS, score)
+        .select_from(fts)
+        .join(Event, Event.id == fts.c.rowid)
+        .where(literal_column(FTS_TABLE).op("MATCH")(match))
+        .order_by(score)
+        .limit(limit)
+    )
+
+    if category_id is not None:
+        statement = statement.where(Event.category_id == category_id)
+
+    return db.session.execute(statement).all()
+
+
+def _like_search(query, category_id, limit, prefix):
+    conditions = []
+
+    for word in words(query):
+        pattern = f"%{word}%"
+        conditions.append(
+            or_(Event.name.ilike(pattern), Event.description.ilike(pattern), Event.venue.ilike(pattern))
+        )
+
+    if not conditions:
+        return []
+
+    statement = select(*SUMMARY_COLUMNS).where(*conditions).order_by(Event.start_date).limit(limit)
+
+    if category_id is not None:
+        statement = statement.where(Event.category_id == category_id)
+
+    return db.session.execute(statement).all()
+
+
+def search_events(query, category_id=None, limit=20, prefix=True):
+    """Returns summary rows of the best matching events, best first"""
+    limit = max(1, min(limit, MAX_RESULTS))
+
+    if db.session.get_bind().dialect.name == "sqlite":
+        return _fts_search(query, category_id, limit, prefix)
+
+    return _like_search(query, category_id, limit, prefix)
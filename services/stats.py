@@ -0,0 +1,243 @@
+"""
+Sales aggregates
+
+Counting a category's events, or the tickets sold and revenue of an event, from the
+base tables means a GROUP BY over events or payment_items every time. Instead the
+totals are kept in category_stats, event_stats and ticket_stats and bumped in the
+same transaction as the rows they count, so they commit or roll back together:
+
+    event created      category_stats.event_count += 1
+    payment confirmed  tickets_sold and revenue += the cart, for every tier, event
+                       and category in it (one upsert per table, whatever the cart size)
+
+Reading a total is then a primary key lookup. A missing row means nothing counted yet.
+
+Anything that writes the base tables some other way (a manual fix, the seed script,
+a bug) makes the totals drift, so reconcile() recomputes them from the base tables
+in batches of RECONCILE_BATCH_SIZE and corrects the rows that are off:
+
+    flask stats reconcile
+"""
+
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+
+from models import (
+    Category,
+    CategoryStats,
+    Event,
+    EventStats,
+    Payment,
+    PaymentItem,
+    Ticket,
+    TicketStats,
+    db,
+)
+
+RECONCILE_BATCH_SIZE = 500
+
+SALES = ("tickets_sold", "revenue")
+
+
+# built once per table, putting the ON CONFLICT clause together costs more than running it
+_increments = {}
+
+
+def increment_statement(model, amounts):
+    """INSERT ... ON CONFLICT (primary key) DO UPDATE SET amount = amount + the new value"""
+    dialect = db.session.get_bind().dialect.name
+    cache_key = (model, dialect, amounts)
+
+    if cache_key not in _increments:
+        table = model.__table__
+
+        # each dialect spells "insert or update" differently
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+
+            stmt = insert(table)
+            stmt = stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in amounts})
+        else:
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(table.primary_key.columns),
+                set_={name: table.c[name] + stmt.excluded[name] for name in amounts},
+            )
+
+        _increments[cache_key] = stmt
+
+    return _increments[cache_key]
+
+
+def increment(model, rows, amounts):
+    """
+    Adds to the totals of many rows in one executemany statement, creating the
+    rows that don't exist yet. rows are dicts of the primary key and the amounts.
+    The addition happens in the database, so concurrent increments don't get lost.
+    """
+    if rows:
+        db.session.execute(increment_statement(model, tuple(amounts)), rows)
+
+
+def record_events(category_ids):
+    """Counts newly created events, call it before committing them"""
+    counts = Counter(category_ids)
+
+    increment(
+        CategoryStats,
+        [{"category_id": category_id, "event_count": count} for category_id, count in counts.items()],
+        ("event_count",),
+    )
+
+
+def record_sales(lines):
+    """
+    Counts a paid checkout, call it before committing the payment.
+    lines are (ticket_id, event_id, category_id, quantity, unit_price)
+    """
+    tickets = {}
+    events = {}
+    categories = {}
+
+    for ticket_id, event_id, category_id, quantity, unit_price in lines:
+        for totals, key in ((tickets, ticket_id), (events, event_id), (categories, category_id)):
+            sold, revenue = totals.get(key, (0, 0))
+            totals[key] = (sold + quantity, revenue + quantity * unit_price)
+
+    for model, key, totals in (
+        (TicketStats, "ticket_id", tickets),
+        (EventStats, "event_id", events),
+        (CategoryStats, "category_id", categories),
+    ):
+        increment(
+            model,
+            [{key: id, "tickets_sold": sold, "revenue": revenue} for id, (sold, revenue) in totals.items()],
+            SALES,
+        )
+
+
+# reconciliation
+
+
+def sales_by(column, ids):
+    """tickets_sold and revenue of the paid payment_items, grouped by column, for the given ids"""
+    return (
+        select(
+            column.label("key"),
+            func.sum(PaymentItem.quantity).label("tickets_sold"),
+            func.sum(PaymentItem.quantity * PaymentItem.unit_price).label("revenue"),
+        )
+        .select_from(PaymentItem)
+        .join(Payment, Payment.id == PaymentItem.payment_id)
+        .join(Ticket, Ticket.id == PaymentItem.ticket_id)
+        .join(Event, Event.id == Ticket.event_id)
+        .where(column.in_(ids), Payment.status == "paid")
+        .group_by(column)
+        .subquery()
+    )
+
+
+def event_counts(ids):
+    return (
+        select(Event.category_id.label("key"), func.count().label("event_count"))
+        .where(Event.category_id.in_(ids))
+        .group_by(Event.category_id)
+        .subquery()
+    )
+
+
+# stats model, the id of the rows it aggregates, and what it's grouped by in the base tables
+TARGETS = {
+    "categories": (CategoryStats, Category.id, Event.category_id),
+    "events": (EventStats, Event.id, Ticket.event_id),
+    "tickets": (TicketStats, Ticket.id, PaymentItem.ticket_id),
+}
+
+
+def reconcile_batch(model, parent_id, group_by, ids):
+    """Returns how many rows of the batch were off (and have been corrected)"""
+    key = model.__table__.primary_key.columns.values()[0]
+    amounts = [name for name in model.__table__.c.keys() if name != key.name]
+
+    sales = sales_by(group_by, ids)
+    subqueries = [sales]
+    actual = {name: sales.c[name] for name in SALES}
+
+    if "event_count" in amounts:
+        counts = event_counts(ids)
+        subqueries.append(counts)
+        actual["event_count"] = counts.c.event_count
+
+    # stored and actual values in one statement, so they come from the same snapshot
+    query = select(
+        parent_id,
+        *(func.coalesce(model.__table__.c[name], 0) for name in amounts),
+        *(func.coalesce(actual[name], 0) for name in amounts),
+    ).outerjoin(model, key == parent_id)
+
+    for subquery in subqueries:
+        query = query.outerjoin(subquery, subquery.c.key == parent_id)
+
+    fixes = []
+
+    for row in db.session.execute(query.where(parent_id.in_(ids))):
+        stored = row[1 : 1 + len(amounts)]
+        expected = row[1 + len(amounts) :]
+
+        if tuple(stored) != tuple(expected):
+            # applied as a difference, a payment confirmed meanwhile still counts
+            fix = {key.name: row[0]}
+            fix.update({name: e - s for name, s, e in zip(amounts, stored, expected)})
+            fixes.append(fix)
+
+    increment(model, fixes, amounts)
+    return len(fixes)
+
+
+def reconcile(batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Recomputes every aggregate from the base tables, one batch of ids per transaction.
+    Returns {"categories": {"checked": n, "fixed": n}, "events": ..., "tickets": ...}
+    """
+    report = {}
+
+    for name, (model, parent_id, group_by) in TARGETS.items():
+        checked = fixed = 0
+        last_id = 0
+
+        while True:
+            ids = db.session.execute(
+                select(parent_id).where(parent_id > last_id).order_by(parent_id).limit(batch_size)
+            ).scalars().all()
+
+            if not ids:
+                break
+
+            fixed += reconcile_batch(model, parent_id, group_by, ids)
+            db.session.commit()
+
+            checked += len(ids)
+            last_id = ids[-1]
+
+        report[name] = {"checked": checked, "fixed": fixed}
+
+    return report
+
+
+stats_cli = AppGroup("stats", help="Sales aggregates.")
+
+
+@stats_cli.command("reconcile")
+@click.option("--batch-size", default=RECONCILE_BATCH_SIZE, show_default=True)
+def reconcile_command(batch_size):
+    """Recompute the sales aggregates from the base tables and fix any drift."""
+    for name, result in reconcile(batch_size).items():
+        click.echo(f"{name}: {result['checked']} checked, {result['fixed']} fixed")
@@ -0,0 +1,366 @@
+"""
+Waiting room for on-sales
+
+When a big event goes on sale the whole crowd hits reserve and checkout in the same
+second, and every one of those requests is work for the database. With a waiting
+room open for the event, buyers first take a number and are let through at a fixed
+rate, so the database only ever sees that many buyers per second however big the
+crowd gets:
+
+    POST   /events/<id>/queue    take a number, returns a signed queue token
+    GET    /events/<id>/queue    position and estimated wait for the X-Queue-Token,
+                                 answered from the store alone, no database at all
+    PUT    /events/<id>/queue    (admin) open the room: {"rate": 20, "burst": 100}
+    DELETE /events/<id>/queue    (admin) close it, everyone goes straight through again
+
+Reserve and checkout for the event's tickets then need an admitted X-Queue-Token
+(several tokens, one per event, can be sent separated by commas).
+
+Queue positions are FIFO and take three numbers per room:
+
+    joined     the last number handed out
+    served     numbers up to this one are in, it moves forward by rate per second
+    updated    when served was last moved
+
+A buyer's position is their number minus served. served never gets more than
+burst ahead of joined, so after a quiet spell only burst buyers walk straight in.
+
+Each account gets one number per room, joining again hands back the same number,
+so looping the endpoint can't hoard early places. That's the one entry per buyer
+the room keeps. Joining is rate limited too (RATELIMIT_JOIN_*, see services/ratelimit.py).
+
+The token is signed (itsdangerous) and carries the event, the number and the buyer,
+so it can't be forged, moved to another event or passed to another account, and
+checking it needs no lookup. The app won't start without a secret to sign it with,
+WAITING_ROOM_SECRET or else JWT_SECRET_KEY.
+
+Stores:
+    MemoryStore   in-process, only right with a single worker process
+    RedisStore    shared between workers, used when WAITING_ROOM_URL is set (needs the redis package)
+
+Any object with the MemoryStore methods can be passed as WAITING_ROOM_STORE.
+"""
+
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+TOKEN_HEADER = "X-Queue-Token"
+
+# how often a buyer is told to check their position, further back means less often
+MIN_POLL_SECONDS = 1
+MAX_POLL_SECONDS = 30
+
+
+class Room:
+    __slots__ = ("rate", "burst", "tickets", "joined", "served", "updated", "numbers")
+
+    def __init__(self, rate, burst, tickets, now):
+        self.rate = rate
+        self.burst = burst
+        self.tickets = tickets
+        self.joined = 0
+        # the first burst buyers go straight in
+        self.served = float(burst)
+        self.updated = now
+        # user id -> their number
+        self.numbers = {}
+
+    def advance(self, now):
+        self.served = min(self.served + (now - self.updated) * self.rate, self.joined + self.burst)
+        self.updated = now
+        return self.served
+
+
+class MemoryStore:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._rooms = {}
+        # ticket id -> event id, for the tickets of every open room
+        self._tickets = {}
+        self._lock = threading.Lock()
+
+    def open(self, event_id, rate, burst, ticket_ids):
+        with self._lock:
+            self._close(event_id)
+            self._rooms[event_id] = Room(rate, burst, tuple(ticket_ids), self.clock())
+            self._tickets.update((ticket_id, event_id) for ticket_id in ticket_ids)
+
+    def _close(self, event_id):
+        room = self._rooms.pop(event_id, None)
+
+        if room is not None:
+            for ticket_id in room.tickets:
+                self._tickets.pop(ticket_id, None)
+
+    def close(self, event_id):
+        with self._lock:
+            self._close(event_id)
+
+    def gated_events(self, ticket_ids):
+        """The events with an open room among these tickets' events"""
+        if not self._tickets:
+            return set()
+
+        return {self._tickets[t] for t in ticket_ids if t in self._tickets}
+
+    def join(self, event_id, user_id):
+        """Returns (number, rate), or None when the event has no open room. Same user, same number."""
+        with self._lock:
+            room = self._rooms.get(event_id)
+
+            if room is None:
+                return None
+
+            room.advance(self.clock())
+
+            if user_id not in room.numbers:
+                room.joined += 1
+                room.numbers[user_id] = room.joined
+
+            return room.numbers[user_id], room.rate
+
+    def served(self, event_id):
+        """Returns (served, rate), or None when the event has no open room"""
+        with self._lock:
+            room = self._rooms.get(event_id)
+
+            if room is None:
+                return None
+
+            return math.floor(room.advance(self.clock())), room.rate
+
+
+# moves served forward and hands out a number in one step on the redis server,
+# with the server's clock so every worker agrees on who is in.
+# KEYS[2] is the room's user id -> number hash, a buyer who already has a number keeps it
+ADVANCE_SCRIPT = """
+local room = redis.call('HMGET', KEYS[1], 'rate', 'burst', 'joined', 'served', 'updated')
+
+if not room[1] then
+    return false
+end
+
+local rate = tonumber(room[1])
+local burst = tonumber(room[2])
+local joined = tonumber(room[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local served = math.min(tonumber(room[4]) + (now - tonumber(room[5])) * rate, joined + burst)
+local number = false
+
+if ARGV[1] == 'join' then
+    number = tonumber(redis.call('HGET', KEYS[2], ARGV[2]))
+
+    if not number then
+        joined = joined + 1
+        number = joined
+        redis.call('HSET', KEYS[2], ARGV[2], number)
+    end
+end
+
+redis.call('HSET', KEYS[1], 'joined', joined, 'served', tostring(served), 'updated', tostring(now))
+
+if number then
+    return {number, room[1]}
+end
+
+return {math.floor(served), room[1]}
+"""
+
+
+class RedisStore:
+    def __init__(self, url, prefix="waitingroom:", refresh=2):
+        # only needed when a shared store is configured
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._advance = self.client.register_script(ADVANCE_SCRIPT)
+        # the ticket -> event map is read on every reserve and checkout,
+        # each worker keeps a copy for refresh seconds
+        self.refresh = refresh
+        self._tickets = {}
+        self._loaded_at = 0
+
+    def open(self, event_id, rate, burst, ticket_ids):
+        self.close(event_id)
+
+        pipe = self.client.pipeline()
+        pipe.hset(
+            f"{self.prefix}{event_id}",
+            mapping={"rate": rate, "burst": burst, "joined": 0, "served": burst, "updated": time.time()},
+        )
+        if ticket_ids:
+            pipe.hset(f"{self.prefix}tickets", mapping={ticket_id: event_id for ticket_id in ticket_ids})
+        pipe.execute()
+        self._loaded_at = 0
+
+    def close(self, event_id):
+        tickets = self.client.hgetall(f"{self.prefix}tickets")
+        stale = [ticket_id for ticket_id, owner in tickets.items() if int(owner) == event_id]
+
+        pipe = self.client.pipeline()
+        pipe.delete(f"{self.prefix}{event_id}", f"{self.prefix}{event_id}:numbers")
+        if stale:
+            pipe.hdel(f"{self.prefix}tickets", *stale)
+        pipe.execute()
+        self._loaded_at = 0
+
+    def gated_events(self, ticket_ids):
+        if time.monotonic() - self._loaded_at > self.refresh:
+            self._tickets = {int(t): int(e) for t, e in self.client.hgetall(f"{self.prefix}tickets").items()}
+            self._loaded_at = time.monotonic()
+
+        return {self._tickets[t] for t in ticket_ids if t in self._tickets}
+
+    def _run(self, event_id, action, user_id=""):
+        room = f"{self.prefix}{event_id}"
+        result = self._advance(keys=[room, f"{room}:numbers"], args=[action, user_id])
+        return None if result is None else (int(result[0]), float(result[1]))
+
+    def join(self, event_id, user_id):
+        return self._run(event_id, "join", user_id)
+
+    def served(self, event_id):
+        return self._run(event_id, "served")
+
+
+class WaitingRoom:
+    def __init__(self, store=None):
+        self.store = store or MemoryStore()
+        self.serializer = None
+
+    def init_app(self, app):
+        app.config.setdefault("WAITING_ROOM_URL", None)
+        app.config.setdefault("WAITING_ROOM_STORE", None)
+        app.config.setdefault("WAITING_ROOM_SECRET", app.config.get("JWT_SECRET_KEY"))
+        # a number is good for this long, long enough to sit out any on-sale
+        app.config.setdefault("WAITING_ROOM_TOKEN_MAX_AGE", 6 * 3600)
+
+        if app.config["WAITING_ROOM_STORE"] is not None:
+            self.store = app.config["WAITING_ROOM_STORE"]
+        elif app.config["WAITING_ROOM_URL"]:
+            self.store = RedisStore(app.config["WAITING_ROOM_URL"])
+        else:
+            self.store = MemoryStore()
+
+        if not app.config["WAITING_ROOM_SECRET"]:
+            # signed with "" anyone could mint an admitted token
+            raise RuntimeError("Set WAITING_ROOM_SECRET or JWT_SECRET_KEY, the queue tokens are signed with it")
+
+        self.max_age = app.config["WAITING_ROOM_TOKEN_MAX_AGE"]
+        self.serializer = URLSafeTimedSerializer(app.config["WAITING_ROOM_SECRET"], salt="waiting-room")
+
+    def open(self, event_id, rate, burst, ticket_ids):
+        self.store.open(event_id, rate, burst, ticket_ids)
+
+    def close(self, event_id):
+        self.store.close(event_id)
+
+    def join(self, event_id, user_id):
+        """
+        Returns (signed token, status dict), or None when the event has no open room.
+        A user who joins again gets their old number back.
+        """
+        joined = self.store.join(event_id, user_id)
+
+        if joined is None:
+            return None
+
+        number, _ = joined
+        token = self.serializer.dumps({"e": event_id, "n": number, "u": user_id})
+
+        return token, self.status(event_id, number)
+
+    def read_token(self, token):
+        """The token's (event id, number, user id), None when it's forged or too old"""
+        try:
+            data = self.serializer.loads(token, max_age=self.max_age)
+            return data["e"], data["n"], data["u"]
+        except (BadSignature, KeyError, TypeError):
+            return None
+
+    def status(self, event_id, number):
+        """None when the room has been closed (everyone goes through)"""
+        served = self.store.served(event_id)
+
+        if served is None:
+            return None
+
+        served, rate = served
+        ahead = max(0, number - served)
+        wait = ahead / rate if rate else None
+
+        return {
+            "event_id": event_id,
+            "number": number,
+            "position": ahead,
+            "admitted": ahead == 0,
+            "estimated_wait_seconds": None if wait is None else math.ceil(wait),
+            # further back polls less often, the status endpoint stays cheap as the crowd grows
+            "poll_after_seconds": 0 if ahead == 0 else int(min(MAX_POLL_SECONDS, max(MIN_POLL_SECONDS, (wait or 0) / 4))),
+        }
+
+    def check(self, ticket_ids):
+        """Returns None when the request may go ahead, otherwise (message, status, headers)"""
+        events = self.store.gated_events(ticket_ids)
+
+        if not events:
+            return None
+
+        # the token belongs to one account, the queue only applies to logged in buyers
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+
+        if user_id is None:
+            return {"message": "Log in and join the queue for this event"}, 401, {}
+
+        tokens = {}
+
+        for token in request.headers.get(TOKEN_HEADER, "").split(","):
+            data = self.read_token(token.strip()) if token.strip() else None
+
+            if data is not None and data[2] == user_id:
+                tokens[data[0]] = data[1]
+
+        for event_id in events:
+            if event_id not in tokens:
+                return {"message": "Join the queue for this event first", "event_id": event_id}, 428, {}
+
+            status = self.status(event_id, tokens[event_id])
+
+            if status is not None and not status["admitted"]:
+                retry_after = str(max(1, status["poll_after_seconds"]))
+                return {"message": "Still in the queue", **status}, 429, {"Retry-After": retry_after}
+
+        return None
+
+    def guard(self, tickets):
+        """
+        Lets a Resource method through only for buyers the queue has admitted.
+        tickets(**kwargs) gives the ticket ids the request is about.
+        """
+
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                refused = self.check(tickets(**kwargs))
+
+                if refused is not None:
+                    return refused
+
+                return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+waiting_room = WaitingRoom()